@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+"""
+Benchmark for the :py:class:`BackupDatabase` cache used by the base historian.
+
+Fills a cache with a backlog of device scrapes and then drains it the same
+way the historian publish loop does after an outage, reporting how long each
+part of the backlog took. Drain time per batch should not grow with the size
+of the backlog.
+
+    python backup_cache_benchmark.py --rows=10000000 --points=500
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from volttron.platform.agent.base_historian import (BackupDatabase,
+                                                    ScrapeRecord,
+                                                    _BatchPrefetcher)
+
+
+class _Owner(object):
+    pass
+
+
+def fill(backupdb, rows, points, scrapes_per_call):
+    values = dict(('Point{}'.format(i), float(i)) for i in range(points))
+    meta = dict((name, {'units': 'F', 'type': 'float', 'tz': 'UTC'})
+                for name in values)
+    timestamp = datetime(2017, 1, 1, tzinfo=pytz.UTC)
+    written = 0
+    start = time.time()
+    while written < rows:
+        scrapes = []
+        for _ in range(scrapes_per_call):
+            timestamp += timedelta(seconds=1)
+            headers = {'Date': timestamp.isoformat(),
+                       'TimeStamp': timestamp.isoformat()}
+            scrapes.append(ScrapeRecord('scrape', 'campus/building/device',
+                                        timestamp, values, meta, headers))
+        backupdb.backup_new_data(scrapes)
+        written += points * scrapes_per_call
+    elapsed = time.time() - start
+    print("Cached {} rows in {:.1f}s ({:.0f} rows/s)".format(
+        written, elapsed, written / elapsed))
+    return written
+
+
+def drain(backupdb, total, batch_size, report_every, publish_latency,
+          prefetch_batches):
+    prefetcher = None
+    if prefetch_batches:
+        prefetcher = _BatchPrefetcher(backupdb, batch_size, prefetch_batches)
+    drained = 0
+    batches = 0
+    start = last = time.time()
+    while True:
+        last_id = None
+        if prefetcher is not None:
+            batch, last_id = prefetcher.next_batch()
+        else:
+            batch = backupdb.get_outstanding_to_publish(batch_size)
+        if not batch:
+            break
+        # Stand in for the time spent writing to the target database.
+        time.sleep(publish_latency)
+        backupdb.remove_successfully_published(set([None]), batch_size,
+                                               last_outstanding_id=last_id)
+        drained += len(batch)
+        batches += 1
+        if batches % report_every == 0:
+            now = time.time()
+            print("{:>12} / {} rows drained, {:.2f} ms per batch".format(
+                drained, total, (now - last) * 1000.0 / report_every))
+            last = now
+    if prefetcher is not None:
+        prefetcher.stop()
+    elapsed = time.time() - start
+    print("Drained {} rows in {:.1f}s ({:.0f} rows/s)".format(
+        drained, elapsed, drained / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark filling and draining the historian backup cache.")
+    parser.add_argument('--rows', type=int, default=10000000,
+                        help='Size of the backlog to create.')
+    parser.add_argument('--points', type=int, default=500,
+                        help='Points per device scrape.')
+    parser.add_argument('--submit-size-limit', type=int, default=1000,
+                        help='Records per publish batch.')
+    parser.add_argument('--scrapes-per-call', type=int, default=20,
+                        help='Scrapes cached per backup_new_data call.')
+    parser.add_argument('--report-every', type=int, default=1000,
+                        help='Report drain progress every N batches.')
+    parser.add_argument('--publish-latency', type=float, default=0.0,
+                        help='Seconds the simulated historian spends '
+                             'publishing each batch.')
+    parser.add_argument('--prefetch-batches', type=int, default=0,
+                        help='Batches to read ahead while publishing. '
+                             'Same as the historian setting.')
+    parser.add_argument('--journal-mode', default=None,
+                        help='SQLite journal mode for the cache, e.g. WAL. '
+                             'Same as backup_journal_mode.')
+    parser.add_argument('--synchronous', default=None,
+                        help='SQLite synchronous setting for the cache, '
+                             'e.g. NORMAL. Same as backup_synchronous.')
+    parser.add_argument('--directory', default=None,
+                        help='Directory for backup.sqlite. '
+                             'Defaults to a temporary directory.')
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        owner = _Owner()
+        backupdb = BackupDatabase(owner, None, 0.9,
+                                  journal_mode=args.journal_mode,
+                                  synchronous=args.synchronous)
+        total = fill(backupdb, args.rows, args.points, args.scrapes_per_call)
+        drain(backupdb, total, args.submit_size_limit, args.report_every,
+              args.publish_latency, args.prefetch_batches)
+        backupdb.close()
+    finally:
+        os.chdir(cwd)
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+"""
+Benchmark for the work a master driver does to publish each device scrape.
+
+Builds fake driver devices with many points and runs their periodic reads
+with a pubsub that accepts every publish immediately, so only the cost of
+scraping the fake registers and preparing topics, headers and messages is
+measured.
+
+    python driver_publish_benchmark.py --devices=100 --points=500 --scrapes=10
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+from gevent.event import AsyncResult
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'services', 'core',
+                                'MasterDriverAgent'))
+
+from master_driver.driver import DriverAgent
+from master_driver.driver_locks import configure_publish_lock
+from volttron.platform.agent import utils
+from volttron.platform.messaging.topics import DRIVER_TOPIC_ALL
+from volttron.platform.store import process_raw_config
+
+
+class _Parent(object):
+    def scrape_starting(self, topic):
+        pass
+
+    def scrape_ending(self, topic):
+        pass
+
+    def scrape_completed(self, topic, duration, success):
+        pass
+
+
+class _PubSub(object):
+    def __init__(self):
+        self.published = 0
+
+    def publish_many(self, peer, items, bus=''):
+        self.published += len(items)
+        result = AsyncResult()
+        result.set(str(len(items)))
+        return result
+
+
+class _Vip(object):
+    def __init__(self):
+        self.pubsub = _PubSub()
+
+
+class _Core(object):
+    def schedule(self, deadline, func, *args):
+        pass
+
+
+def registry_config(points):
+    rows = ["Point Name,Volttron Point Name,Units,Units Details,Writable,"
+            "Starting Value,Type,Notes"]
+    for i in range(points):
+        rows.append("Point{0},Point{0},F,,FALSE,{0},float,".format(i))
+    return process_raw_config("\n".join(rows), config_type="csv")
+
+
+def build_driver(vip, index, registry):
+    driver = DriverAgent.__new__(DriverAgent)
+    driver.parent = _Parent()
+    driver.vip = vip
+    driver.core = _Core()
+    driver.config = {"driver_config": {},
+                     "driver_type": "fakedriver",
+                     "registry_config": registry,
+                     "interval": 60}
+    driver.device_path = "campus/building/device{}".format(index)
+    driver.interval = 60
+    driver.time_slot_offset = 0
+    driver.periodic_read_event = None
+    driver.update_publish_types(True, True, True, True)
+    driver.setup_device()
+    driver.all_path_depth, driver.all_path_breadth = \
+        driver.get_paths_for_point(DRIVER_TOPIC_ALL)
+    return driver
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark preparing driver scrape publishes.")
+    parser.add_argument('--devices', type=int, default=100,
+                        help='Number of fake devices.')
+    parser.add_argument('--points', type=int, default=500,
+                        help='Number of points on each device.')
+    parser.add_argument('--scrapes', type=int, default=10,
+                        help='Number of times to scrape every device.')
+    args = parser.parse_args()
+
+    # Debug logging would dominate the measurement.
+    logging.getLogger().setLevel(logging.INFO)
+    configure_publish_lock()
+    vip = _Vip()
+    registry = registry_config(args.points)
+    drivers = [build_driver(vip, i, registry) for i in range(args.devices)]
+
+    now = utils.get_aware_utc_now()
+    start = time.time()
+    for _ in range(args.scrapes):
+        for driver in drivers:
+            driver.periodic_read(now)
+    elapsed = time.time() - start
+
+    scrapes = args.scrapes * args.devices
+    print("{} scrapes of {} points, {} publishes in {:.2f}s".format(
+        scrapes, args.points, vip.pubsub.published, elapsed))
+    print("{:.1f} ms per scrape, {:.0f} points/s".format(
+        elapsed / scrapes * 1000, scrapes * args.points / elapsed))
+
+
+if __name__ == '__main__':
+    main()
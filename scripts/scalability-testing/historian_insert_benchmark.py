@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+"""
+Benchmark for writing batches of historian records through the SQL
+historian database drivers.
+
+Each driver is timed writing the same batches once with one statement per
+record, the generic DbDriver.bulk_insert, and once with the driver's own
+bulk insert. SQLite is measured against a database file in a temporary
+directory. Without a MySQL server the MySQL driver runs against a stand-in
+connection that stores nothing and waits --latency seconds for every
+statement, the round trip to a server, so the number of statements sent is
+what gets measured.
+
+    python historian_insert_benchmark.py --rows=100000 --batch-size=1000
+    python historian_insert_benchmark.py --mysql-config=mysql.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from volttron.platform.dbutils.basedb import DbDriver
+from volttron.platform.dbutils.sqlitefuncts import SqlLiteFuncts
+
+TABLE_NAMES = {'data_table': 'data', 'topics_table': 'topics',
+               'meta_table': 'meta', 'agg_topics_table': 'aggregate_topics',
+               'agg_meta_table': 'aggregate_meta'}
+
+
+class _StandInCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.rowcount = 0
+
+    def execute(self, stmt, args=()):
+        time.sleep(self.connection.latency)
+        self.connection.statements += 1
+        self.rowcount = len(args) // 3
+
+    def executemany(self, stmt, args):
+        for row in args:
+            self.execute(stmt, row)
+
+    def fetchall(self):
+        # Only asked for max_allowed_packet.
+        return [(4 * 1024 * 1024,)]
+
+    def close(self):
+        pass
+
+
+class _StandInConnection(object):
+    """Takes the place of a MySQL connection, counting statements."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.statements = 0
+
+    def cursor(self):
+        return _StandInCursor(self)
+
+    def commit(self):
+        time.sleep(self.latency)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def batches(rows, batch_size, points, start):
+    batch = []
+    for i in range(rows):
+        ts = start + timedelta(seconds=i // points)
+        batch.append((ts, i % points + 1, 70.0 + (i % 100) / 10.0))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(driver, bulk_insert, args, first_ts):
+    start = time.time()
+    for batch in batches(args.rows, args.batch_size, args.points, first_ts):
+        with bulk_insert(driver) as insert_data:
+            for ts, topic_id, value in batch:
+                insert_data(ts, topic_id, value)
+        driver.commit()
+    return time.time() - start
+
+
+def report(name, driver, args, statements=None):
+    results = []
+    for label, bulk_insert, first_ts in (
+            ('per row', DbDriver.bulk_insert, datetime(2018, 1, 1)),
+            ('bulk', type(driver).bulk_insert, datetime(2019, 1, 1))):
+        before = statements() if statements else None
+        elapsed = run(driver, bulk_insert, args, first_ts)
+        sent = statements() - before if statements else None
+        results.append((label, elapsed, sent))
+
+    for label, elapsed, sent in results:
+        line = "{:<8} {:<8} {:>10.0f} rows/s".format(
+            name, label, args.rows / elapsed)
+        if sent is not None:
+            line += " {:>8} statements".format(sent)
+        print(line)
+
+
+def sqlite_driver(directory):
+    driver = SqlLiteFuncts({'database': os.path.join(directory,
+                                                     'historian.sqlite')},
+                           TABLE_NAMES)
+    driver.setup_historian_tables()
+    return driver
+
+
+def mysql_driver(args):
+    from volttron.platform.dbutils.mysqlfuncts import MySqlFuncts
+    if args.mysql_config:
+        with open(args.mysql_config) as f:
+            driver = MySqlFuncts(json.load(f), TABLE_NAMES)
+        driver.setup_historian_tables()
+        return driver, None
+
+    driver = MySqlFuncts({}, TABLE_NAMES)
+    connection = _StandInConnection(args.latency)
+    driver._DbDriver__connect = lambda: connection
+    return driver, lambda: connection.statements
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark historian database inserts.")
+    parser.add_argument('--rows', type=int, default=100000,
+                        help='Number of records to write.')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='Records per batch, like the historian '
+                             'submit_size_limit.')
+    parser.add_argument('--points', type=int, default=500,
+                        help='Number of topics the records are spread over.')
+    parser.add_argument('--latency', type=float, default=0.0005,
+                        help='Seconds per statement for the MySQL stand-in.')
+    parser.add_argument('--mysql-config',
+                        help='JSON file of mysql.connector connect '
+                             'parameters of a real server to use instead of '
+                             'the stand-in.')
+    args = parser.parse_args()
+
+    # Debug logging would dominate the measurement.
+    logging.getLogger().setLevel(logging.INFO)
+
+    directory = tempfile.mkdtemp()
+    try:
+        report('sqlite', sqlite_driver(directory), args)
+    finally:
+        shutil.rmtree(directory)
+
+    try:
+        driver, statements = mysql_driver(args)
+    except ImportError:
+        print("mysql       skipped, mysql-connector-python is not installed")
+    else:
+        report('mysql', driver, args, statements)
+
+
+if __name__ == '__main__':
+    main()
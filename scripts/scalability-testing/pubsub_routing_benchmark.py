@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+"""
+Benchmark for topic routing in the platform :py:class:`PubSubService`.
+
+Registers thousands of subscriptions spread over a device topic hierarchy and
+then routes publishes through the service with a socket that discards
+everything sent to it, so only the cost of finding subscribers and building
+frames is measured. The lookup is also timed on its own next to testing
+every prefix with ``startswith`` the way routing used to.
+
+    python pubsub_routing_benchmark.py --subscriptions=10000 --publishes=100000
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import time
+
+import zmq
+
+from volttron.platform.agent import json as jsonapi
+# The agent package has to be imported before the service it depends on.
+from volttron.platform.vip import agent  # noqa
+from volttron.platform.vip.pubsubservice import PubSubService
+
+
+class _NullSocket(object):
+    def send(self, data, flags=0, copy=True):
+        pass
+
+    def send_multipart(self, frames, flags=0, copy=True):
+        pass
+
+
+def build_topics(campuses, buildings, devices):
+    return ['devices/campus{}/building{}/device{}/all'.format(c, b, d)
+            for c in range(campuses)
+            for b in range(buildings)
+            for d in range(devices)]
+
+
+def subscribe(service, topics, count, subscribers):
+    prefixes = set()
+    for topic in topics:
+        parts = topic.split('/')
+        for depth in range(1, len(parts) + 1):
+            prefixes.add('/'.join(parts[:depth]))
+    prefixes = sorted(prefixes)
+    random.seed(0)
+    for i in range(count):
+        prefix = random.choice(prefixes)
+        peer = 'agent{}'.format(i % subscribers)
+        service._add_peer_subscription(peer, '', prefix)
+    return len(service._peer_subscriptions['internal'][''])
+
+
+def publish_frames(topic, payload_size):
+    data = jsonapi.dumps(dict(bus='', headers={},
+                              message=[{'Point': 'x' * payload_size}, {}]))
+    return [zmq.Frame(b'publisher'), zmq.Frame(b''), zmq.Frame(b'VIP1'),
+            zmq.Frame(b''), zmq.Frame(b''), zmq.Frame(b'pubsub'),
+            zmq.Frame(b'publish'), zmq.Frame(topic), zmq.Frame(data)]
+
+
+def route(service, topics, publishes, payload_size):
+    # Frames as they would arrive at the router, built ahead of time.
+    received = [publish_frames(topic, payload_size) for topic in topics]
+    delivered = 0
+    start = time.time()
+    for i in range(publishes):
+        frames = list(received[i % len(received)])
+        delivered += service._peer_publish(frames, b'publisher')
+    return time.time() - start, delivered
+
+
+def lookup(service, topics, publishes):
+    subscriptions = service._peer_subscriptions['internal']['']
+    delivered = 0
+    start = time.time()
+    for i in range(publishes):
+        delivered += len(subscriptions.subscribers(topics[i % len(topics)]))
+    return time.time() - start, delivered
+
+
+def scan(service, topics, publishes):
+    subscriptions = service._peer_subscriptions['internal']['']
+    delivered = 0
+    start = time.time()
+    for i in range(publishes):
+        topic = topics[i % len(topics)]
+        subscribers = set()
+        for prefix, subscription in subscriptions.iteritems():
+            if subscription and topic.startswith(prefix):
+                subscribers |= subscription
+        delivered += len(subscribers)
+    return time.time() - start, delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark topic routing in the pubsub service.")
+    parser.add_argument('--subscriptions', type=int, default=10000,
+                        help='Number of subscriptions to register.')
+    parser.add_argument('--subscribers', type=int, default=200,
+                        help='Number of distinct subscribing agents.')
+    parser.add_argument('--publishes', type=int, default=100000,
+                        help='Number of publishes to route.')
+    parser.add_argument('--payload-size', type=int, default=100,
+                        help='Approximate size in bytes of each message.')
+    parser.add_argument('--campuses', type=int, default=10)
+    parser.add_argument('--buildings', type=int, default=10)
+    parser.add_argument('--devices', type=int, default=50)
+    args = parser.parse_args()
+
+    service = PubSubService(_NullSocket(), {}, None)
+    topics = build_topics(args.campuses, args.buildings, args.devices)
+    prefixes = subscribe(service, topics, args.subscriptions,
+                         args.subscribers)
+    print("{} subscriptions over {} distinct prefixes".format(
+        args.subscriptions, prefixes))
+
+    elapsed, delivered = route(service, topics, args.publishes,
+                               args.payload_size)
+    print("Routed {} publishes to {} subscribers in {:.2f}s "
+          "({:.0f} publishes/s)".format(args.publishes, delivered, elapsed,
+                                        args.publishes / elapsed))
+
+    elapsed, delivered = lookup(service, topics, args.publishes)
+    print("Index lookup alone: {:.2f}s ({:.0f} publishes/s)".format(
+        elapsed, args.publishes / elapsed))
+
+    elapsed, delivered = scan(service, topics, args.publishes)
+    print("Testing every prefix: {:.2f}s ({:.0f} publishes/s)".format(
+        elapsed, args.publishes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
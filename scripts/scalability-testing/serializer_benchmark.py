@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+"""
+Benchmark for the pubsub message serializers.
+
+Encodes and decodes a typical ``devices/.../all`` message the way a driver
+publishes it, a dict of point values followed by a dict of point metadata,
+with every available serializer and reports the encoded size and time per
+message.
+
+    python serializer_benchmark.py --points=500 --iterations=2000
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+from datetime import datetime
+
+from volttron.platform.vip import serializers
+
+
+def device_message(points):
+    values = {}
+    meta = {}
+    for i in range(points):
+        name = 'Point{}'.format(i)
+        values[name] = i * 1.25
+        meta[name] = {'units': 'degreesFahrenheit', 'type': 'float',
+                      'tz': 'US/Pacific'}
+    now = datetime.utcnow().isoformat() + '+00:00'
+    headers = {'Date': now, 'TimeStamp': now, 'SynchronizedTimeStamp': now}
+    return dict(sender='platform.driver', bus='', headers=headers,
+                message=[values, meta])
+
+
+def measure(serializer, message, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        data = serializer.dumps(message)
+    encode = time.time() - start
+    start = time.time()
+    for _ in range(iterations):
+        serializer.loads(data)
+    decode = time.time() - start
+    return len(data), encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark pubsub message serializers.")
+    parser.add_argument('--points', type=int, default=500,
+                        help='Points in the device message.')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='Messages to encode and decode.')
+    args = parser.parse_args()
+
+    message = device_message(args.points)
+    print("{:<10} {:>10} {:>14} {:>14}".format(
+        'serializer', 'bytes', 'encode (ms)', 'decode (ms)'))
+    for name in serializers.available():
+        size, encode, decode = measure(serializers.get(name), message,
+                                       args.iterations)
+        print("{:<10} {:>10} {:>14.3f} {:>14.3f}".format(
+            name, size, encode * 1000.0 / args.iterations,
+            decode * 1000.0 / args.iterations))
+    if not serializers.HAS_MSGPACK:
+        print("msgpack is not installed, only JSON was measured.")
+
+
+if __name__ == '__main__':
+    main()
@@ -455,7 +455,7 @@ from actuator.scheduler import ScheduleManager
 
 from tzlocal import get_localzone
 from volttron.platform.agent import utils
-from volttron.platform.jsonrpc import RemoteError
+from volttron.platform.jsonrpc import RemoteError, MethodNotFound
 from volttron.platform.messaging import topics
 from volttron.platform.messaging.utils import normtopic
 from volttron.platform.vip.agent import Agent, Core, RPC, Unreachable, compat
@@ -976,7 +976,7 @@ class ActuatorAgent(Agent):
         """RPC method
 
         Get multiple points on multiple devices. Makes a single
-        RPC call to the master driver per device.
+        RPC call to the master driver for all devices.
 
         :param topics: List of topics or list of [device, point] pairs.
         :param \*\*kwargs: Any driver specific parameters
@@ -1004,14 +1004,23 @@ class ActuatorAgent(Agent):
                 e = ValueError("Invalid topic: {}".format(topic))
                 errors[repr(topic)] = repr(e)
 
-        for device, point_names in devices.iteritems():
+        try:
             r, e = self.vip.rpc.call(self.driver_vip_identity,
-                                     'get_multiple_points',
-                                     device,
-                                     point_names,
+                                     'get_multiple_devices_points',
+                                     devices,
                                      **kwargs).get()
             results.update(r)
             errors.update(e)
+        except MethodNotFound:
+            # Older drivers are called once per device.
+            for device, point_names in devices.iteritems():
+                r, e = self.vip.rpc.call(self.driver_vip_identity,
+                                         'get_multiple_points',
+                                         device,
+                                         point_names,
+                                         **kwargs).get()
+                results.update(r)
+                errors.update(e)
 
         return results, errors
 
@@ -1020,7 +1029,7 @@ class ActuatorAgent(Agent):
         """RPC method
 
         Set multiple points on multiple devices. Makes a single
-        RPC call to the master driver per device.
+        RPC call to the master driver for all devices.
 
         :param requester_id: Ignored, VIP Identity used internally
         :param topics_values: List of (topic, value) tuples
@@ -1053,13 +1062,21 @@ class ActuatorAgent(Agent):
             if not self._check_lock(device, requester_id):
                 raise LockError("caller ({}) does not lock for device {}".format(requester_id, device))
 
-        for device, point_names_values in devices.iteritems():
+        try:
             r = self.vip.rpc.call(self.driver_vip_identity,
-                                  'set_multiple_points',
-                                  device,
-                                  point_names_values,
+                                  'set_multiple_devices_points',
+                                  devices,
                                   **kwargs).get()
             results.update(r)
+        except MethodNotFound:
+            # Older drivers are called once per device.
+            for device, point_names_values in devices.iteritems():
+                r = self.vip.rpc.call(self.driver_vip_identity,
+                                      'set_multiple_points',
+                                      device,
+                                      point_names_values,
+                                      **kwargs).get()
+                results.update(r)
 
         return results
     
@@ -36,12 +36,14 @@
 # under Contract DE-AC05-76RL01830
 # }}}
 
+import hashlib
 import logging
 import sys
 import datetime
 
 from volttron.platform.vip.agent import Agent, Core, RPC
 from volttron.platform.async import AsyncCall
+from volttron.platform.agent import json as jsonapi
 from volttron.platform.agent import utils
 from volttron.platform.messaging import topics, headers
 
@@ -52,7 +54,7 @@ bacnet_logger = logging.getLogger("bacpypes")
 bacnet_logger.setLevel(logging.WARNING)
 __version__ = '0.5'
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 from Queue import Queue, Empty
 
@@ -61,6 +63,7 @@ from bacpypes.task import RecurringTask
 import bacpypes.core
 
 import threading
+import time
 
 # Tweeks to BACpypes to make it play nice with Gevent.
 bacpypes.core.enable_sleeping()
@@ -93,6 +96,7 @@ from bacpypes.constructeddata import Array, Any, Choice
 from bacpypes.basetypes import ServicesSupported
 from bacpypes.task import TaskManager
 from gevent.event import AsyncResult
+from gevent.lock import BoundedSemaphore
 
 from volttron.platform.agent.known_identities import PLATFORM_DRIVER
 
@@ -471,6 +475,76 @@ class BACnet_application(BIPSimpleApplication, RecurringTask):
         BIPSimpleApplication.indication(self, apdu)
 
 
+# Seconds to wait for a free request slot, and then for each response, when
+# reading properties.
+REQUEST_TIMEOUT = 10
+
+
+class RequestWindow(object):
+    """Limits the number of confirmed requests waiting on a response.
+
+    Each target address gets its own window of outstanding requests and
+    all targets share a global limit. A slot is given back as soon as the
+    response (or error) for its request arrives, not when the caller gets
+    around to reading it, so callers blocked waiting on a slot cannot
+    starve each other.
+    """
+
+    def __init__(self, per_target=1, total=32):
+        self.per_target = max(1, per_target)
+        self.total = BoundedSemaphore(max(1, total))
+        self.targets = {}
+
+    def acquire(self, target_address, timeout=None):
+        """Wait for a free slot for target_address and return a function
+        that gives it back. Returns None if no slot came free in time.
+
+        The timeout covers the wait for both the target and the global
+        limit."""
+        target = self.targets.get(target_address)
+        if target is None:
+            target = self.targets[target_address] = \
+                BoundedSemaphore(self.per_target)
+
+        deadline = None if timeout is None else time.time() + timeout
+        if not target.acquire(timeout=timeout):
+            return None
+        if deadline is not None:
+            timeout = max(0.0, deadline - time.time())
+        if not self.total.acquire(timeout=timeout):
+            target.release()
+            return None
+
+        released = []
+
+        def release(*args):
+            if not released:
+                released.append(True)
+                self.total.release()
+                target.release()
+        return release
+
+
+# Number of registered point maps kept by the proxy.
+MAX_POINT_MAPS = 1000
+
+
+class UnknownPointMap(Exception):
+    pass
+
+
+class CompiledPointMap(object):
+    """A point map registered with the proxy along with the read requests
+    compiled from it for each max_per_request value used so far."""
+
+    def __init__(self, target_address, object_property_map,
+                 reverse_point_map):
+        self.target_address = target_address
+        self.object_property_map = object_property_map
+        self.reverse_point_map = reverse_point_map
+        self.requests = {}
+
+
 write_debug_str = ("Writing: {target} {type} {instance} {property} (Priority: "
                    "{priority}, Index: {index}): {value}")
 
@@ -485,12 +559,16 @@ def bacnet_proxy_agent(config_path, **kwargs):
     ven_id = config.get("vendor_id", 15)
     max_per_request = config.get("default_max_per_request", 1000000)
     request_check_interval = config.get("request_check_interval", 100)
+    max_outstanding_per_target = config.get("max_outstanding_per_target", 1)
+    max_outstanding_requests = config.get("max_outstanding_requests", 32)
 
     return BACnetProxyAgent(device_address,
                             max_apdu_len, seg_supported,
                             obj_id, obj_name, ven_id,
                             max_per_request,
                             request_check_interval=request_check_interval,
+                            max_outstanding_per_target=max_outstanding_per_target,
+                            max_outstanding_requests=max_outstanding_requests,
                             heartbeat_autostart=True,
                             **kwargs)
 
@@ -503,6 +581,8 @@ class BACnetProxyAgent(Agent):
                  max_apdu_len, seg_supported,
                  obj_id, obj_name, ven_id, max_per_request,
                  request_check_interval=100,
+                 max_outstanding_per_target=1,
+                 max_outstanding_requests=32,
                  **kwargs):
         super(BACnetProxyAgent, self).__init__(**kwargs)
 
@@ -523,6 +603,9 @@ class BACnetProxyAgent(Agent):
 
         self.iocb_class = IOCB
         self._max_per_request = max_per_request
+        self._request_window = RequestWindow(max_outstanding_per_target,
+                                             max_outstanding_requests)
+        self._point_maps = OrderedDict()
 
         self.setup_device(async_call, device_address,
                           max_apdu_len, seg_supported,
@@ -722,7 +805,7 @@ class BACnetProxyAgent(Agent):
 
         iocb = self.iocb_class(request)
         self.this_application.submit_request(iocb)
-        result = iocb.ioResult.get(10)
+        result = iocb.ioResult.get(timeout=10)
         if isinstance(result, SimpleAckPDU):
             return value
         raise RuntimeError("Failed to set value: " + str(result))
@@ -762,7 +845,7 @@ class BACnetProxyAgent(Agent):
         request.pduDestination = Address(target_address)
         iocb = self.iocb_class(request)
         self.this_application.submit_request(iocb)
-        bacnet_results = iocb.ioResult.get(10)
+        bacnet_results = iocb.ioResult.get(timeout=10)
         return bacnet_results
 
     def _get_access_spec(self, obj_data, properties):
@@ -828,24 +911,87 @@ class BACnetProxyAgent(Agent):
         (object_property_map, reverse_point_map) = self._get_object_properties(
             point_map, target_address)
 
-        result_dict = {}
-        finished = False
+        requests = self._compile_read_requests(object_property_map,
+                                               max_per_request)
+        return self._send_read_requests(target_address, requests,
+                                        reverse_point_map)
+
+    @RPC.export
+    def register_point_map(self, target_address, point_map):
+        """Compile a point map for read_registered_properties and return its
+        handle. Registering the same map again returns the same handle."""
+        handle = hashlib.sha1(jsonapi.dumps(
+            [target_address, sorted(point_map.items())])).hexdigest()
+        if handle in self._point_maps:
+            self._point_maps[handle] = self._point_maps.pop(handle)
+            return handle
+
+        (object_property_map, reverse_point_map) = self._get_object_properties(
+            point_map, target_address)
+        self._point_maps[handle] = CompiledPointMap(
+            target_address, object_property_map, reverse_point_map)
+        while len(self._point_maps) > MAX_POINT_MAPS:
+            self._point_maps.popitem(last=False)
+
+        _log.debug("Registered {count} points on {target} as {handle}".format(
+            count=len(point_map), target=target_address, handle=handle))
+        return handle
 
-        while not finished:
+    @RPC.export
+    def read_registered_properties(self, handle, max_per_request=None):
+        """Read the points of a map registered with register_point_map.
+
+        Raises UnknownPointMap if the handle is not known, for instance
+        after the proxy restarts, and the caller should register again."""
+        try:
+            point_map = self._point_maps[handle]
+        except KeyError:
+            raise UnknownPointMap("Unknown point map handle: " + str(handle))
+
+        if max_per_request is None:
+            max_per_request = self._max_per_request
+
+        requests = point_map.requests.get(max_per_request)
+        if requests is None:
+            requests = self._compile_read_requests(
+                dict(point_map.object_property_map), max_per_request)
+            point_map.requests[max_per_request] = requests
+
+        return self._send_read_requests(point_map.target_address, requests,
+                                        point_map.reverse_point_map)
+
+    def _compile_read_requests(self, object_property_map, max_per_request):
+        """Split the objects into lists of read access specifications of
+        at most max_per_request objects each."""
+        requests = []
+        while object_property_map:
             read_access_spec_list = []
             count = 0
             for _ in xrange(max_per_request):
                 try:
                     obj_data, properties = object_property_map.popitem()
                 except KeyError:
-                    finished = True
                     break
                 (spec_list, spec_count) = self._get_access_spec(
                     obj_data, properties)
                 count += spec_count
                 read_access_spec_list.append(spec_list)
+            requests.append((read_access_spec_list, count))
+        return requests
+
+    def _send_read_requests(self, target_address, requests,
+                            reverse_point_map):
+        # Keep up to the configured number of requests in flight for this
+        # target and only then start waiting on the oldest response.
+        pending = []
+        try:
+            for read_access_spec_list, count in requests:
+                release = self._request_window.acquire(
+                    target_address, timeout=REQUEST_TIMEOUT)
+                if release is None:
+                    raise RuntimeError("Timed out waiting to send a request "
+                                       "to {}".format(target_address))
 
-            if read_access_spec_list:
                 _log.debug(("Requesting {count} properties from "
                            "{target}").format(count=count,
                                               target=target_address))
@@ -854,8 +1000,13 @@ class BACnetProxyAgent(Agent):
                 request.pduDestination = Address(target_address)
 
                 iocb = self.iocb_class(request)
+                iocb.ioResult.rawlink(release)
+                pending.append((iocb, count, release))
                 self.this_application.submit_request(iocb)
-                bacnet_results = iocb.ioResult.get(10)
+
+            result_dict = {}
+            for iocb, count, _ in pending:
+                bacnet_results = iocb.ioResult.get(timeout=REQUEST_TIMEOUT)
 
                 _log.debug(("Received read response from {target} count: "
                             "{count}").format(count=count,
@@ -864,6 +1015,10 @@ class BACnetProxyAgent(Agent):
                 for prop_tuple, value in bacnet_results.iteritems():
                     name = reverse_point_map[prop_tuple]
                     result_dict[name] = value
+        finally:
+            # Requests that never answered must not hold on to their slots.
+            for _, _, release in pending:
+                release()
 
         return result_dict
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+import time
+
+import gevent
+import pytest
+from gevent.event import AsyncResult
+
+from bacnet_proxy import agent
+from bacnet_proxy.agent import BACnetProxyAgent, RequestWindow
+
+TARGET = '10.0.0.1'
+
+
+@pytest.mark.driver
+def test_per_target_and_total_limits():
+    window = RequestWindow(per_target=2, total=3)
+    first = window.acquire(TARGET, timeout=0)
+    second = window.acquire(TARGET, timeout=0)
+    assert first and second
+    assert window.acquire(TARGET, timeout=0) is None
+
+    # Other targets have their own window, within the total.
+    third = window.acquire('10.0.0.2', timeout=0)
+    assert third
+    assert window.acquire('10.0.0.3', timeout=0) is None
+
+    # Giving back a slot twice does not free a second one.
+    first()
+    first()
+    assert window.acquire('10.0.0.3', timeout=0)
+    assert window.acquire('10.0.0.4', timeout=0) is None
+
+
+@pytest.mark.driver
+def test_timeout_covers_both_limits():
+    window = RequestWindow(per_target=1, total=2)
+    held = [window.acquire('10.0.0.2'), window.acquire(TARGET)]
+
+    def release_target():
+        # TARGET comes free part way through, but its slot in the total
+        # limit is taken straight away by another target.
+        held.pop()()
+        held.append(window.acquire('10.0.0.3', timeout=0))
+
+    gevent.spawn_later(0.2, release_target)
+    start = time.time()
+    assert window.acquire(TARGET, timeout=0.3) is None
+    assert time.time() - start < 0.45
+
+    # Nothing is left held by the attempt that timed out.
+    for release in held:
+        release()
+    assert window.acquire(TARGET, timeout=0)
+
+
+class FakeIOCB(object):
+    def __init__(self, request):
+        self.ioRequest = request
+        self.ioResult = AsyncResult()
+
+
+class FakeApplication(object):
+    """Answers each request after delay seconds, with the property in its
+    spec list, or fails it if it is in failures. Requests for the properties
+    in late are answered after a second."""
+    def __init__(self, delay=0.01, failures=(), late=()):
+        self.delay = delay
+        self.failures = failures
+        self.late = late
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    def submit_request(self, iocb):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        prop = iocb.ioRequest.listOfReadAccessSpecs[0]
+        delay = 1.0 if prop in self.late else self.delay
+        gevent.spawn_later(delay, self.answer, iocb, prop)
+
+    def answer(self, iocb, prop):
+        self.in_flight -= 1
+        if prop in self.failures:
+            iocb.ioResult.set_exception(RuntimeError(prop))
+        else:
+            iocb.ioResult.set({prop: prop.upper()})
+
+
+def make_proxy(window, application):
+    proxy = BACnetProxyAgent.__new__(BACnetProxyAgent)
+    proxy.iocb_class = FakeIOCB
+    proxy._request_window = window
+    proxy.this_application = application
+    return proxy
+
+
+def read(proxy, props):
+    requests = [([prop], 1) for prop in props]
+    reverse_point_map = dict((prop, 'point_' + prop) for prop in props)
+    return proxy._send_read_requests(TARGET, requests, reverse_point_map)
+
+
+def assert_all_released(window):
+    releases = [window.acquire(TARGET, timeout=0.1)
+                for _ in range(window.per_target)]
+    assert all(releases)
+    for release in releases:
+        release()
+
+
+@pytest.mark.driver
+def test_requests_kept_in_flight():
+    window = RequestWindow(per_target=2, total=32)
+    application = FakeApplication()
+    proxy = make_proxy(window, application)
+
+    props = ['a', 'b', 'c', 'd', 'e']
+    assert read(proxy, props) == dict(('point_' + p, p.upper()) for p in props)
+    assert application.most_in_flight == 2
+    assert_all_released(window)
+
+
+@pytest.mark.driver
+def test_slots_released_on_error():
+    window = RequestWindow(per_target=2, total=32)
+    proxy = make_proxy(window, FakeApplication(failures=['b']))
+
+    with pytest.raises(RuntimeError):
+        read(proxy, ['a', 'b', 'c'])
+    assert_all_released(window)
+
+
+@pytest.mark.driver
+def test_slots_released_on_timeout(monkeypatch):
+    monkeypatch.setattr(agent, 'REQUEST_TIMEOUT', 0.1)
+    window = RequestWindow(per_target=2, total=32)
+    proxy = make_proxy(window, FakeApplication(late=['a']))
+
+    # The response to the first request comes too late.
+    with pytest.raises(gevent.Timeout):
+        read(proxy, ['a', 'b'])
+    assert_all_released(window)
+
+    # A target whose window stays full times out waiting for a slot.
+    held = [window.acquire(TARGET), window.acquire(TARGET)]
+    with pytest.raises(RuntimeError):
+        read(proxy, ['c'])
+    for release in held:
+        release()
+    assert_all_released(window)
@@ -57,7 +57,6 @@ from __future__ import absolute_import, print_function
 import logging
 import sys
 
-from requests.exceptions import ConnectionError
 from influxdb.exceptions import InfluxDBClientError
 
 from volttron.platform.agent import utils
@@ -123,6 +122,9 @@ class InfluxdbHistorian(BaseHistorian):
             3. database
             4. user
             5. passwd
+            6. gzip (optional, compress writes)
+            7. batch_size (optional, data points per write)
+            8. time_precision (optional, 's', 'ms', 'u' or 'n')
         :param kwargs: additional keyword arguments. (optional identity and
                        topic_replace_list used by parent classes)
         """
@@ -131,6 +133,8 @@ class InfluxdbHistorian(BaseHistorian):
         self._host = self._connection_params.get('host', None)
         self._user = self._connection_params.get('user', None)
         self._database = self._connection_params.get('database', None)
+        self._batch_size = self._connection_params.get('batch_size', influxdbutils.DEFAULT_BATCH_SIZE)
+        self._time_precision = self._connection_params.get('time_precision', None)
         self._client = None
 
         # Config for aggregation queries, can be changed in config file.
@@ -166,7 +170,9 @@ class InfluxdbHistorian(BaseHistorian):
               }
             }
 
-        If user and passwd are optional if authentication is disabled
+        If user and passwd are optional if authentication is disabled.
+        gzip, batch_size and time_precision may also be set in params, see
+        the README.
         """
         try:
             params = configuration['connection']['params']
@@ -174,6 +180,8 @@ class InfluxdbHistorian(BaseHistorian):
             db = params['database']
             user = params.get('user', None)
             passwd = params.get('passwd', None)
+            batch_size = int(params.get('batch_size', influxdbutils.DEFAULT_BATCH_SIZE))
+            time_precision = params.get('time_precision', None)
             if configuration['aggregations']:
                 use_calendar_time_periods = configuration['aggregations']['use_calendar_time_periods']
         except (KeyError, TypeError) as err:
@@ -202,6 +210,16 @@ class InfluxdbHistorian(BaseHistorian):
             _log.info("Changing user to {}".format(user))
             self._user = user
 
+        if batch_size < 1:
+            _log.error("Invalid configuration for params: batch_size must be at least 1")
+            raise ValueError("batch_size must be at least 1")
+        self._batch_size = batch_size
+
+        if time_precision not in (None, 's', 'ms', 'u', 'n'):
+            _log.error("Invalid configuration for params: time_precision is {}".format(time_precision))
+            raise ValueError("time_precision must be one of 's', 'ms', 'u' or 'n'")
+        self._time_precision = time_precision
+
         client = influxdbutils.get_client(params)
 
         if not client:
@@ -234,67 +252,77 @@ class InfluxdbHistorian(BaseHistorian):
         _log.debug("publish_to_historian number of items: {}".format(
             len(to_publish_list)))
 
-        try:
-            for stored_index, row in enumerate(to_publish_list):
-                ts = utils.format_timestamp(row['timestamp'])
-                source = row['source']
-                topic = row['topic']
-
-                # record/* has got wrong format for InfluxDB, only timeseries data
-                if topic.startswith('record/'):
-                    continue
-
-                meta = row['meta']
-                value = row['value']
-                value_string = str(value)
-
-                # Check type of value from metadata if it exists,
-                # then cast value to that type
-                try:
-                    value_type = meta["type"]
-                    value = influxdbutils.value_type_matching(value_type, value)
-                except KeyError:
-                    _log.info("Metadata doesn't include \'type\' keyword")
-                except ValueError:
-                    _log.warning("Metadata specifies \'type\' of value is {} while "
-                                 "value={} is type {}".format(value_type, value, type(value)))
-
-                topic_id = topic.lower()
-
-                # If the topic is not in the list
-                if topic_id not in self._topic_id_map:
-                    self._topic_id_map[topic_id] = topic
-                    self._meta_dicts[topic_id] = {}
+        # Rows that data points were made from, matched by index.
+        rows = []
+        points = []
 
-                # If topic's metadata changes, update its metadata.
-                if topic_id in self._topic_id_map and meta != self._meta_dicts[topic_id]:
+        for row in to_publish_list:
+            ts = utils.format_timestamp(row['timestamp'])
+            source = row['source']
+            topic = row['topic']
 
-                    _log.info("Updating meta for topic {} at {}".format(topic_id, ts))
-                    self._meta_dicts[topic_id] = meta
+            # record/* has got wrong format for InfluxDB, only timeseries data
+            if topic.startswith('record/'):
+                self.report_handled(row)
+                continue
 
-                    # Insert the meta into the database
-                    influxdbutils.insert_meta(self._client, topic_id, topic, meta, ts)
-                # Else if topic name in database changes, update.
-                elif topic_id in self._topic_id_map and self._topic_id_map[topic_id] != topic:
-                    _log.info("Updating actual topic name {} in database for topic id {}".format(topic, topic_id))
-                    self._topic_id_map[topic_id] = topic
+            meta = row['meta']
+            value = row['value']
+            value_string = str(value)
 
-                    # Update topic name in the database
-                    influxdbutils.insert_meta(self._client, topic_id, topic, meta, ts)
-
-                # Insert data point
-                influxdbutils.insert_data_point(self._client, ts, topic_id, source, value, value_string)
-
-            # After all data points are published
-            self.report_all_handled()
-            _log.info("Store ALL data in to_publish_list to InfluxDB client")
-
-        except ConnectionError, err:
-            raise err
-        except InfluxDBClientError, err:
-            _log.error("Stored [:{}] data in to_publish_list to InfluxDB client".format(stored_index-1))
-            self.report_handled(to_publish_list[:stored_index-1])
-            raise err
+            # Check type of value from metadata if it exists,
+            # then cast value to that type
+            try:
+                value_type = meta["type"]
+                value = influxdbutils.value_type_matching(value_type, value)
+            except KeyError:
+                _log.info("Metadata doesn't include \'type\' keyword")
+            except ValueError:
+                _log.warning("Metadata specifies \'type\' of value is {} while "
+                             "value={} is type {}".format(value_type, value, type(value)))
+
+            topic_id = topic.lower()
+
+            # If the topic is not in the list
+            if topic_id not in self._topic_id_map:
+                self._topic_id_map[topic_id] = topic
+                self._meta_dicts[topic_id] = {}
+
+            # If topic's metadata changes, update its metadata.
+            if topic_id in self._topic_id_map and meta != self._meta_dicts[topic_id]:
+
+                _log.info("Updating meta for topic {} at {}".format(topic_id, ts))
+                self._meta_dicts[topic_id] = meta
+
+                # Insert the meta into the database
+                influxdbutils.insert_meta(self._client, topic_id, topic, meta, ts)
+            # Else if topic name in database changes, update.
+            elif topic_id in self._topic_id_map and self._topic_id_map[topic_id] != topic:
+                _log.info("Updating actual topic name {} in database for topic id {}".format(topic, topic_id))
+                self._topic_id_map[topic_id] = topic
+
+                # Update topic name in the database
+                influxdbutils.insert_meta(self._client, topic_id, topic, meta, ts)
+
+            rows.append(row)
+            points.append(influxdbutils.make_data_point(ts, topic_id, source, value, value_string))
+
+        # Insert data points, reporting each batch as soon as it is stored so
+        # a lost connection only leaves the unwritten rows in the cache.
+        # Points the database rejects for a field type conflict would be
+        # rejected again on every retry, so they are dropped from the cache
+        # as well. Other errors are raised and leave the rows in the cache.
+        stored = dropped = 0
+        for stored_indexes, dropped_indexes in influxdbutils.insert_data_points(self._client, points,
+                                                                                self._batch_size,
+                                                                                self._time_precision):
+            self.report_handled([rows[i] for i in stored_indexes + dropped_indexes])
+            stored += len(stored_indexes)
+            dropped += len(dropped_indexes)
+
+        _log.info("Stored {} of {} data points to InfluxDB client".format(stored, len(points)))
+        if dropped:
+            _log.warning("Dropped {} data points rejected by InfluxDB".format(dropped))
 
     @doc_inherit
     def query_topic_list(self):
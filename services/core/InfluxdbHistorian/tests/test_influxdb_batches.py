@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+
+# Copyright (c) 2017, SLAC National Laboratory / Kisensum Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in
+#    the documentation and/or other materials provided with the
+#    distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation
+# are those of the authors and should not be interpreted as representing
+# official policies, either expressed or implied, of the FreeBSD
+# Project.
+#
+# This material was prepared as an account of work sponsored by an
+# agency of the United States Government.  Neither the United States
+# Government nor the United States Department of Energy, nor SLAC / Kisensum,
+# nor any of their employees, nor any jurisdiction or organization that
+# has cooperated in the development of these materials, makes any
+# warranty, express or implied, or assumes any legal liability or
+# responsibility for the accuracy, completeness, or usefulness or any
+# information, apparatus, product, software, or process disclosed, or
+# represents that its use would not infringe privately owned rights.
+#
+# Reference herein to any specific commercial product, process, or
+# service by trade name, trademark, manufacturer, or otherwise does not
+# necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# SLAC / Kisensum. The views and opinions of authors
+# expressed herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# }}}
+
+import json
+from datetime import datetime
+
+import pytest
+import pytz
+
+try:
+    from influxdb.exceptions import InfluxDBClientError
+    HAS_INFLUXDB = True
+except ImportError:
+    HAS_INFLUXDB = False
+
+if HAS_INFLUXDB:
+    from volttron.platform.dbutils import influxdbutils
+    from influx.historian import InfluxdbHistorian
+
+pytestmark = pytest.mark.skipif(not HAS_INFLUXDB, reason='No influxdb library. Please run \'pip install influxdb\'')
+
+CONFLICT = 'partial write: field type conflict: input field "value" on measurement "{}" is type float, ' \
+           'already exists as type {} dropped=1'
+
+
+class FakeClient(object):
+    """
+    Rejects every write that holds a point of a measurement in rejected, or a
+    point of a measurement in conflicts whose value is not of the existing
+    type. Values in line protocol writes never match the existing type. Every
+    write fails with error once writes_before_error writes were stored.
+    """
+    def __init__(self, conflicts=None, rejected=(), error=None, writes_before_error=0):
+        self.conflicts = conflicts or {}
+        self.rejected = set(rejected)
+        self.error = error
+        self.writes_before_error = writes_before_error
+        self.writes = []
+        self.stored = []
+
+    def write_points(self, points, time_precision=None, protocol='json'):
+        self.writes.append((protocol, len(points)))
+        if self.error is not None and len(self.writes) > self.writes_before_error:
+            raise self.error
+        if protocol == 'line':
+            received = [(line.split(',', 1)[0], None) for line in points]
+        else:
+            received = [(point["measurement"], point["fields"].get("value")) for point in points]
+        for measurement, value in received:
+            existing = self.conflicts.get(measurement)
+            if measurement in self.rejected or (existing is not None and
+                                                type(value).__name__ != existing[:3]):
+                raise InfluxDBClientError(json.dumps({"error": CONFLICT.format(measurement, existing)}), 400)
+        self.stored.extend(received)
+
+
+def make_points(measurements):
+    ts = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    return [influxdbutils.make_data_point(ts, 'campus/building/device/' + measurement, 'scrape', 1.0, '1.0')
+            for measurement in measurements]
+
+
+@pytest.mark.historian
+def test_rejected_batch_is_split():
+    client = FakeClient(conflicts={'count': 'integer'}, rejected=['broken'])
+    points = make_points(['temp', 'temp', 'count', 'temp', 'temp', 'temp', 'broken', 'temp'])
+
+    batches = list(influxdbutils.insert_data_points(client, points, batch_size=4))
+    assert batches == [([0, 1, 2, 3], []), ([4, 5, 7], [6])]
+
+    # Only the halves holding a rejected point are split again.
+    assert client.writes == [('line', 4), ('line', 2), ('line', 2), ('line', 1), ('json', 1), ('line', 1),
+                             ('line', 4), ('line', 2), ('line', 2), ('line', 1), ('json', 1), ('line', 1)]
+
+
+@pytest.mark.historian
+def test_rejected_point_cast_to_existing_type():
+    client = FakeClient(conflicts={'count': 'integer'})
+    points = make_points(['count'])
+
+    assert list(influxdbutils.insert_data_points(client, points)) == [([0], [])]
+    assert client.stored == [('count', 1)]
+    assert isinstance(client.stored[0][1], int)
+    # The point that was sent is left as it was.
+    assert points[0]["fields"]["value"] == 1.0
+
+
+@pytest.mark.historian
+def test_each_batch_reported_handled():
+    historian = InfluxdbHistorian.__new__(InfluxdbHistorian)
+    historian._client = FakeClient(rejected=['broken'])
+    historian._batch_size = 2
+    historian._time_precision = None
+    historian._topic_id_map = {}
+    historian._meta_dicts = {}
+    reported = []
+    historian.report_handled = reported.append
+
+    ts = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    rows = [{'timestamp': ts, 'source': 'scrape', 'topic': 'campus/building/device/' + measurement,
+             'value': 1.0, 'meta': {'type': 'float'}}
+            for measurement in ['temp', 'humidity', 'broken', 'pressure', 'flow']]
+    rows.insert(2, {'timestamp': ts, 'source': 'record', 'topic': 'record/note',
+                    'value': 'text', 'meta': {}})
+    historian.publish_to_historian(rows)
+
+    # The record row right away, then each batch once it was written, with
+    # the point the database rejected dropped from the cache too.
+    assert reported == [rows[2], [rows[0], rows[1]], [rows[4], rows[3]], [rows[5]]]
+
+
+@pytest.mark.historian
+@pytest.mark.parametrize('error', [
+    ('{"error":"authorization failed"}', 401),
+    ('{"error":"database not found: \\"historian\\""}', 404),
+    ('{"error":"unable to parse points"}', 400)])
+def test_other_errors_keep_rows_in_cache(error):
+    client = FakeClient(error=InfluxDBClientError(*error))
+    points = make_points(['temp', 'count', 'temp', 'temp'])
+    with pytest.raises(InfluxDBClientError):
+        list(influxdbutils.insert_data_points(client, points))
+    # The batch is neither split nor cast.
+    assert client.writes == [('line', 4)]
+
+    historian = InfluxdbHistorian.__new__(InfluxdbHistorian)
+    # The meta of each of the four topics, then the first batch are written.
+    historian._client = FakeClient(error=InfluxDBClientError(*error), writes_before_error=5)
+    historian._batch_size = 2
+    historian._time_precision = None
+    historian._topic_id_map = {}
+    historian._meta_dicts = {}
+    reported = []
+    historian.report_handled = reported.append
+
+    ts = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    rows = [{'timestamp': ts, 'source': 'scrape', 'topic': 'campus/building/device/' + measurement,
+             'value': 1.0, 'meta': {'type': 'float'}}
+            for measurement in ['temp', 'humidity', 'pressure', 'flow']]
+    with pytest.raises(InfluxDBClientError):
+        historian.publish_to_historian(rows)
+    # Only the batch written before the error left the cache.
+    assert reported == [[rows[0], rows[1]]]
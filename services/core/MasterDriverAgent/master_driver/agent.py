@@ -39,6 +39,7 @@
 import logging
 import sys
 import gevent
+from gevent.pool import Pool
 from collections import defaultdict
 from volttron.platform.vip.agent import Agent, Core, RPC
 from volttron.platform.agent import utils
@@ -50,8 +51,15 @@ from datetime import datetime, timedelta
 import bisect
 import fnmatch
 from volttron.platform.agent import json as jsonapi
+from volttron.platform.scheduling import periodic
 from interfaces import DriverInterfaceError
 from driver_locks import configure_socket_lock, configure_publish_lock
+from scrape_scheduler import (ScrapeStatistics, plan_scrape_offsets, wrap_offset,
+                              PLANNING_PERCENTILE, RESCHEDULE_TOLERANCE)
+
+# Driver types whose devices are scraped together when they are reached
+# through the same gateway.
+SHARED_ENDPOINT_DRIVER_TYPES = ("modbus", "modbus_tk")
 
 utils.setup_logging()
 _log = logging.getLogger(__name__)
@@ -115,6 +123,12 @@ def master_driver_agent(config_path, **kwargs):
 
     group_offset_interval = get_config("group_offset_interval", 0.0)
 
+    adaptive_scheduling = bool(get_config("adaptive_scheduling", False))
+    max_concurrent_scrapes = get_config("max_concurrent_scrapes", 10)
+    reschedule_interval = get_config("reschedule_interval", 300.0)
+
+    max_concurrent_device_requests = get_config("max_concurrent_device_requests", 20)
+
     return MasterDriverAgent(driver_config_list, scalability_test,
                              scalability_test_iterations,
                              driver_scrape_interval,
@@ -126,6 +140,10 @@ def master_driver_agent(config_path, **kwargs):
                              publish_breadth_first_all,
                              publish_depth_first,
                              publish_breadth_first,
+                             adaptive_scheduling=adaptive_scheduling,
+                             max_concurrent_scrapes=max_concurrent_scrapes,
+                             reschedule_interval=reschedule_interval,
+                             max_concurrent_device_requests=max_concurrent_device_requests,
                              heartbeat_autostart=True, **kwargs)
 
 class MasterDriverAgent(Agent):
@@ -140,6 +158,10 @@ class MasterDriverAgent(Agent):
                  publish_breadth_first_all=False,
                  publish_depth_first=False,
                  publish_breadth_first=False,
+                 adaptive_scheduling=False,
+                 max_concurrent_scrapes=10,
+                 reschedule_interval=300.0,
+                 max_concurrent_device_requests=20,
                  **kwargs):
         super(MasterDriverAgent, self).__init__(**kwargs)
         self.instances = {}
@@ -160,8 +182,16 @@ class MasterDriverAgent(Agent):
         self.system_socket_limit = system_socket_limit
         self.freed_time_slots = defaultdict(list)
         self.group_counts = defaultdict(int)
+        self.endpoint_slots = {}
         self._name_map = {}
 
+        self.adaptive_scheduling = bool(adaptive_scheduling)
+        self.max_concurrent_scrapes = int(max_concurrent_scrapes)
+        self.reschedule_interval = float(reschedule_interval)
+        self.scrape_stats = {}
+        self._reschedule_event = None
+        self.max_concurrent_device_requests = int(max_concurrent_device_requests)
+
         self.publish_depth_first_all = bool(publish_depth_first_all)
         self.publish_breadth_first_all = bool(publish_breadth_first_all)
         self.publish_depth_first = bool(publish_depth_first)
@@ -185,7 +215,11 @@ class MasterDriverAgent(Agent):
                                "publish_depth_first_all": self.publish_depth_first_all,
                                "publish_breadth_first_all": self.publish_breadth_first_all,
                                "publish_depth_first": self.publish_depth_first,
-                               "publish_breadth_first": self.publish_breadth_first}
+                               "publish_breadth_first": self.publish_breadth_first,
+                               "adaptive_scheduling": self.adaptive_scheduling,
+                               "max_concurrent_scrapes": self.max_concurrent_scrapes,
+                               "reschedule_interval": self.reschedule_interval,
+                               "max_concurrent_device_requests": self.max_concurrent_device_requests}
 
         self.vip.config.set_default("config", self.default_config)
         self.vip.config.subscribe(self.configure_main, actions=["NEW", "UPDATE"], pattern="config")
@@ -313,11 +347,39 @@ class MasterDriverAgent(Agent):
             #Reset all scrape schedules
             self.freed_time_slots.clear()
             self.group_counts.clear()
+            self.endpoint_slots.clear()
             for driver in self.instances.itervalues():
-                time_slot = self.group_counts[driver.group]
+                time_slot = self.assign_time_slot(driver.group, self.derive_endpoint(driver.config))
                 driver.update_scrape_schedule(time_slot, self.driver_scrape_interval,
                                               driver.group, self.group_offset_interval)
-                self.group_counts[driver.group] += 1
+
+        try:
+            adaptive_scheduling = bool(config["adaptive_scheduling"])
+            max_concurrent_scrapes = int(config["max_concurrent_scrapes"])
+            reschedule_interval = float(config["reschedule_interval"])
+        except ValueError as e:
+            _log.error("ERROR PROCESSING CONFIGURATION: {}".format(e))
+            _log.error("Master driver adaptive scheduling settings unchanged")
+        else:
+            self.adaptive_scheduling = adaptive_scheduling
+            self.max_concurrent_scrapes = max_concurrent_scrapes
+            self.reschedule_interval = reschedule_interval
+
+        if self._reschedule_event is not None:
+            self._reschedule_event.cancel()
+            self._reschedule_event = None
+        if self.adaptive_scheduling and self.reschedule_interval > 0:
+            _log.info("Rescheduling device scrapes every {} seconds with at most {} "
+                      "running at once".format(self.reschedule_interval, self.max_concurrent_scrapes))
+            self._reschedule_event = self.core.schedule(
+                periodic(self.reschedule_interval, start=timedelta(seconds=self.reschedule_interval)),
+                self.reschedule_scrapes)
+
+        try:
+            self.max_concurrent_device_requests = int(config["max_concurrent_device_requests"])
+        except ValueError as e:
+            _log.error("ERROR PROCESSING CONFIGURATION: {}".format(e))
+            _log.error("Master driver max_concurrent_device_requests unchanged")
 
         self.publish_depth_first_all = bool(config["publish_depth_first_all"])
         self.publish_breadth_first_all = bool(config["publish_breadth_first_all"])
@@ -335,10 +397,95 @@ class MasterDriverAgent(Agent):
         _, topic = config_name.split('/', 1)
         return topic
 
+    def derive_endpoint(self, config):
+        """Devices behind the same Modbus gateway or on the same serial line
+        share an endpoint. Returns None for devices that do not."""
+        driver_type = config.get("driver_type")
+        if driver_type not in SHARED_ENDPOINT_DRIVER_TYPES:
+            return None
+        driver_config = config.get("driver_config", {})
+        address = driver_config.get("device_address")
+        if address is None:
+            return None
+        return driver_type, address, str(driver_config.get("port", ""))
+
+    def assign_time_slot(self, group, endpoint=None):
+        """Devices sharing an endpoint share a time slot so their reads
+        reach the endpoint together and go out over one connection."""
+        if endpoint is not None:
+            shared = self.endpoint_slots.get((group, endpoint))
+            if shared is not None:
+                shared[1] += 1
+                return shared[0]
+
+        slot = self.group_counts[group]
+
+        if self.freed_time_slots[group]:
+            slot = self.freed_time_slots[group].pop(0)
+
+        self.group_counts[group] += 1
+
+        if endpoint is not None:
+            self.endpoint_slots[(group, endpoint)] = [slot, 1]
+
+        return slot
+
+    def release_time_slot(self, group, slot, endpoint=None):
+        if endpoint is not None:
+            shared = self.endpoint_slots[(group, endpoint)]
+            shared[1] -= 1
+            if shared[1]:
+                return
+            del self.endpoint_slots[(group, endpoint)]
+
+        bisect.insort(self.freed_time_slots[group], slot)
+        self.group_counts[group] -= 1
+
+    def estimated_scrape_time(self, device_topic):
+        stats = self.scrape_stats.get(device_topic)
+        duration = stats.percentile(PLANNING_PERCENTILE) if stats is not None else None
+        if duration is None:
+            return self.driver_scrape_interval
+        return duration
+
+    def reschedule_scrapes(self):
+        """Spread out the start of device scrapes in each group using how
+        long each device has recently taken to scrape, so that no more than
+        max_concurrent_scrapes are expected to run at once. Devices sharing
+        an endpoint keep sharing a start time. Small changes are ignored so
+        that devices are not moved on every call as their statistics
+        drift."""
+        groups = defaultdict(list)
+        units = {}
+        for topic, driver in sorted(self.instances.iteritems(), key=lambda item: item[1].time_slot):
+            key = (driver.group, self.derive_endpoint(driver.config) or topic)
+            unit = units.get(key)
+            if unit is None:
+                unit = units[key] = [[], 0.0]
+                groups[driver.group].append(key)
+            unit[0].append(driver)
+            unit[1] += self.estimated_scrape_time(topic)
+
+        for group, keys in groups.iteritems():
+            offsets = plan_scrape_offsets([(key, units[key][1]) for key in keys],
+                                          self.driver_scrape_interval, self.max_concurrent_scrapes)
+            for key in keys:
+                offset = offsets[key] + group * self.group_offset_interval
+                for driver in units[key][0]:
+                    if abs(driver.time_slot_offset - wrap_offset(offset, driver.interval)) > RESCHEDULE_TOLERANCE:
+                        driver.update_scrape_offset(offset)
+
+    def scrape_completed(self, device_topic, duration, success):
+        stats = self.scrape_stats.get(device_topic)
+        if stats is None:
+            stats = self.scrape_stats[device_topic] = ScrapeStatistics()
+        stats.record(duration, success)
+
     def stop_driver(self, device_topic):
         real_name = self._name_map.pop(device_topic.lower(), device_topic)
 
         driver = self.instances.pop(real_name, None)
+        self.scrape_stats.pop(real_name, None)
 
         if driver is None:
             return
@@ -350,8 +497,7 @@ class MasterDriverAgent(Agent):
         except StandardError as e:
             _log.error("Failure during {} driver shutdown: {}".format(real_name, e))
 
-        bisect.insort(self.freed_time_slots[driver.group], driver.time_slot)
-        self.group_counts[driver.group] -= 1
+        self.release_time_slot(driver.group, driver.time_slot, self.derive_endpoint(driver.config))
 
 
     def update_driver(self, config_name, action, contents):
@@ -360,10 +506,7 @@ class MasterDriverAgent(Agent):
 
         group = int(contents.get("group", 0))
 
-        slot = self.group_counts[group]
-
-        if self.freed_time_slots[group]:
-            slot = self.freed_time_slots[group].pop(0)
+        slot = self.assign_time_slot(group, self.derive_endpoint(contents))
 
         _log.info("Starting driver: {}".format(topic))
         driver = DriverAgent(self, contents, slot, self.driver_scrape_interval, topic,
@@ -374,7 +517,6 @@ class MasterDriverAgent(Agent):
                              self.publish_breadth_first)
         gevent.spawn(driver.core.run)
         self.instances[topic] = driver
-        self.group_counts[group] += 1
         self._name_map[topic.lower()] = topic
         self._update_override_state(topic, 'add')
 
@@ -428,6 +570,33 @@ class MasterDriverAgent(Agent):
                 _log.info("Std dev publish time: "+str(stdev))
                 sys.exit(0)
 
+    @RPC.export
+    def get_scrape_statistics(self, path=None):
+        """RPC method
+
+        Return recent scrape durations in seconds and failure counts.
+
+        :param path: device path, or None for every device
+        :type path: str
+        :return: dictionary of device path to a dictionary with the count,
+                 failures, failure_rate, last, p50, p90, p99 and max of the
+                 recent scrapes and the current scrape offset
+        :rtype: dict
+        """
+        if path is not None:
+            path = self._name_map.get(path.lower(), path)
+            topics = [path] if path in self.instances else []
+        else:
+            topics = self.instances.keys()
+
+        result = {}
+        for topic in topics:
+            stats = self.scrape_stats.get(topic) or ScrapeStatistics()
+            summary = stats.summary()
+            summary["offset"] = self.instances[topic].time_slot_offset
+            result[topic] = summary
+        return result
+
     @RPC.export
     def get_point(self, path, point_name, **kwargs):
         """RPC method
@@ -488,6 +657,79 @@ class MasterDriverAgent(Agent):
                 "Cannot set point on device {} since global override is set".format(path))
         else:
             return self.instances[path].set_multiple_points(point_names_values, **kwargs)
+
+    @RPC.export
+    def get_multiple_devices_points(self, device_points, **kwargs):
+        """RPC method
+
+        Read points on many devices with one call. Devices are read concurrently, at most
+        max_concurrent_device_requests at a time.
+        :param device_points: device paths to lists of point names
+        :type device_points: dict
+        :param kwargs: additional arguments for the devices
+        :type arguments pointer
+        :returns: Dictionary of points to values and dictionary of points to errors
+        :rtype: (dict, dict)
+        """
+        results = {}
+        errors = {}
+
+        def get_points(path, point_names):
+            return self.instances[path].get_multiple_points(point_names, **kwargs)
+
+        for path, point_names, result, error in self._call_devices(get_points, device_points):
+            if error is not None:
+                for point_name in point_names:
+                    errors[path + '/' + point_name] = repr(error)
+            else:
+                r, e = result
+                results.update(r)
+                errors.update(e)
+
+        return results, errors
+
+    @RPC.export
+    def set_multiple_devices_points(self, device_points_values, **kwargs):
+        """RPC method
+
+        Set points on many devices with one call. Devices are written concurrently, at most
+        max_concurrent_device_requests at a time. Devices under global override are not written
+        and report an OverrideError for each point.
+        :param device_points_values: device paths to lists of points and corresponding values
+        :type device_points_values: dict
+        :param kwargs: additional arguments for the devices
+        :type arguments pointer
+        :returns: Dictionary of points to any exceptions raised
+        :rtype: dict
+        """
+        def set_points(path, point_names_values):
+            if path in self._override_devices:
+                raise OverrideError(
+                    "Cannot set point on device {} since global override is set".format(path))
+            return self.instances[path].set_multiple_points(point_names_values, **kwargs)
+
+        errors = {}
+        for path, point_names_values, result, error in self._call_devices(set_points, device_points_values):
+            if error is not None:
+                for point_name, _ in point_names_values:
+                    errors[path + '/' + point_name] = repr(error)
+            else:
+                errors.update(result)
+
+        return errors
+
+    def _call_devices(self, method, device_args):
+        """Call method(path, args) for each device in its own greenlet and yield
+        (path, args, result, error) tuples as the calls finish."""
+        def call(item):
+            path, args = item
+            try:
+                return path, args, method(path, args), None
+            except Exception as e:
+                return path, args, None, e
+
+        pool = Pool(max(1, self.max_concurrent_device_requests))
+        return pool.imap_unordered(call, device_args.items())
     
     @RPC.export
     def heart_beat(self):
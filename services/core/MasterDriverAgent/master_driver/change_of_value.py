@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+import logging
+
+_log = logging.getLogger(__name__)
+
+NUMERIC_TYPES = ('integer', 'float')
+
+
+class ChangeOfValueFilter(object):
+    """Picks out the points of a scrape that are worth publishing.
+
+    A numeric point is published when it has moved more than its deadband
+    away from the value last published for it. The deadband is the larger of
+    an absolute deadband and a percent of the last published value. Any
+    other point is published whenever its value changes. Points that have
+    not been published for max_silence seconds are published even if
+    unchanged, and every full_publish_every scrapes everything is published.
+
+    The device configuration sets the defaults with change_deadband,
+    change_deadband_percent, max_silence and full_publish_every.
+    point_deadbands may override the first three for individual points:
+
+        "point_deadbands": {"ZoneTemp": {"deadband": 0.5},
+                            "DamperPosition": {"deadband_percent": 2,
+                                               "max_silence": 900}}
+    """
+    def __init__(self, config, meta_data):
+        self.deadband = float(config.get("change_deadband", 0.0))
+        self.deadband_percent = float(config.get("change_deadband_percent", 0.0))
+        self.max_silence = float(config.get("max_silence", 0.0))
+        self.full_publish_every = int(config.get("full_publish_every", 0))
+
+        self.point_settings = {}
+        for point, settings in config.get("point_deadbands", {}).iteritems():
+            if point not in meta_data:
+                _log.warning("point_deadbands setting for unknown point {}".format(point))
+                continue
+            self.point_settings[point] = (float(settings.get("deadband", self.deadband)),
+                                          float(settings.get("deadband_percent", self.deadband_percent)),
+                                          float(settings.get("max_silence", self.max_silence)))
+
+        self.numeric_points = set(point for point, meta in meta_data.iteritems()
+                                  if meta.get('type') in NUMERIC_TYPES)
+        self.default_settings = (self.deadband, self.deadband_percent, self.max_silence)
+        self._last_published = {}
+        self._scrape_count = 0
+
+    def filter(self, results, now):
+        """Returns the points in results to publish for a scrape at now
+        (a datetime), and whether this is a full publish of every point."""
+        full = not self._last_published or (self.full_publish_every > 0 and
+                                             self._scrape_count % self.full_publish_every == 0)
+        self._scrape_count += 1
+
+        changed = {}
+        for point, value in results.iteritems():
+            last = self._last_published.get(point)
+            if full or last is None or self._should_publish(point, value, last, now):
+                changed[point] = value
+                self._last_published[point] = (value, now)
+
+        return changed, full
+
+    def _should_publish(self, point, value, last, now):
+        last_value, last_time = last
+        deadband, deadband_percent, max_silence = self.point_settings.get(point, self.default_settings)
+
+        if max_silence > 0 and (now - last_time).total_seconds() >= max_silence:
+            return True
+
+        if value == last_value:
+            return False
+
+        if point not in self.numeric_points:
+            return True
+
+        try:
+            threshold = max(deadband, abs(last_value) * deadband_percent / 100.0)
+            return abs(value - last_value) > threshold
+        except TypeError:
+            # A point that could not be read properly changes type.
+            return True
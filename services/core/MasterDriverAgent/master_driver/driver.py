@@ -50,7 +50,10 @@ from volttron.platform.messaging.topics import (DRIVER_TOPIC_BASE,
 
 from volttron.platform.vip.agent.errors import VIPError, Again
 from driver_locks import publish_lock
+from change_of_value import ChangeOfValueFilter
+from scrape_scheduler import wrap_offset
 import datetime
+from monotonic import monotonic
 
 utils.setup_logging()
 _log = logging.getLogger(__name__)
@@ -89,6 +92,7 @@ class DriverAgent(BasicAgent):
 
         self.interval = interval
         self.periodic_read_event = None
+        self.next_periodic_read = None
 
         self.update_scrape_schedule(time_slot, driver_scrape_interval, group, group_offset_interval)
 
@@ -105,27 +109,40 @@ class DriverAgent(BasicAgent):
 
 
     def update_scrape_schedule(self, time_slot, driver_scrape_interval, group, group_offset_interval):
-        self.time_slot_offset = (time_slot * driver_scrape_interval) + (group * group_offset_interval)
         self.time_slot = time_slot
         self.group = group
 
-        _log.debug("{} group: {}, time_slot: {}, offset: {}".format(self.device_path, group,
-                                                                    time_slot, self.time_slot_offset))
+        _log.debug("{} group: {}, time_slot: {}".format(self.device_path, group, time_slot))
 
-        if self.time_slot_offset >= self.interval:
+        self.update_scrape_offset((time_slot * driver_scrape_interval) + (group * group_offset_interval))
+
+    def update_scrape_offset(self, time_slot_offset):
+        """Set how many seconds into each interval the device is scraped.
+
+        The pending scrape moves within its own interval so that changing
+        the offset neither skips nor repeats a scrape. A scrape moved to
+        before the current time happens right away."""
+        _log.debug("{} offset: {}".format(self.device_path, time_slot_offset))
+
+        if time_slot_offset >= self.interval:
             _log.warning(
                 "Scrape offset exceeds interval. Required adjustment will cause scrapes to double up with other devices.")
-            while self.time_slot_offset >= self.interval:
-                self.time_slot_offset -= self.interval
+            time_slot_offset = wrap_offset(time_slot_offset, self.interval)
 
         #check weather or not we have run our starting method.
         if not self.periodic_read_event:
+            self.time_slot_offset = time_slot_offset
             return
 
+        moved = time_slot_offset - self.time_slot_offset
+        self.time_slot_offset = time_slot_offset
+
         self.periodic_read_event.cancel()
 
-        next_periodic_read = self.find_starting_datetime(utils.get_aware_utc_now())
+        self.schedule_periodic_read(self.next_periodic_read + datetime.timedelta(seconds=moved))
 
+    def schedule_periodic_read(self, next_periodic_read):
+        self.next_periodic_read = next_periodic_read
         self.periodic_read_event = self.core.schedule(next_periodic_read, self.periodic_read, next_periodic_read)
 
 
@@ -164,9 +181,7 @@ class DriverAgent(BasicAgent):
         # interval = self.config.get("interval", 60)
         # self.core.periodic(interval, self.periodic_read, wait=None)
 
-        next_periodic_read = self.find_starting_datetime(utils.get_aware_utc_now())
-
-        self.periodic_read_event = self.core.schedule(next_periodic_read, self.periodic_read, next_periodic_read)
+        self.schedule_periodic_read(self.find_starting_datetime(utils.get_aware_utc_now()))
 
         self.all_path_depth, self.all_path_breadth = self.get_paths_for_point(DRIVER_TOPIC_ALL)
 
@@ -201,6 +216,10 @@ class DriverAgent(BasicAgent):
                                      'type': ts_type,
                                      'tz': config.get('timezone', '')}
 
+        self.change_filter = None
+        if config.get("publish_on_change", False):
+            self.change_filter = ChangeOfValueFilter(config, self.meta_data)
+
         self.base_topic = DEVICES_VALUE(campus='',
                                         building='',
                                         unit='',
@@ -215,6 +234,10 @@ class DriverAgent(BasicAgent):
                                         path=self.device_path,
                                         point='')
 
+        # Topics are built once here rather than for every point of every scrape.
+        self.point_topics = dict((point, self.get_paths_for_point(point))
+                                 for point in self.interface.get_register_names())
+
         # self.parent.device_startup_callback(self.device_name, self)
 
 
@@ -231,14 +254,15 @@ class DriverAgent(BasicAgent):
         if test_now - next_scrape_time > datetime.timedelta(seconds=self.interval):
             next_scrape_time = self.find_starting_datetime(test_now)
 
-        _log.debug("{} next scrape scheduled: {}".format(self.device_path, next_scrape_time))
+        _log.debug("%s next scrape scheduled: %s", self.device_path, next_scrape_time)
 
-        self.periodic_read_event = self.core.schedule(next_scrape_time, self.periodic_read, next_scrape_time)
+        self.schedule_periodic_read(next_scrape_time)
 
-        _log.debug("scraping device: " + self.device_name)
+        _log.debug("scraping device: %s", self.device_name)
 
         self.parent.scrape_starting(self.device_name)
 
+        scrape_start = monotonic()
         try:
             results = self.interface.scrape_all()
             register_names = self.interface.get_register_names_view()
@@ -246,15 +270,29 @@ class DriverAgent(BasicAgent):
                 depth_first_topic = self.base_topic(point=point)
                 _log.error("Failed to scrape point: "+depth_first_topic)
         except (Exception, gevent.Timeout) as ex:
+            self.parent.scrape_completed(self.device_path, monotonic() - scrape_start, False)
             tb = traceback.format_exc()
             _log.error('Failed to scrape ' + self.device_name + ':\n' + tb)
             return
 
+        self.parent.scrape_completed(self.device_path, monotonic() - scrape_start, bool(results))
+
         # XXX: Does a warning need to be printed?
         if not results:
             return
 
         utcnow = utils.get_aware_utc_now()
+
+        meta_data = self.meta_data
+        if self.change_filter is not None:
+            results, full = self.change_filter.filter(results, utcnow)
+            if not results:
+                _log.debug("no changes to publish for " + self.device_name)
+                self.parent.scrape_ending(self.device_name)
+                return
+            if not full:
+                meta_data = dict((point, self.meta_data[point]) for point in results)
+
         utcnow_string = utils.format_timestamp(utcnow)
         sync_timestamp = utils.format_timestamp(now - datetime.timedelta(seconds=self.time_slot_offset))
 
@@ -266,31 +304,30 @@ class DriverAgent(BasicAgent):
 
 
 
+        # Everything from one scrape is published as a single batch.
+        items = []
+
         if self.publish_depth_first or self.publish_breadth_first:
+            point_topics = self.point_topics
             for point, value in results.iteritems():
-                depth_first_topic, breadth_first_topic = self.get_paths_for_point(point)
+                depth_first_topic, breadth_first_topic = point_topics[point]
                 message = [value, self.meta_data[point]]
 
                 if self.publish_depth_first:
-                    self._publish_wrapper(depth_first_topic,
-                                          headers=headers,
-                                          message=message)
+                    items.append((depth_first_topic, headers, message))
 
                 if self.publish_breadth_first:
-                    self._publish_wrapper(breadth_first_topic,
-                                          headers=headers,
-                                          message=message)
+                    items.append((breadth_first_topic, headers, message))
 
-        message = [results, self.meta_data]
+        message = [results, meta_data]
         if self.publish_depth_first_all:
-            self._publish_wrapper(self.all_path_depth,
-                                  headers=headers,
-                                  message=message)
+            items.append((self.all_path_depth, headers, message))
 
         if self.publish_breadth_first_all:
-            self._publish_wrapper(self.all_path_breadth,
-                                  headers=headers,
-                                  message=message)
+            items.append((self.all_path_breadth, headers, message))
+
+        if items:
+            self._publish_many_wrapper(items)
 
         self.parent.scrape_ending(self.device_name)
 
@@ -299,13 +336,13 @@ class DriverAgent(BasicAgent):
         while True:
             try:
                 with publish_lock():
-                    _log.debug("publishing: " + topic)
+                    _log.debug("publishing: %s", topic)
                     self.vip.pubsub.publish('pubsub',
                                         topic,
                                         headers=headers,
                                         message=message).get(timeout=10.0)
 
-                    _log.debug("finish publishing: " + topic)
+                    _log.debug("finish publishing: %s", topic)
             except gevent.Timeout:
                 _log.warn("Did not receive confirmation of publish to "+topic)
                 break
@@ -319,6 +356,26 @@ class DriverAgent(BasicAgent):
                 break
 
 
+    def _publish_many_wrapper(self, items):
+        while True:
+            try:
+                with publish_lock():
+                    _log.debug("publishing %d topics for %s", len(items), self.device_name)
+                    self.vip.pubsub.publish_many('pubsub', items).get(timeout=10.0)
+                    _log.debug("finish publishing %s", self.device_name)
+            except gevent.Timeout:
+                _log.warn("Did not receive confirmation of publish for " + self.device_name)
+                break
+            except Again:
+                _log.warn("publish delayed: " + self.device_name + " pubsub is busy")
+                gevent.sleep(random.random())
+            except VIPError as ex:
+                _log.warn("driver failed to publish " + self.device_name + ": " + str(ex))
+                break
+            else:
+                break
+
+
     def heart_beat(self):
         if self.heart_beat_point is None:
             return
@@ -383,8 +440,7 @@ class DriverAgent(BasicAgent):
             all_message = [results, meta]
             individual_point_message = [value, self.meta_data[point_name]]
 
-            depth_first_topic, breadth_first_topic = self.get_paths_for_point(
-                point_name)
+            depth_first_topic, breadth_first_topic = self.point_topics[point_name]
 
             if self.publish_depth_first:
                 self._publish_wrapper(depth_first_topic,
@@ -60,6 +60,21 @@ def socket_lock():
         yield 
     finally:
         _socket_lock.release()
+
+def acquire_socket_lock(blocking=True):
+    """Take a socket from the budget for a socket that stays open past a
+    single call. Returns False if blocking is False and none are left."""
+    global _socket_lock
+    if _socket_lock is None:
+        raise RuntimeError("socket_lock not configured!")
+    return _socket_lock.acquire(blocking=blocking)
+
+def release_socket_lock():
+    """Return a socket taken with acquire_socket_lock to the budget."""
+    global _socket_lock
+    if _socket_lock is None:
+        raise RuntimeError("socket_lock not configured!")
+    _socket_lock.release()
         
 _publish_lock = None
 
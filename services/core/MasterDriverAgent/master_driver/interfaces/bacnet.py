@@ -58,7 +58,7 @@ from datetime import datetime, timedelta
 
 from master_driver.driver_exceptions import DriverConfigError
 from volttron.platform.vip.agent import errors
-from volttron.platform.jsonrpc import RemoteError
+from volttron.platform.jsonrpc import RemoteError, MethodNotFound
 
 #Logging is completely configured by now.
 _log = logging.getLogger(__name__)
@@ -84,6 +84,10 @@ class Interface(BaseInterface):
         self.register_count = 10000
         self.register_count_divisor = 1
         self.cov_points = []
+        # Handle of the point map registered with the proxy. None until
+        # the first scrape registers it, False if the proxy is too old to
+        # support registration.
+        self.point_map_handle = None
 
     def configure(self, config_dict, registry_config_str):
         self.min_priority = config_dict.get("min_priority", 8)
@@ -164,7 +168,7 @@ class Interface(BaseInterface):
         result = self.vip.rpc.call(self.proxy_address, 'write_property', *args).get(timeout=self.timeout)
         return result
 
-    def scrape_all(self):
+    def get_proxy_point_map(self):
         #TODO: support reading from an array.
         point_map = {}
         read_registers = self.get_registers_by_type("byte", True)
@@ -175,12 +179,39 @@ class Interface(BaseInterface):
                                               register.instance_number,
                                               register.property,
                                               register.index]
+        return point_map
+
+    def read_point_map(self):
+        """Read every point, sending the point map to the proxy only once
+        when the proxy supports registering it."""
+        if not self.use_read_multiple or self.point_map_handle is False:
+            return self.vip.rpc.call(self.proxy_address, 'read_properties',
+                                     self.target_address, self.get_proxy_point_map(),
+                                     self.max_per_request, self.use_read_multiple).get(timeout=self.timeout)
 
+        for _ in range(2):
+            try:
+                if self.point_map_handle is None:
+                    self.point_map_handle = self.vip.rpc.call(self.proxy_address, 'register_point_map',
+                                                              self.target_address,
+                                                              self.get_proxy_point_map()).get(timeout=self.timeout)
+                return self.vip.rpc.call(self.proxy_address, 'read_registered_properties',
+                                         self.point_map_handle, self.max_per_request).get(timeout=self.timeout)
+            except MethodNotFound:
+                _log.info("BACnet proxy does not support registered point maps.")
+                self.point_map_handle = False
+                return self.read_point_map()
+            except RemoteError as e:
+                # The proxy forgets registered maps when it restarts.
+                if not e.exc_info.get('exc_type', '').endswith('UnknownPointMap'):
+                    raise
+                self.point_map_handle = None
+        raise RuntimeError("BACnet proxy did not accept the point map for " + str(self.target_address))
+
+    def scrape_all(self):
         while True:
             try:
-                result = self.vip.rpc.call(self.proxy_address, 'read_properties',
-                                               self.target_address, point_map,
-                                               self.max_per_request, self.use_read_multiple).get(timeout=self.timeout)
+                result = self.read_point_map()
             except RemoteError as e:
                 if "segmentationNotSupported" in e.message:
                     if self.max_per_request <= 1:
@@ -84,7 +84,7 @@ type_mapping = {"string": str,
 point_name_mapping = {"Status.TimeStamp": "TimeStamp"}
 
 service = {}
-gevent.spawn(async.web_service)
+gevent.spawn(async.web_service, async.web_service_queue)
 
 
 def recursive_asdict(d):
@@ -139,6 +139,8 @@ class ChargepointRegister(BaseRegister):
         self.attribute_name = attribute_name
         self.username = username
         self.timeout = timeout
+        # Station group (sgID) to query as a whole instead of this station alone.
+        self.group_id = None
 
         if default_value:
             self.value = default_value
@@ -164,6 +166,33 @@ class ChargepointRegister(BaseRegister):
                 _log.error("{0} cannot be cast to {1}".format(value, data_type))
                 return None
 
+    def station_request(self, method_name, **kwargs):
+        """Make a cached API request for this register's station and return the response.
+
+        Registers of a driver configured with a station group query the whole group instead, following every page
+        of the reply. Those requests are identical for every station of the group so the async service makes them
+        once, and each register takes its own station's part of the response. A station missing from a group reply
+        that could not be read to the end is queried alone.
+
+        :param method_name: Name of the CPService method to call.
+        :param kwargs: Further query parameters, used only for single station requests.
+        """
+        global service
+        method = getattr(service[self.username], method_name)
+        if self.group_id is None:
+            return async.CPRequest.request(method, self.timeout, stationID=self.station_id, **kwargs).get()
+
+        response = async.CPRequest.request(service[self.username].get_all_pages, self.timeout, method_name,
+                                           sgID=self.group_id).get()
+        if isinstance(response, cps.CPAPIException):
+            return response
+        station_response = response.for_station(self.station_id, kwargs.get('portNumber'))
+        if station_response.responseCode == cps.CPAPI_NO_DATA and response.more_records:
+            _log.warning('{0} reply for station group {1} is incomplete and does not include station {2}, '
+                         'querying the station alone.'.format(method_name, self.group_id, self.station_id))
+            return async.CPRequest.request(method, self.timeout, stationID=self.station_id, **kwargs).get()
+        return station_response
+
     def read_only_check(self):
         if self.read_only:
             raise IOError("Trying to write to a point configured read only: {0}".format(self.attribute_name))
@@ -224,11 +253,7 @@ class StationRegister(ChargepointRegister):
 
     @property
     def value(self):
-        global service
-        method = service[self.username].getStations
-        result = async.CPRequest.request(method, self.timeout, stationID=self.station_id)
-        result.wait()
-        return self.get_register(result.value, method)
+        return self.get_register(self.station_request('getStations'), 'getStations')
 
     @value.setter
     def value(self, x):
@@ -265,11 +290,7 @@ class LoadRegister(ChargepointRegister):
 
     @property
     def value(self):
-        global service
-        method = service[self.username].getLoad
-        result = async.CPRequest.request(method, self.timeout, stationID=self.station_id)
-        result.wait()
-        return self.get_register(result.value, method)
+        return self.get_register(self.station_request('getLoad'), 'getLoad')
 
     @value.setter
     def value(self, x):
@@ -343,18 +364,13 @@ class AlarmRegister(ChargepointRegister):
 
     @property
     def value(self):
-        global service
-
         if self.attribute_name == 'clearAlarms':
             return False
-        method = service[self.username].getAlarms
-        kwargs = {'stationID': self.station_id}
+        kwargs = {}
         if self.port:
             kwargs['portNumber'] = self.port
 
-        result = async.CPRequest.request(method, self.timeout, **kwargs)
-        result.wait()
-        return self.get_register(result.value, method, False)
+        return self.get_register(self.station_request('getAlarms', **kwargs), 'getAlarms', False)
 
     @value.setter
     def value(self, x):
@@ -590,6 +606,7 @@ class Interface(BasicRevert, BaseInterface):
                 username=config_dict['username'],
                 timeout=config_dict['cacheExpiration']
             )
+            register.group_id = config_dict.get('sgID')
 
             self.insert_register(register)
 
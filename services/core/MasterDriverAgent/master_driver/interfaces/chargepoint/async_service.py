@@ -72,6 +72,13 @@ The request and response is left in the dictionary until a configurable expirati
 time so that subsequent requests with the same signature can use the cached result
 if it has not expired.  In this case, the AsyncResult is set immediately.
 
+The signature is made from the account name, the method name and its parameters,
+so drivers for different stations of one account share responses to identical
+requests. The expiration time is counted from when the response arrives; a request
+still waiting on its response never expires, so identical requests are always
+coalesced into one call. Failed calls are not cached and expired responses are
+swept out of the dictionary periodically.
+
 """
 from __future__ import print_function
 import gevent
@@ -91,6 +98,9 @@ SERVICE_WSDL_URL = "https://webservices.chargepoint.com/cp_api_5.0.wsdl"
 # web_service() greenlet.
 web_service_queue = gevent.queue.Queue()
 
+# Seconds between sweeps of expired responses out of the cache.
+CACHE_SWEEP_INTERVAL = 300
+
 
 class CPRequest (object):
     """ Encapsulates a method to be called asynchronously.
@@ -110,7 +120,6 @@ class CPRequest (object):
         @param kwargs
         """
         self._method = method
-        self._client = method.__self__._client
         self._timeout = timeout
         self._args = args
         self._kwargs = kwargs
@@ -130,7 +139,9 @@ class CPRequest (object):
         return True
 
     def key(self):
-        return self._method.__str__() + self._args.__str__() + self._kwargs.__str__()
+        username = getattr(self._method.__self__, '_username', None)
+        return '{0}.{1}{2}{3}'.format(username, self._method.__name__, self._args,
+                                       sorted(self._kwargs.items()))
 
     def result(self):
         return self._result
@@ -181,21 +192,23 @@ class CPResponse (object):
         return self._client
 
 
-def web_call(request, client):
+def web_call(request, client, queue):
     """Wraps the request to be executed.
 
         This is spawned as a greenlet and puts the
         request result on the queue.
     """
-    global web_service_queue
     try:
         request._method.__self__.set_client(client)
         response = request._method(*request._args, **request._kwargs)
     except CPAPIException as exception:
         _log.warning(exception)
         response = exception
+    except Exception as exception:
+        _log.error('{0} failed: {1}'.format(request.key(), exception))
+        response = exception
 
-    web_service_queue.put(CPResponse(request.key(), response, client))
+    queue.put(CPResponse(request.key(), response, client))
 
 
 class CacheItem (object):
@@ -211,7 +224,8 @@ class CacheItem (object):
         self._request = None
         self._response = None
         self._waiting_results = set()
-        self._expiration = datetime.utcnow() + timedelta(seconds=cache_life)
+        self._cache_life = cache_life
+        self._expiration = None
 
     @property
     def request(self):
@@ -228,6 +242,7 @@ class CacheItem (object):
     @response.setter
     def response(self, r):
         self._response = r
+        self._expiration = datetime.utcnow() + timedelta(seconds=self._cache_life)
 
     @property
     def waiting_results(self):
@@ -237,8 +252,13 @@ class CacheItem (object):
     def expiration(self):
         return self._expiration
 
+    def expired(self, now):
+        """True once the response is older than the cache life. Never true while
+        the response is still pending."""
+        return self._expiration is not None and self._expiration < now
 
-def web_service():
+
+def web_service(queue=None, client_factory=None):
     """Cache/service request loop.
 
        Reads items from the web_service_queue.  It is intended to be spawned as a greenlet
@@ -249,21 +269,33 @@ def web_service():
 
        If the de-queued item is a CPResponse, the item is found in cache and all waiting
        AsyncResults are set with the response.  The response will stay in cache until expiration.
+       A call that failed with anything other than a CPAPIException raises that exception in
+       the waiting greenlets and is dropped from cache.
 
     """
 
-    global web_service_queue
+    if queue is None:
+        queue = web_service_queue
+    if client_factory is None:
+        client_factory = lambda: suds.client.Client(SERVICE_WSDL_URL)
     web_cache = dict()
     client_set = set()
+    next_sweep = datetime.utcnow() + timedelta(seconds=CACHE_SWEEP_INTERVAL)
+
+    for item in queue:
+        now = datetime.utcnow()
+        if now > next_sweep:
+            for key in [key for key, cached in web_cache.items() if cached.expired(now)]:
+                del web_cache[key]
+            next_sweep = now + timedelta(seconds=CACHE_SWEEP_INTERVAL)
 
-    for item in web_service_queue:
         if item.is_request():
             # Item is a request to make an async call.
 
             item_key = item.key()
             # _log.info("START {0}".format(item_key))
             # First deal with expiration, popping anything that is too old.
-            if item_key in web_cache and web_cache[item_key].expiration < datetime.utcnow():
+            if item_key in web_cache and web_cache[item_key].expired(now):
                 web_cache.pop(item_key)
             cached_request = web_cache.get(item_key, None)
             if cached_request:
@@ -284,15 +316,21 @@ def web_service():
                 web_cache[item_key] = cache_item
 
                 if not client_set:
-                    client_set.add(suds.client.Client(SERVICE_WSDL_URL))
+                    client_set.add(client_factory())
                 client = client_set.pop()
-                gevent.spawn(web_call, item, client)
+                gevent.spawn(web_call, item, client, queue)
 
         else:  # Handle response
 
-            cached_request = web_cache.get(item.key())
-            cached_request.response = item.response()
-            for result in cached_request.waiting_results:
-                result.set(cached_request.response)
             client_set.add(item.client)
+            response = item.response()
+            if isinstance(response, Exception) and not isinstance(response, CPAPIException):
+                cached_request = web_cache.pop(item.key())
+                for result in cached_request.waiting_results:
+                    result.set_exception(response)
+            else:
+                cached_request = web_cache.get(item.key())
+                cached_request.response = response
+                for result in cached_request.waiting_results:
+                    result.set(cached_request.response)
             cached_request.waiting_results.clear()
@@ -52,6 +52,7 @@
 #
 # }}}
 import suds.client
+import suds.sudsobject
 import suds.wsse
 import logging
 
@@ -60,6 +61,7 @@ logger = logging.getLogger('chargepoint')
 SERVICE_WSDL_URL = "https://webservices.chargepoint.com/cp_api_5.0.wsdl"
 
 CPAPI_SUCCESS = '100'
+CPAPI_NO_DATA = '153'
 
 XMPP_EVENTS = [
     'station_charging_session_start',
@@ -398,8 +400,14 @@ class CPAPIResponse(object):
     :property responseText: Short description of the designation for the API call
 
     :method is_successful: Returns Boolean value checking whether or not responseCode is set to '100.'
+    :method for_station: Returns the part of a response to a query covering many stations that
+    describes one station.
+    :property more_records: True if the reply is one page of a longer result, with the rest left to query.
     """
 
+    # Name of the reply list holding one item per station, for responses that can be split by station.
+    station_list = None
+
     def __init__(self, response):
         self.response = response
 
@@ -414,6 +422,33 @@ class CPAPIResponse(object):
     def is_successful(self):
         return self.responseCode == CPAPI_SUCCESS
 
+    @property
+    def more_records(self):
+        return bool(int(getattr(self.response, 'moreFlag', 0) or 0))
+
+    def for_station(self, station_id, port_number=None):
+        """Split a response to a group or organization wide query back out to one station.
+
+        :param station_id: ID of the station to keep.
+        :param port_number: (Optional) Only keep items for this port, for replies listing ports individually.
+
+        :return: Response of the same type holding only the items for the station. If there are none the
+        response code is '153', as it is when a single station query finds nothing.
+        """
+        if not self.is_successful():
+            return self
+
+        items = [item for item in getattr(self.response, self.station_list, [])
+                 if item.stationID == station_id and
+                 (port_number is None or 'portNumber' not in item or
+                  item.portNumber is None or int(item.portNumber) == port_number)]
+        if items:
+            reply = {'responseCode': self.responseCode, 'responseText': self.responseText}
+        else:
+            reply = {'responseCode': CPAPI_NO_DATA, 'responseText': 'No data for station {0}'.format(station_id)}
+        reply[self.station_list] = items
+        return type(self)(suds.sudsobject.Factory.object('reply', reply))
+
     @staticmethod
     def is_not_found(name):
         logger.warning("{0} not found in result set.".format(name))
@@ -474,6 +509,8 @@ class CPAPIResponse(object):
 
 
 class CPAPIGetAlarmsResponse(CPAPIResponse):
+    station_list = 'Alarms'
+
     def __init__(self, response):
         super(CPAPIGetAlarmsResponse, self).__init__(response)
 
@@ -546,6 +583,8 @@ class CPAPIGetStationStatusResponse(CPAPIResponse):
 
 
 class CPAPIGetStationsResponse(CPAPIResponse):
+    station_list = 'stationData'
+
     def __init__(self, response):
         super(CPAPIGetStationsResponse, self).__init__(response)
 
@@ -733,6 +772,8 @@ class CPAPIGetStationRightsResponse(CPAPIResponse):
 
 
 class CPAPIGetLoadResponse(CPAPIResponse):
+    station_list = 'stationData'
+
     def __init__(self, response):
         super(CPAPIGetLoadResponse, self).__init__(response)
 
@@ -826,6 +867,41 @@ class CPService(object):
         self._suds_client = client
         self.set_security_token()
 
+    def get_all_pages(self, method_name, **kwargs):
+        """Call a query method until its reply no longer sets moreFlag and return one response holding the items of
+        every page.
+
+        getStations and getAlarms split long results into pages, each reply setting moreFlag if there are more
+        records to fetch starting at startRecord. Replies of other methods are returned as they are.
+
+        :param method_name: Name of the CPService method to call.
+        :param **kwargs: Query parameters of the method, other than startRecord.
+
+        :returns Response of the type the method returns. If a page fails, the response for that page. If a page
+        comes back empty while still setting moreFlag, the records so far with moreFlag left set.
+        """
+        method = getattr(self, method_name)
+        response = method(**kwargs)
+        if response.station_list is None or not response.is_successful() or not response.more_records:
+            return response
+
+        items = list(getattr(response.response, response.station_list, []))
+        while response.more_records:
+            page = method(startRecord=len(items) + 1, **kwargs)
+            if not page.is_successful():
+                return page
+            page_items = getattr(page.response, page.station_list, [])
+            if not page_items:
+                logger.warning("{0} returned an empty page at record {1} for {2}".format(method_name,
+                                                                                           len(items) + 1, kwargs))
+                break
+            items.extend(page_items)
+            response = page
+
+        reply = {'responseCode': response.responseCode, 'responseText': response.responseText,
+                 response.station_list: items, 'moreFlag': 1 if response.more_records else 0}
+        return type(response)(suds.sudsobject.Factory.object('reply', reply))
+
     def clearAlarms(self, **kwargs):
         """Clears the Alarms of given group or station based on given query parameters.
 
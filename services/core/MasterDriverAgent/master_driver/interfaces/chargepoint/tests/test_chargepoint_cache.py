@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+
+# Copyright (c) 2016, SLAC National Laboratory / Kisensum Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in
+#    the documentation and/or other materials provided with the
+#    distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation
+# are those of the authors and should not be interpreted as representing
+# official policies, either expressed or implied, of the FreeBSD
+# Project.
+#
+# This material was prepared as an account of work sponsored by an
+# agency of the United States Government.  Neither the United States
+# Government nor the United States Department of Energy, nor SLAC / Kisensum,
+# nor any of their employees, nor any jurisdiction or organization that
+# has cooperated in the development of these materials, makes any
+# warranty, express or implied, or assumes any legal liability or
+# responsibility for the accuracy, completeness, or usefulness or any
+# information, apparatus, product, software, or process disclosed, or
+# represents that its use would not infringe privately owned rights.
+#
+# Reference herein to any specific commercial product, process, or
+# service by trade name, trademark, manufacturer, or otherwise does not
+# necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# SLAC / Kisensum. The views and opinions of authors
+# expressed herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# }}}
+import gevent
+import gevent.queue
+import pytest
+from suds.sudsobject import Factory
+
+from master_driver.interfaces import chargepoint
+from master_driver.interfaces.chargepoint import async_service
+
+# The package keeps its CPService objects in a dict named service, hiding the module of that name.
+cps = chargepoint.cps
+
+
+def reply(list_name, items, more=0):
+    return Factory.object('reply', {'responseCode': '100', 'responseText': 'OK', 'moreFlag': more,
+                                    list_name: [Factory.object('item', item) for item in items]})
+
+
+def load_data(station_id, load):
+    return {'stationID': station_id, 'stationLoad': load,
+            'Port': [Factory.object('stationPortData', {'portNumber': '1', 'portLoad': load})]}
+
+
+class StubService(object):
+    """Stands in for CPService, answering like the web service after a delay."""
+
+    get_all_pages = cps.CPService.__dict__['get_all_pages']
+
+    def __init__(self):
+        self._username = 'user'
+        self.calls = []
+        self.stations = {'1:001': 1.5, '1:002': 2.5, '1:003': 3.5}
+        # getAlarms replies hold page_size records, the last page_limit pages are never returned.
+        self.alarms = [{'stationID': '1:00{0}'.format(i), 'portNumber': None, 'alarmType': 'Alarm{0}'.format(i)}
+                       for i in range(1, 6)]
+        self.page_size = 2
+        self.page_limit = None
+
+    def set_client(self, client):
+        pass
+
+    def getAlarms(self, **kwargs):
+        self.calls.append(('getAlarms', kwargs))
+        if 'sgID' not in kwargs:
+            return cps.CPAPIGetAlarmsResponse(reply('Alarms', [alarm for alarm in self.alarms
+                                                               if alarm['stationID'] == kwargs['stationID']]))
+        start = kwargs.get('startRecord', 1) - 1
+        end = start + self.page_size
+        if self.page_limit is not None:
+            end = min(end, self.page_limit)
+        return cps.CPAPIGetAlarmsResponse(reply('Alarms', self.alarms[start:end], int(end < len(self.alarms))))
+
+    def getLoad(self, **kwargs):
+        self.calls.append(('getLoad', kwargs))
+        gevent.sleep(0.01)
+        if 'sgID' in kwargs:
+            stations = sorted(self.stations.items())
+        else:
+            stations = [(kwargs['stationID'], self.stations[kwargs['stationID']])]
+        return cps.CPAPIGetLoadResponse(reply('stationData', [load_data(s, l) for s, l in stations]))
+
+    def getStations(self, **kwargs):
+        self.calls.append(('getStations', kwargs))
+        raise IOError('connection reset')
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    queue = gevent.queue.Queue()
+    monkeypatch.setattr(async_service, 'web_service_queue', queue)
+    worker = gevent.spawn(async_service.web_service, queue, lambda: object())
+    stub = StubService()
+    monkeypatch.setitem(chargepoint.service, 'user', stub)
+    yield stub
+    worker.kill()
+
+
+@pytest.mark.driver
+def test_identical_requests_are_coalesced(stub):
+    results = [async_service.CPRequest.request(stub.getLoad, 0, stationID='1:001') for _ in range(5)]
+    assert set(result.get(timeout=1).stationLoad()[0] for result in results) == {1.5}
+    assert len(stub.calls) == 1
+
+    # Once the response has expired the next request goes to the service.
+    gevent.sleep(0.01)
+    async_service.CPRequest.request(stub.getLoad, 0, stationID='1:001').get(timeout=1)
+    assert len(stub.calls) == 2
+
+    # Responses are reused while they are fresh.
+    for _ in range(3):
+        async_service.CPRequest.request(stub.getLoad, 60, stationID='1:002').get(timeout=1)
+    assert len(stub.calls) == 3
+
+
+@pytest.mark.driver
+def test_failures_reach_every_caller_and_are_not_cached(stub):
+    results = [async_service.CPRequest.request(stub.getStations, 60, stationID='1:001') for _ in range(3)]
+    for result in results:
+        with pytest.raises(IOError):
+            result.get(timeout=1)
+    assert len(stub.calls) == 1
+
+    with pytest.raises(IOError):
+        async_service.CPRequest.request(stub.getStations, 60, stationID='1:001').get(timeout=1)
+    assert len(stub.calls) == 2
+
+
+@pytest.mark.driver
+def test_group_registers_share_one_request(stub):
+    registers = []
+    for station_id in sorted(stub.stations):
+        register = chargepoint.LoadRegister(True, 'Load', 'portLoad', 'kW', float, station_id,
+                                            port_number='1', username='user', timeout=60)
+        register.group_id = 'group'
+        registers.append(register)
+
+    values = [gevent.spawn(lambda r: r.value, register) for register in registers]
+    gevent.joinall(values, timeout=1)
+    assert [value.value for value in values] == [1.5, 2.5, 3.5]
+    assert stub.calls == [('getLoad', {'sgID': 'group'})]
+
+
+def alarm_registers(station_ids):
+    registers = []
+    for station_id in station_ids:
+        register = chargepoint.AlarmRegister(True, 'Alarm', 'alarmType', '', str, station_id, username='user',
+                                             timeout=60)
+        register.group_id = 'group'
+        registers.append(register)
+    return registers
+
+
+@pytest.mark.driver
+def test_group_reply_pages_are_merged(stub):
+    registers = alarm_registers(['1:001', '1:003', '1:005'])
+    values = [gevent.spawn(lambda r: r.value, register) for register in registers]
+    gevent.joinall(values, timeout=1)
+    assert [value.value for value in values] == ['Alarm1', 'Alarm3', 'Alarm5']
+    assert stub.calls == [('getAlarms', {'sgID': 'group'}),
+                          ('getAlarms', {'sgID': 'group', 'startRecord': 3}),
+                          ('getAlarms', {'sgID': 'group', 'startRecord': 5})]
+
+
+@pytest.mark.driver
+def test_station_missing_from_incomplete_reply_queried_alone(stub):
+    stub.page_limit = 3
+    first, last = alarm_registers(['1:001', '1:005'])
+    assert first.value == 'Alarm1'
+    assert last.value == 'Alarm5'
+    assert stub.calls[-1] == ('getAlarms', {'stationID': '1:005'})
+    assert len(stub.calls) == 4
+
+
+@pytest.mark.driver
+def test_response_split_by_station_and_port():
+    alarms = cps.CPAPIGetAlarmsResponse(reply('Alarms', [
+        {'stationID': '1:001', 'portNumber': '1', 'alarmType': 'Unreachable'},
+        {'stationID': '1:001', 'portNumber': '2', 'alarmType': 'Reachable'},
+        {'stationID': '1:002', 'portNumber': None, 'alarmType': 'Tamper'}]))
+
+    assert alarms.for_station('1:001').alarmType() == ['Unreachable', 'Reachable']
+    assert alarms.for_station('1:001', 2).alarmType() == ['Reachable']
+    assert alarms.for_station('1:002', 1).alarmType() == ['Tamper']
+
+    missing = alarms.for_station('1:003')
+    assert missing.responseCode == cps.CPAPI_NO_DATA
+    with pytest.raises(cps.CPAPIException):
+        missing.alarms
@@ -54,25 +54,27 @@ monkey.patch_socket()
 from pymodbus.client.sync import ModbusTcpClient as SyncModbusClient  
 from pymodbus.exceptions import ConnectionException, ModbusIOException, ModbusException
 from pymodbus.pdu import ExceptionResponse
+from pymodbus.bit_read_message import ReadCoilsRequest, ReadDiscreteInputsRequest
+from pymodbus.register_read_message import ReadHoldingRegistersRequest, ReadInputRegistersRequest
 from pymodbus.constants import Defaults
 from volttron.platform.agent import utils
 
 from master_driver.interfaces import BaseInterface, BaseRegister, BasicRevert, DriverInterfaceError
+from master_driver.interfaces.modbus_blocks import plan_blocks, request_count, DEFAULT_MAX_READ_GAP
 
 import struct
 import logging
+import select
+import socket
 from csv import DictReader
 from StringIO import StringIO
 import os.path
 
-from contextlib import contextmanager, closing
-from master_driver.driver_locks import socket_lock
-
-@contextmanager
-def modbus_client(address, port):
-    with socket_lock():
-        with closing(SyncModbusClient(address, port)) as client:
-            yield client
+from contextlib import contextmanager
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from monotonic import monotonic
+from master_driver.driver_locks import acquire_socket_lock, release_socket_lock
 
 modbus_logger = logging.getLogger("pymodbus")
 modbus_logger.setLevel(logging.WARNING)
@@ -80,8 +82,29 @@ modbus_logger.setLevel(logging.WARNING)
 utils.setup_logging()
 _log = logging.getLogger(__name__)
 
+# Seconds an unused connection stays open.
+IDLE_TIMEOUT = 300.0
+# Seconds to wait before reconnecting after the first failed attempt,
+# doubling with each further failure up to MAX_BACKOFF.
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+# Transaction id, protocol id, length and unit id of a Modbus TCP frame.
+MBAP_HEADER = struct.Struct(">HHHB")
+
+# Number of requests a device may have waiting for a response at once.
+# Many gateways only handle one at a time, so this is opt in.
+DEFAULT_PIPELINE_DEPTH = 1
+
+READ_REQUESTS = {('byte', True): ReadInputRegistersRequest,
+                 ('byte', False): ReadHoldingRegistersRequest,
+                 ('bit', True): ReadDiscreteInputsRequest,
+                 ('bit', False): ReadCoilsRequest}
+
 MODBUS_REGISTER_SIZE = 2
 MODBUS_READ_MAX = 100
+# Most registers a Modbus PDU can carry in one read.
+MODBUS_REGISTER_READ_LIMIT = 125
 PYMODBUS_REGISTER_STRUCT = struct.Struct('>H')
 
 path = os.path.dirname(os.path.abspath(__file__))
@@ -91,6 +114,263 @@ configFile = os.path.join(path, "example.csv")
 class ModbusInterfaceException(ModbusException):
     pass
 
+
+class _PooledConnection(object):
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self.client = None
+        self.lock = Semaphore()
+        self.last_used = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+        self.pending = []
+
+
+class _PipelineBatch(object):
+    def __init__(self, requests, depth):
+        self.requests = requests
+        self.depth = depth
+        self.result = AsyncResult()
+
+
+class ModbusConnectionPool(object):
+    """Long lived Modbus TCP connections shared by every device at the same
+    address and port.
+
+    Each open connection holds one socket from the max_open_sockets budget
+    until it is closed. When the budget is used up the least recently used
+    idle connection is closed to make room, or if every connection is in use
+    the caller waits until one is returned and closed for it. Connections are
+    checked before
+    reuse, closed after an error or after sitting idle for idle_timeout
+    seconds, and reconnects to an unreachable device back off exponentially
+    up to max_backoff seconds.
+
+    Reads for several devices behind the same gateway are coalesced by
+    read_pipelined into one stream of requests over the shared connection.
+    """
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, min_backoff=MIN_BACKOFF,
+                 max_backoff=MAX_BACKOFF):
+        self.idle_timeout = idle_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._connections = {}
+        # Callers waiting for a socket from the budget.
+        self._waiting = 0
+
+    def connection(self, address, port):
+        return self._connection(self._entry(address, port))
+
+    def read_pipelined(self, address, port, requests, depth=1):
+        """Send read requests to the device at address and port and return
+        the responses in the same order.
+
+        Requests queued by other devices on the same gateway while the
+        connection is busy are sent along with these in a single stream,
+        keeping up to depth requests in flight at once.
+        """
+        entry = self._entry(address, port)
+        batch = _PipelineBatch(requests, depth)
+        entry.pending.append(batch)
+        try:
+            with entry.lock:
+                # Another device may already have sent our requests with its own.
+                if entry.pending:
+                    batches, entry.pending = entry.pending, []
+                    self._run_batches(entry, batches)
+        finally:
+            self._checked_in()
+        return batch.result.get()
+
+    def _run_batches(self, entry, batches):
+        requests = [request for batch in batches for request in batch.requests]
+        depth = min(batch.depth for batch in batches)
+        try:
+            client = self._checkout(entry)
+            responses = pipeline_requests(client, requests, depth)
+        except BaseException as e:
+            # Every device waiting on this stream has to hear about the
+            # failure, including a Timeout or kill of the greenlet sending it.
+            self._close(entry)
+            for batch in batches:
+                batch.result.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        entry.last_used = monotonic()
+        start = 0
+        for batch in batches:
+            end = start + len(batch.requests)
+            batch.result.set(responses[start:end])
+            start = end
+
+    def _entry(self, address, port):
+        key = (address, port)
+        entry = self._connections.get(key)
+        if entry is None:
+            entry = self._connections[key] = _PooledConnection(address, port)
+        return entry
+
+    @contextmanager
+    def _connection(self, entry):
+        try:
+            with entry.lock:
+                client = self._checkout(entry)
+                try:
+                    yield client
+                except (ConnectionException, ModbusIOException, ModbusInterfaceException):
+                    # The state of the connection is unknown after an error.
+                    self._close(entry)
+                    raise
+                entry.last_used = monotonic()
+        finally:
+            self._checked_in()
+
+    def _checked_in(self):
+        # A connection was just returned. Close one for a caller waiting on
+        # the socket budget, idle connections only give theirs back once
+        # they are closed.
+        if self._waiting:
+            self._close_least_recently_used()
+        self.evict_idle()
+
+    def evict_idle(self):
+        """Close connections that have not been used for idle_timeout seconds."""
+        cutoff = monotonic() - self.idle_timeout
+        for entry in self._connections.values():
+            if (entry.client is not None and entry.last_used < cutoff and
+                    not entry.lock.locked()):
+                self._close(entry)
+
+    def close_all(self):
+        for entry in self._connections.values():
+            self._close(entry)
+
+    def _checkout(self, entry):
+        if entry.client is not None:
+            if _is_socket_alive(entry.client):
+                return entry.client
+            _log.debug("Modbus connection to {}:{} was closed, reconnecting".format(entry.address, entry.port))
+            self._close(entry)
+
+        now = monotonic()
+        if now < entry.retry_at:
+            raise ConnectionException("Not reconnecting to {}:{} for another {:.1f} seconds".format(
+                entry.address, entry.port, entry.retry_at - now))
+
+        if not acquire_socket_lock(blocking=False):
+            self._close_least_recently_used()
+            self._waiting += 1
+            try:
+                acquire_socket_lock()
+            finally:
+                self._waiting -= 1
+
+        client = SyncModbusClient(entry.address, entry.port)
+        if not client.connect():
+            client.close()
+            release_socket_lock()
+            entry.failures += 1
+            backoff = min(self.min_backoff * 2 ** (entry.failures - 1), self.max_backoff)
+            entry.retry_at = monotonic() + backoff
+            raise ConnectionException("Failed to connect to {}:{}, retrying in {} seconds".format(
+                entry.address, entry.port, backoff))
+
+        entry.client = client
+        entry.failures = 0
+        entry.retry_at = 0.0
+        return client
+
+    def _close(self, entry):
+        if entry.client is None:
+            return
+        try:
+            entry.client.close()
+        finally:
+            entry.client = None
+            release_socket_lock()
+
+    def _close_least_recently_used(self):
+        idle = [entry for entry in self._connections.values()
+                if entry.client is not None and not entry.lock.locked()]
+        if idle:
+            self._close(min(idle, key=lambda entry: entry.last_used))
+
+
+def _is_socket_alive(client):
+    """A connection is reusable if its socket has nothing waiting to be
+    read. Readable means the device closed it or sent something unasked."""
+    sock = client.socket
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+        return False
+    return not readable
+
+
+def pipeline_requests(client, requests, depth=1):
+    """Send requests over an open client connection with up to depth of
+    them waiting for a response at once. Responses are matched to requests
+    by transaction id and returned in request order."""
+    sock = client.socket
+    # pymodbus leaves the socket non-blocking after its own reads.
+    sock.settimeout(client.timeout)
+    responses = [None] * len(requests)
+    in_flight = {}
+    buffered = b''
+    position = 0
+    try:
+        while position < len(requests) or in_flight:
+            while position < len(requests) and len(in_flight) < depth:
+                request = requests[position]
+                request.transaction_id = client.transaction.getNextTID()
+                sock.sendall(client.framer.buildPacket(request))
+                in_flight[request.transaction_id] = position
+                position += 1
+
+            transaction_id, pdu, buffered = _read_frame(sock, buffered)
+            index = in_flight.pop(transaction_id, None)
+            if index is None:
+                _log.warning("Discarding Modbus response with unknown transaction id {}".format(transaction_id))
+                continue
+            response = client.framer.decoder.decode(pdu)
+            if response is None:
+                raise ModbusIOException("Unable to decode response to {}".format(requests[index]))
+            response.transaction_id = transaction_id
+            responses[index] = response
+    except socket.error as e:
+        raise ModbusIOException("Modbus connection failed: {}".format(e))
+    return responses
+
+
+def _read_frame(sock, buffered):
+    while len(buffered) < MBAP_HEADER.size:
+        buffered += _recv(sock)
+    transaction_id, _, length, _ = MBAP_HEADER.unpack_from(buffered)
+    # The length counts the unit id, which is part of the header.
+    end = MBAP_HEADER.size + length - 1
+    while len(buffered) < end:
+        buffered += _recv(sock)
+    return transaction_id, buffered[MBAP_HEADER.size:end], buffered[end:]
+
+
+def _recv(sock):
+    data = sock.recv(4096)
+    if not data:
+        raise ConnectionException("Connection closed by device")
+    return data
+
+
+_connection_pool = ModbusConnectionPool()
+
+
+def modbus_client(address, port):
+    return _connection_pool.connection(address, port)
+
+
 class ModbusRegisterBase(BaseRegister):
     def __init__(self, address, register_type, read_only, pointName, units, description = '', slave_id=0):
         super(ModbusRegisterBase, self).__init__(register_type, read_only, pointName, units, description = '')
@@ -202,6 +482,9 @@ class ModbusByteRegister(ModbusRegisterBase):
     
         
 class Interface(BasicRevert, BaseInterface):
+    max_read_gap = DEFAULT_MAX_READ_GAP
+    max_read_count = MODBUS_READ_MAX
+
     def __init__(self, **kwargs):
         super(Interface, self).__init__(**kwargs)
         self.build_ranges_map()
@@ -210,7 +493,13 @@ class Interface(BasicRevert, BaseInterface):
         self.slave_id=config_dict.get("slave_id", 0)
         self.ip_address = config_dict["device_address"]
         self.port = config_dict.get("port", Defaults.Port)
+        self.pipeline_depth = max(int(config_dict.get("pipeline_depth", DEFAULT_PIPELINE_DEPTH)), 1)
+        self.max_read_gap = max(int(config_dict.get("max_read_gap", DEFAULT_MAX_READ_GAP)), 0)
+        self.max_read_count = min(max(int(config_dict.get("max_read_count", MODBUS_READ_MAX)), 1),
+                                  MODBUS_REGISTER_READ_LIMIT)
         self.parse_config(registry_config_str) 
+        _log.info("{}: {} points read with {} requests".format(self.device_path, len(self.point_map),
+                                                                 self.planned_request_count()))
         
     def build_ranges_map(self):
         self.register_ranges = {('byte',True):[],
@@ -232,35 +521,27 @@ class Interface(BasicRevert, BaseInterface):
 
 
     def merge_register_ranges(self):
-        """Merges any adjacent registers for more efficient scraping.
+        """Merges registers into as few blocks as max_read_gap and
+           max_read_count allow for more efficient scraping.
            May only be called after all registers have been inserted."""
         for key, register_ranges in self.register_ranges.items():
-            if not register_ranges:
-                continue
-            register_ranges.sort()
-            result = []
-            current = register_ranges[0]
-            for register_range in register_ranges[1:]:
-                if register_range[0] > current[1] + 1:
-                    result.append(current)
-                    current = register_range
-                    continue
-
-                current[1] = register_range[1]
-                current[2].extend(register_range[2])
+            ranges = [(start, end, register) for start, end, registers in register_ranges
+                      for register in registers]
+            self.register_ranges[key] = plan_blocks(ranges, self.max_read_gap, self.max_read_count)
 
-            result.append(current)
-
-            self.register_ranges[key] = result
+    def planned_request_count(self):
+        """Number of read requests a full scrape of the device takes."""
+        return sum(request_count(register_ranges, self.max_read_count)
+                   for register_ranges in self.register_ranges.itervalues())
 
         
     def get_point(self, point_name):    
         register = self.get_register_by_name(point_name)
-        with modbus_client(self.ip_address, self.port) as client:
-            try:
+        try:
+            with modbus_client(self.ip_address, self.port) as client:
                 result = register.get_state(client)
-            except (ConnectionException, ModbusIOException, ModbusInterfaceException):
-                result = None
+        except (ConnectionException, ModbusIOException, ModbusInterfaceException):
+            result = None
         return result
     
     def _set_point(self, point_name, value):    
@@ -268,31 +549,45 @@ class Interface(BasicRevert, BaseInterface):
         if register.read_only:
             raise  IOError("Trying to write to a point configured read only: "+point_name)
 
-        with modbus_client(self.ip_address, self.port) as client:
-            try:
+        try:
+            with modbus_client(self.ip_address, self.port) as client:
                 result = register.set_state(client, value)
-            except (ConnectionException, ModbusIOException, ModbusInterfaceException) as ex:
-                IOError("Error encountered trying to write to point {}: {}".format(point_name, ex))
+        except (ConnectionException, ModbusIOException, ModbusInterfaceException) as ex:
+            raise IOError("Error encountered trying to write to point {}: {}".format(point_name, ex))
         return result
     
-    def scrape_byte_registers(self, client, read_only):
+    def read_requests(self):
+        """Build the requests for a scrape. Returns a list of
+        (register_type, start, registers, requests) tuples, one for each
+        merged range of registers."""
+        plan = []
+        for (register_type, read_only), register_ranges in self.register_ranges.iteritems():
+            request_class = READ_REQUESTS[(register_type, read_only)]
+            for start, end, registers in register_ranges:
+                requests = [request_class(group, min(end - group + 1, self.max_read_count), unit=self.slave_id)
+                            for group in xrange(start, end + 1, self.max_read_count)]
+                plan.append((register_type, start, registers, requests))
+        return plan
+
+    def parse_responses(self, plan, responses):
         result_dict = {}
-        register_ranges = self.register_ranges[('byte', read_only)]
-
-        read_func = client.read_input_registers if read_only else client.read_holding_registers
+        responses = iter(responses)
 
-        for register_range in register_ranges:
-            start, end, registers = register_range
-            result = ''
+        for register_type, start, registers, requests in plan:
+            result = '' if register_type == 'byte' else []
 
-            for group in xrange(start, end + 1, MODBUS_READ_MAX):
-                count = min(end - group + 1, MODBUS_READ_MAX)
-                response = read_func(group, count, unit=self.slave_id)
+            for request in requests:
+                response = next(responses)
                 if response is None:
                     raise ModbusInterfaceException("pymodbus returned None")
-                response_bytes = response.encode()
-                #Trim off length byte.
-                result += response_bytes[1:]
+                if response.isError():
+                    raise ModbusInterfaceException("Device returned {} for {}".format(response, request))
+                if register_type == 'byte':
+                    #Trim off length byte.
+                    result += response.encode()[1:]
+                else:
+                    #Coils come back padded to a whole byte.
+                    result += response.bits[:request.count]
 
             for register in registers:
                 point = register.point_name
@@ -300,48 +595,18 @@ class Interface(BasicRevert, BaseInterface):
                 result_dict[point] = value
 
         return result_dict
-    
-    def scrape_bit_registers(self, client, read_only):
-        result_dict = {}
-        register_ranges = self.register_ranges[('bit', read_only)]
-
-        for register_range in register_ranges:
-            start, end, registers = register_range
-            if not registers:
-                return result_dict
 
-            result = []
-
-            for group in xrange(start, end + 1, MODBUS_READ_MAX):
-                count = min(end - group + 1, MODBUS_READ_MAX)
-                response = client.read_discrete_inputs(group, count, unit=self.slave_id) if read_only else client.read_coils(group, count, unit=self.slave_id)
-                if response is None:
-                    raise ModbusInterfaceException("pymodbus returned None")
-                result += response.bits
-
-            for register in registers:
-                point = register.point_name
-                value = register.parse_value(start, result)
-                result_dict[point] = value
-            
-        return result_dict
-        
     def _scrape_all(self):
-        result_dict={}
-        with modbus_client(self.ip_address, self.port) as client:
-            try:
-                
-                result_dict.update(self.scrape_byte_registers(client, True))
-                result_dict.update(self.scrape_byte_registers(client, False))
-                
-                result_dict.update(self.scrape_bit_registers(client, True))
-                result_dict.update(self.scrape_bit_registers(client, False))
-            except (ConnectionException, ModbusIOException, ModbusInterfaceException) as e:
-                raise DriverInterfaceError ("Failed to scrape device at " + 
-                           self.ip_address + ":" + str(self.port) + " " + 
-                           "ID: " + str(self.slave_id) + str(e))
-                
-        return result_dict
+        plan = self.read_requests()
+        requests = [request for _, _, _, range_requests in plan for request in range_requests]
+        try:
+            responses = _connection_pool.read_pipelined(self.ip_address, self.port,
+                                                        requests, self.pipeline_depth)
+            return self.parse_responses(plan, responses)
+        except (ConnectionException, ModbusIOException, ModbusInterfaceException) as e:
+            raise DriverInterfaceError ("Failed to scrape device at " + 
+                       self.ip_address + ":" + str(self.port) + " " + 
+                       "ID: " + str(self.slave_id) + str(e))
     
     def parse_config(self, configDict):
         if configDict is None:
@@ -0,0 +1,105 @@
+#
+# Copyright (c) 2017, Battelle Memorial Institute
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and documentation are those
+# of the authors and should not be interpreted as representing official policies,
+# either expressed or implied, of the FreeBSD Project.
+#
+# This material was prepared as an account of work sponsored by an
+# agency of the United States Government.  Neither the United States
+# Government nor the United States Department of Energy, nor Battelle,
+# nor any of their employees, nor any jurisdiction or organization
+# that has cooperated in the development of these materials, makes
+# any warranty, express or implied, or assumes any legal liability
+# or responsibility for the accuracy, completeness, or usefulness or
+# any information, apparatus, product, software, or process disclosed,
+# or represents that its use would not infringe privately owned rights.
+#
+# Reference herein to any specific commercial product, process, or
+# service by trade name, trademark, manufacturer, or otherwise does
+# not necessarily constitute or imply its endorsement, recommendation,
+# r favoring by the United States Government or any agency thereof,
+# or Battelle Memorial Institute. The views and opinions of authors
+# expressed herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY
+# operated by BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+
+"""
+Plans the read requests for a Modbus scrape.
+
+Both Modbus interfaces describe the points on a device as ranges of
+register (or coil) addresses. plan_blocks groups those ranges into as few
+blocks as possible, each small enough for a single read request.
+"""
+
+# Most devices accept reads of this many registers in one request.
+DEFAULT_MAX_READ_COUNT = 100
+
+# By default only adjacent ranges are merged. Reading unconfigured
+# registers fails on some devices.
+DEFAULT_MAX_READ_GAP = 0
+
+
+def plan_blocks(ranges, max_gap=DEFAULT_MAX_READ_GAP, max_count=DEFAULT_MAX_READ_COUNT, can_merge=None):
+    """Group address ranges into blocks that can each be read with one
+    request.
+
+    :param ranges: (start, end, item) tuples, end inclusive.
+    :param max_gap: Most unconfigured addresses to read between two ranges
+                    to save a request.
+    :param max_count: Most addresses a single request may read.
+    :param can_merge: Optional function of (block, item) that returns False
+                      when item must not be added to block.
+    :returns: List of [start, end, items] blocks sorted by address.
+
+    Ranges are taken in address order and each one is added to the
+    current block whenever the gap and size limits allow. Because a block
+    is only closed when the next range cannot join it, no other grouping
+    needs fewer blocks. A single range larger than max_count gets a block
+    of its own.
+    """
+    blocks = []
+    current = None
+    for start, end, item in sorted(ranges, key=lambda r: (r[0], r[1])):
+        if (current is not None and
+                start - current[1] - 1 <= max_gap and
+                max(end, current[1]) - current[0] + 1 <= max_count and
+                (can_merge is None or can_merge(current, item))):
+            current[1] = max(end, current[1])
+            current[2].append(item)
+            continue
+
+        current = [start, end, [item]]
+        blocks.append(current)
+
+    return blocks
+
+
+def request_count(blocks, max_count=DEFAULT_MAX_READ_COUNT):
+    """Number of read requests needed for blocks, counting blocks longer
+    than max_count as several reads."""
+    return sum((end - start) // max_count + 1 for start, end, _ in blocks)
@@ -57,6 +57,7 @@ from volttron.platform.agent import utils
 from master_driver.interfaces import BaseRegister, BaseInterface, BasicRevert
 from master_driver.interfaces.modbus_tk import helpers
 from master_driver.interfaces.modbus_tk.maps import Map
+from master_driver.interfaces.modbus_tk.client import MAX_REQUEST_COUNT
 
 import logging
 import struct
@@ -80,7 +81,8 @@ parity_map = dict(
 )
 
 config_keys = ["name", "device_type", "device_address", "port", "slave_id", "baudrate", "bytesize", "parity",
-               "stopbits", "xonxoff", "addressing", "endian", "write_multiple_registers", "register_map"]
+               "stopbits", "xonxoff", "addressing", "endian", "write_multiple_registers", "register_map",
+               "max_read_gap", "max_read_count"]
 
 register_map_columns = ["register name", "address", "type", "units", "writable", "default value", "transform", "table",
                         "mixed endian", "description"]
@@ -278,6 +280,8 @@ class Interface(BasicRevert, BaseInterface):
         addressing = config_dict.get('addressing', helpers.OFFSET).lower()
         endian = config_dict.get('endian', 'big')
         write_single_values = not helpers.str2bool(str(config_dict.get('write_multiple_registers', "True")))
+        max_read_gap = config_dict.get('max_read_gap', None)
+        max_read_count = config_dict.get('max_read_count', None)
 
         # Convert original modbus csv config format to the new modbus_tk registry_config_lst
         if registry_config_lst and 'point address' in registry_config_lst[0]:
@@ -322,7 +326,10 @@ class Interface(BasicRevert, BaseInterface):
             name=name,
             addressing=addressing,
             endian=endian,
-            registry_config_lst=selected_registry_config_lst
+            registry_config_lst=selected_registry_config_lst,
+            max_read_gap=None if max_read_gap is None else max(int(max_read_gap), 0),
+            max_read_count=None if max_read_count is None else min(max(int(max_read_count), 1),
+                                                                   MAX_REQUEST_COUNT)
         ).get_class()
 
         self.modbus_client = modbus_client_class(device_address=device_address,
@@ -357,6 +364,9 @@ class Interface(BasicRevert, BaseInterface):
             if not register.read_only and register.default_value:
                 self.set_default(register.point_name, register.default_value)
 
+        _log.info("%s: %s points read with %s requests", name, len(selected_registry_config_lst),
+                  self.modbus_client.planned_request_count())
+
 
     def get_point(self, point_name):
         """
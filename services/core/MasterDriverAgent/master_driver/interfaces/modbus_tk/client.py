@@ -77,6 +77,7 @@
 from datetime import datetime
 import collections
 import struct
+import itertools
 import serial
 import six.moves
 import logging
@@ -86,11 +87,58 @@ import modbus_tk.defines as modbus_constants
 import modbus_tk.modbus_tcp as modbus_tcp
 import modbus_tk.modbus_rtu as modbus_rtu
 from modbus_tk.exceptions import ModbusError
+from gevent.lock import RLock
 
 import helpers
+from master_driver.interfaces.modbus_blocks import plan_blocks
 
 logger = logging.getLogger(__name__)
 
+# Devices behind the same gateway, or on the same serial line, share one
+# modbus_tk master and so one connection. The lock keeps the requests of
+# one device from interleaving with another's. Each entry is a list of the
+# master, its lock, the transport settings it was created with and the
+# number of clients using it.
+_shared_masters = {}
+
+
+def shared_master(key, factory, settings):
+    """
+    Get the master and lock shared by clients using the transport key,
+    creating the master with factory for the first of them. Every call must
+    be matched by a call to release_master.
+    """
+    try:
+        entry = _shared_masters[key]
+    except KeyError:
+        entry = _shared_masters[key] = [factory(), RLock(), settings, 0]
+    else:
+        if settings != entry[2]:
+            logger.warning("Transport settings {0} for {1} differ from {2} "
+                           "the shared master was created with, using "
+                           "those".format(settings, key, entry[2]))
+    entry[3] += 1
+    return entry[0], entry[1]
+
+
+def release_master(key):
+    """
+    Release the master shared under key, closing it once the last client
+    using it leaves.
+    """
+    entry = _shared_masters[key]
+    master, lock = entry[0], entry[1]
+    with lock:
+        entry[3] -= 1
+        if entry[3] == 0:
+            del _shared_masters[key]
+            master.close()
+
+
+# Most registers compile_requests puts in one request.
+MAX_REQUEST_COUNT = 123
+
+
 # In cache representation of modbus field.
 Datum = collections.namedtuple('Datum', ('value', 'timestamp'))
 
@@ -470,6 +518,12 @@ class Request (object):
         self._fields.append(field)
         self._next_address += struct_size / 2
 
+    def add_gap(self, count):
+        """Read count registers that no field uses, up to the next field."""
+        self._data_format += '{0}x'.format(count * 2)
+        self._count += count
+        self._next_address += count
+
     def block_info(self):
         return self._name, self._table, self._address, self._count
 
@@ -499,8 +553,21 @@ class Request (object):
             )
         return field_values
 
+    @staticmethod
+    def register_count(field):
+        """Number of registers (or coils) field takes up in a request."""
+        struct_size = struct.calcsize(field.format_string)
+        return (struct_size + 1) // 2
+
+    @staticmethod
+    def _can_merge(block, field):
+        first = block[2][0]
+        return not first.is_struct_format and not first.is_array_field and \
+            field.length == 1 and not field.byte_order and not field.is_struct_format and \
+            field.address > block[1]
+
     @classmethod
-    def compile_requests(cls, fields, byte_order):
+    def compile_requests(cls, fields, byte_order, max_gap=0, max_count=MAX_REQUEST_COUNT):
         """
 
         Creates a set of Modbus requests for the fields provided.  The fields
@@ -511,6 +578,9 @@ class Request (object):
 
         :param fields: List of fields sorted by address.
         :param byte_order: Byte order of the modbus slave.
+        :param max_gap: Most unused registers a request may read between two
+                        fields.  Only use this for read requests.
+        :param max_count: Most registers a request may read.
         :return: List of Requests
         """
         requests = list()
@@ -520,19 +590,19 @@ class Request (object):
 
         fields.sort(key=lambda f: f.table * 100000 + f.address)
 
-        # Set up the initial request before starting the loop
-        current_request = None
-
-        for f in fields:
-            # Decide if we need to start a new request
-
-            if current_request is None or not current_request.able_to_add(f):
-                current_request = Request(f, data_format=byte_order)
+        for table, table_fields in itertools.groupby(fields, key=lambda f: f.table):
+            # Coil values are not unpacked with a format string, so there is
+            # no way to skip over unused coils.
+            table_gap = max_gap if table in (helpers.REGISTER_READ_WRITE, helpers.REGISTER_READ_ONLY) else 0
+            ranges = [(f.address, f.address + cls.register_count(f) - 1, f) for f in table_fields]
+
+            for start, end, block_fields in plan_blocks(ranges, table_gap, max_count, can_merge=cls._can_merge):
+                current_request = Request(block_fields[0], data_format=byte_order)
+                for f in block_fields[1:]:
+                    if f.address > current_request._next_address:
+                        current_request.add_gap(f.address - current_request._next_address)
+                    current_request.add_field(f)
                 requests.append(current_request)
-                if f.is_struct_format or f.is_array_field:
-                    current_request = None
-            else:
-                current_request.add_field(f)
 
         return requests
 
@@ -548,6 +618,8 @@ class Client (object):
 
     byte_order = helpers.BIG_ENDIAN
     addressing = helpers.ADDRESS_OFFSET
+    max_read_gap = 0
+    max_read_count = MAX_REQUEST_COUNT
 
     __meta = None
 
@@ -563,7 +635,8 @@ class Client (object):
             # Maintain a list of fields sorted by address (ascending)
             meta[helpers.META_FIELDS] = list(meta.values())                         # Turns Python3 view into a list.
             meta[helpers.META_FIELDS].sort(key=lambda f: f.address)
-            meta[helpers.META_REQUESTS] = Request.compile_requests(meta[helpers.META_FIELDS], cls.byte_order)
+            meta[helpers.META_REQUESTS] = Request.compile_requests(meta[helpers.META_FIELDS], cls.byte_order,
+                                                                   cls.max_read_gap, cls.max_read_count)
             # Dictionary for easy lookup of the request that corresponds to a field.
             meta[helpers.META_REQUEST_MAP] = {field: request for request in meta[helpers.META_REQUESTS]
                                               for field in request._fields}
@@ -625,21 +698,35 @@ class Client (object):
                 self.client.set_timeout(1.0)
             self.client.set_verbose(verbose)
 
+        self._transport_lock = RLock()
+        self._master_key = None
         self._data = collections.OrderedDict()
         self._pending_writes = dict()
         self._error_count = 0
 
     def set_transport_tcp(self, hostname, port, timeout_in_sec=1.0):
-        self.client = modbus_tcp.TcpMaster(host=hostname, port=int(port), timeout_in_sec=timeout_in_sec)
+        self.close()
+        self._master_key = ('tcp', hostname, int(port))
+        self.client, self._transport_lock = shared_master(
+            self._master_key,
+            lambda: modbus_tcp.TcpMaster(host=hostname, port=int(port), timeout_in_sec=timeout_in_sec),
+            dict(timeout_in_sec=timeout_in_sec))
         return self
 
     def set_transport_rtu(self, device, baudrate, bytesize, parity, stopbits, xonxoff):
-        self.client = modbus_rtu.RtuMaster(
-            serial.Serial(device,
-                          baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits, xonxoff=xonxoff,
-                          rtscts=False, writeTimeout=None, dsrdtr=False, interCharTimeout=None)
-        )
-        self.client.set_timeout(1.0)
+        def rtu_master():
+            master = modbus_rtu.RtuMaster(
+                serial.Serial(device,
+                              baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits, xonxoff=xonxoff,
+                              rtscts=False, writeTimeout=None, dsrdtr=False, interCharTimeout=None)
+            )
+            master.set_timeout(1.0)
+            return master
+        self.close()
+        self._master_key = ('rtu', device)
+        self.client, self._transport_lock = shared_master(
+            self._master_key, rtu_master,
+            dict(baudrate=baudrate, bytesize=bytesize, parity=parity, stopbits=stopbits, xonxoff=xonxoff))
         return self
 
     def __str__(self):
@@ -661,6 +748,9 @@ class Client (object):
     def fields(self):
         return self.__meta[helpers.META_FIELDS]
 
+    def planned_request_count(self):
+        return len(self.__meta[helpers.META_REQUESTS])
+
     def field_by_name(self, name):
         return self.__meta.get(name, None)
 
@@ -699,8 +789,9 @@ class Client (object):
     def read_all(self):
         requests = self.__meta[helpers.META_REQUESTS]
         self._data.clear()
-        for r in requests:
-            self.read_request(r)
+        with self._transport_lock:
+            for r in requests:
+                self.read_request(r)
 
     def dump_all(self):
         self.read_all()
@@ -710,6 +801,10 @@ class Client (object):
 
     def write_all(self):
         logger.debug("In write_all")
+        with self._transport_lock:
+            self._write_all()
+
+    def _write_all(self):
         fields = list(self._pending_writes.keys())
         if self.write_single_values:
             # Convert values if necessary for transport as modbus supported types.
@@ -764,7 +859,13 @@ class Client (object):
         """
         request = self.get_request(field)
         if request:
-            self.read_request(request)
+            with self._transport_lock:
+                self.read_request(request)
 
     def close(self):
-        self.client.close()
+        if self._master_key is not None:
+            release_master(self._master_key)
+            self._master_key = None
+        elif hasattr(self, 'client'):
+            with self._transport_lock:
+                self.client.close()
@@ -258,7 +258,7 @@ class Map(object):
     """
 
     def __init__(self, file='', map_dir='', addressing='offset', name='', endian='big',
-                 description='', registry_config_lst=[]):
+                 description='', registry_config_lst=[], max_read_gap=None, max_read_count=None):
         self._filename = file
         self._map_dir = map_dir
 
@@ -276,6 +276,8 @@ class Map(object):
         self._description = description
         self._registry_config_lst = [dict((k.lower(), v) for k, v in i.iteritems()) for i in registry_config_lst]
         self._registers = dict()
+        self._max_read_gap = max_read_gap
+        self._max_read_count = max_read_count
 
     def _convert_csv_registers(self):
         """Loading contents of the csv into dictionary
@@ -311,6 +313,10 @@ class Map(object):
         """
         class_attrs = dict(byte_order=self._endian,
                            addressing=self._addressing)
+        if self._max_read_gap is not None:
+            class_attrs['max_read_gap'] = self._max_read_gap
+        if self._max_read_count is not None:
+            class_attrs['max_read_count'] = self._max_read_count
         self._load_registers()
         class_attrs.update(self._registers)
         modbus_client_class = type(self._name.replace(' ', '_'),
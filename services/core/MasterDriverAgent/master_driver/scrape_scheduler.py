@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+import heapq
+import math
+from collections import deque
+
+# Number of recent scrapes kept for each device.
+DEFAULT_WINDOW = 100
+
+# Percentile of recent scrape durations used to plan start times.
+PLANNING_PERCENTILE = 90
+
+# Devices whose planned start moves by less than this many seconds are left
+# where they are.
+RESCHEDULE_TOLERANCE = 1.0
+
+
+class ScrapeStatistics(object):
+    """Durations and outcomes of the recent scrapes of one device."""
+    def __init__(self, window=DEFAULT_WINDOW):
+        self.durations = deque(maxlen=window)
+        self.failed = deque(maxlen=window)
+        self.count = 0
+        self.failures = 0
+
+    def record(self, duration, success=True):
+        self.durations.append(duration)
+        self.failed.append(not success)
+        self.count += 1
+        if not success:
+            self.failures += 1
+
+    def percentile(self, percent):
+        """Nearest rank percentile of the recent scrape durations, or None
+        before the first scrape."""
+        if not self.durations:
+            return None
+        ordered = sorted(self.durations)
+        rank = int(math.ceil(percent / 100.0 * len(ordered)))
+        return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+    def failure_rate(self):
+        """Fraction of the recent scrapes that failed."""
+        if not self.failed:
+            return 0.0
+        return sum(self.failed) / float(len(self.failed))
+
+    def summary(self):
+        return {"count": self.count,
+                "failures": self.failures,
+                "failure_rate": self.failure_rate(),
+                "last": self.durations[-1] if self.durations else None,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "max": max(self.durations) if self.durations else None}
+
+
+def plan_scrape_offsets(durations, spacing, max_concurrent=0):
+    """Plan the start of each scrape in an interval.
+
+    :param durations: (key, expected duration) pairs in scrape order.
+    :param spacing: Least time between the start of two scrapes.
+    :param max_concurrent: Most scrapes to have running at once, or 0 for
+                           no limit.
+    :returns: Dictionary of key to start offset in seconds.
+
+    Each scrape starts spacing after the one before it, or once one of the
+    max_concurrent scrapes already planned is expected to have finished,
+    whichever is later.
+    """
+    offsets = {}
+    running = [0.0] * max_concurrent if max_concurrent > 0 else None
+    start = 0.0
+    for key, duration in durations:
+        if running is not None:
+            start = max(start, heapq.heappop(running))
+            heapq.heappush(running, start + duration)
+        offsets[key] = start
+        start += spacing
+    return offsets
+
+
+def wrap_offset(offset, interval):
+    """Bring a start offset of interval seconds or more back into the
+    interval."""
+    while offset >= interval:
+        offset -= interval
+    return offset
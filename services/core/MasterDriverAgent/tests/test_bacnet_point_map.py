@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+import pytest
+
+from master_driver.interfaces import bacnet
+from volttron.platform.jsonrpc import RemoteError, MethodNotFound
+
+registry_config = [{'Volttron Point Name': 'Point{0}'.format(i),
+                    'BACnet Object Type': 'analogInput',
+                    'Property': 'presentValue',
+                    'Writable': 'FALSE',
+                    'Index': str(i),
+                    'Units': 'degreesFahrenheit'} for i in range(5)]
+
+
+class FakeResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def get(self, timeout=None):
+        if isinstance(self.value, Exception):
+            raise self.value
+        return self.value
+
+
+class FakeProxy(object):
+    """Answers the proxy RPC calls made by the BACnet interface."""
+    def __init__(self, registration=True):
+        self.registration = registration
+        self.calls = []
+        self.point_maps = {}
+
+    def call(self, peer, method, *args):
+        self.calls.append(method)
+        return FakeResult(getattr(self, method)(*args))
+
+    def ping_device(self, target_address, device_id):
+        return None
+
+    def read_properties(self, target_address, point_map, max_per_request, use_read_multiple):
+        return dict((name, 1.0) for name in point_map)
+
+    def register_point_map(self, target_address, point_map):
+        if not self.registration:
+            return MethodNotFound(-32601, 'Method not found')
+        self.point_maps['handle'] = point_map
+        return 'handle'
+
+    def read_registered_properties(self, handle, max_per_request):
+        if handle not in self.point_maps:
+            return RemoteError('Unknown point map handle',
+                               exc_type='bacnet_proxy.agent.UnknownPointMap', exc_args=[handle])
+        return dict((name, 1.0) for name in self.point_maps[handle])
+
+
+class FakeVIP(object):
+    def __init__(self, proxy):
+        self.rpc = proxy
+
+
+def make_interface(proxy):
+    interface = bacnet.Interface(vip=FakeVIP(proxy))
+    interface.configure({'device_address': '10.0.0.1', 'device_id': 500}, registry_config)
+    del proxy.calls[:]
+    return interface
+
+
+@pytest.mark.driver
+def test_point_map_registered_once():
+    proxy = FakeProxy()
+    interface = make_interface(proxy)
+    expected = dict(('Point{0}'.format(i), 1.0) for i in range(5))
+
+    assert interface.scrape_all() == expected
+    assert interface.scrape_all() == expected
+    assert proxy.calls == ['register_point_map', 'read_registered_properties',
+                           'read_registered_properties']
+
+    # A restarted proxy has forgotten the map and it is registered again.
+    proxy.point_maps.clear()
+    del proxy.calls[:]
+    assert interface.scrape_all() == expected
+    assert proxy.calls == ['read_registered_properties', 'register_point_map',
+                           'read_registered_properties']
+
+
+@pytest.mark.driver
+def test_older_proxy_gets_full_point_map():
+    proxy = FakeProxy(registration=False)
+    interface = make_interface(proxy)
+    expected = dict(('Point{0}'.format(i), 1.0) for i in range(5))
+
+    assert interface.scrape_all() == expected
+    assert interface.scrape_all() == expected
+    assert proxy.calls == ['register_point_map', 'read_properties', 'read_properties']
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from master_driver.change_of_value import ChangeOfValueFilter
+
+meta_data = {"ZoneTemp": {"type": "float", "units": "F", "tz": ""},
+             "Setpoint": {"type": "integer", "units": "F", "tz": ""},
+             "Damper": {"type": "float", "units": "%", "tz": ""},
+             "Mode": {"type": "string", "units": "", "tz": ""},
+             "Occupied": {"type": "boolean", "units": "", "tz": ""}}
+
+start = datetime(2017, 1, 1)
+
+
+def scrape(cov_filter, minutes, **values):
+    results = {"ZoneTemp": 70.0, "Setpoint": 72, "Damper": 50.0, "Mode": "cool", "Occupied": True}
+    results.update(values)
+    return cov_filter.filter(results, start + timedelta(minutes=minutes))
+
+
+@pytest.mark.driver
+def test_first_scrape_publishes_everything():
+    cov_filter = ChangeOfValueFilter({}, meta_data)
+    changed, full = scrape(cov_filter, 0)
+    assert full
+    assert len(changed) == 5
+
+    changed, full = scrape(cov_filter, 1)
+    assert not full
+    assert changed == {}
+
+
+@pytest.mark.driver
+def test_deadbands():
+    config = {"change_deadband": 0.5,
+              "point_deadbands": {"Damper": {"deadband_percent": 10}}}
+    cov_filter = ChangeOfValueFilter(config, meta_data)
+    scrape(cov_filter, 0)
+
+    changed, _ = scrape(cov_filter, 1, ZoneTemp=70.4, Damper=54.0, Mode="heat", Occupied=False)
+    assert changed == {"Mode": "heat", "Occupied": False}
+
+    # Deadbands are measured from the last published value, so slow drift
+    # is published once it adds up.
+    changed, _ = scrape(cov_filter, 2, ZoneTemp=70.6, Damper=56.0, Mode="heat", Occupied=False)
+    assert changed == {"ZoneTemp": 70.6, "Damper": 56.0}
+
+    changed, _ = scrape(cov_filter, 3, ZoneTemp=70.6, Damper=56.0, Mode="heat", Occupied=False,
+                        Setpoint=73)
+    assert changed == {"Setpoint": 73}
+
+
+@pytest.mark.driver
+def test_silence_and_full_publishes():
+    config = {"max_silence": 600, "full_publish_every": 4,
+              "point_deadbands": {"Setpoint": {"max_silence": 0}}}
+    cov_filter = ChangeOfValueFilter(config, meta_data)
+    assert scrape(cov_filter, 0)[1]
+    assert scrape(cov_filter, 5)[0] == {}
+
+    changed, full = scrape(cov_filter, 10)
+    assert not full
+    assert sorted(changed) == ["Damper", "Mode", "Occupied", "ZoneTemp"]
+
+    assert scrape(cov_filter, 11) == ({}, False)
+    changed, full = scrape(cov_filter, 12)
+    assert full
+    assert len(changed) == 5
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+
+import gevent
+import pytest
+
+from master_driver.agent import MasterDriverAgent
+
+
+class SlowDriver(object):
+    """Answers like a DriverAgent after a delay, tracking how many calls overlap."""
+    running = 0
+    most_running = 0
+
+    def __init__(self, path):
+        self.path = path
+
+    def _wait(self):
+        SlowDriver.running += 1
+        SlowDriver.most_running = max(SlowDriver.most_running, SlowDriver.running)
+        gevent.sleep(0.05)
+        SlowDriver.running -= 1
+
+    def get_multiple_points(self, point_names):
+        self._wait()
+        results = {}
+        errors = {}
+        for point_name in point_names:
+            if point_name == "missing":
+                errors[self.path + "/" + point_name] = repr(KeyError(point_name))
+            else:
+                results[self.path + "/" + point_name] = 1.0
+        return results, errors
+
+    def set_multiple_points(self, point_names_values):
+        self._wait()
+        return {}
+
+
+def make_agent(devices, max_concurrent):
+    agent = MasterDriverAgent.__new__(MasterDriverAgent)
+    agent.instances = dict((path, SlowDriver(path)) for path in devices)
+    agent.max_concurrent_device_requests = max_concurrent
+    agent._override_devices = set()
+    SlowDriver.most_running = 0
+    return agent
+
+
+@pytest.mark.driver
+def test_get_points_on_many_devices():
+    agent = make_agent(["device{}".format(i) for i in range(10)], 5)
+    device_points = dict(("device{}".format(i), ["a", "b"]) for i in range(10))
+    device_points["device0"].append("missing")
+    device_points["unknown"] = ["a"]
+
+    results, errors = agent.get_multiple_devices_points(device_points)
+
+    assert len(results) == 20
+    assert results["device9/b"] == 1.0
+    assert sorted(errors) == ["device0/missing", "unknown/a"]
+    assert "KeyError" in errors["unknown/a"]
+    assert SlowDriver.most_running == 5
+
+
+@pytest.mark.driver
+def test_set_points_skips_overridden_devices():
+    agent = make_agent(["device0", "device1"], 20)
+    agent._override_devices.add("device1")
+
+    errors = agent.set_multiple_devices_points({"device0": [["a", 1]], "device1": [["a", 1], ["b", 2]]})
+
+    assert sorted(errors) == ["device1/a", "device1/b"]
+    assert "OverrideError" in errors["device1/a"]
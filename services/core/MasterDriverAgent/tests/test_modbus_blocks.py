@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+import struct
+
+import pytest
+
+from master_driver.interfaces import modbus
+from master_driver.interfaces.modbus_blocks import plan_blocks, request_count
+from master_driver.interfaces.modbus_tk.client import Request
+from master_driver.interfaces.modbus_tk.maps import Map
+from volttron.platform.store import process_raw_config
+
+# A sparse meter map: one float every 10 registers.
+registry_config_string = "Volttron Point Name,Units,Modbus Register,Writable,Point Address\n" + \
+    "".join("Point{0},kW,>f,FALSE,{1}\n".format(i, i * 10) for i in range(20))
+
+registry_config = process_raw_config(registry_config_string, config_type="csv")
+
+
+@pytest.mark.driver
+def test_plan_blocks_limits():
+    ranges = [(0, 1, 'a'), (2, 3, 'b'), (10, 11, 'c'), (13, 13, 'd'), (200, 399, 'e')]
+
+    assert plan_blocks(ranges) == [[0, 3, ['a', 'b']], [10, 11, ['c']], [13, 13, ['d']],
+                                   [200, 399, ['e']]]
+    assert plan_blocks(ranges, max_gap=6) == [[0, 13, ['a', 'b', 'c', 'd']], [200, 399, ['e']]]
+    assert plan_blocks(ranges, max_gap=6, max_count=12) == [[0, 11, ['a', 'b', 'c']], [13, 13, ['d']],
+                                                            [200, 399, ['e']]]
+    assert plan_blocks(ranges, max_gap=6, can_merge=lambda block, item: item != 'c') == \
+        [[0, 3, ['a', 'b']], [10, 13, ['c', 'd']], [200, 399, ['e']]]
+    # The oversized range takes two reads.
+    assert request_count(plan_blocks(ranges, max_gap=6)) == 3
+
+
+def make_interface(**config):
+    interface = modbus.Interface()
+    config["device_address"] = "10.0.0.1"
+    interface.configure(config, registry_config)
+    return interface
+
+
+@pytest.mark.driver
+def test_interface_reads_across_gaps():
+    assert make_interface().planned_request_count() == 20
+    assert make_interface(max_read_gap=8).planned_request_count() == 2
+    assert make_interface(max_read_gap=8, max_read_count=50).planned_request_count() == 4
+
+    # Values are parsed from their place in the block, skipping the gaps.
+    interface = make_interface(max_read_gap=8)
+    plan = interface.read_requests()
+    responses = [FakeResponse(request.address, request.count)
+                 for _, _, _, requests in plan for request in requests]
+    values = interface.parse_responses(plan, responses)
+    assert values == dict(("Point{0}".format(i), float(i)) for i in range(20))
+
+
+class FakeResponse(object):
+    """Holds address / 10 as a float at every tenth register and zeros elsewhere."""
+    def __init__(self, address, count):
+        data = b''
+        while len(data) < count * 2:
+            if address % 10 == 0:
+                data += struct.pack(">f", address // 10)
+                address += 2
+            else:
+                data += b'\x00\x00'
+                address += 1
+        self.data = data[:count * 2]
+
+    def isError(self):
+        return False
+
+    def encode(self):
+        return struct.pack(">B", len(self.data)) + self.data
+
+
+@pytest.mark.driver
+def test_modbus_tk_requests_skip_gaps():
+    registers = [{'register name': 'point{0}'.format(i), 'address': str(i * 4), 'type': 'uint16',
+                  'units': '', 'writable': 'FALSE', 'table': 'analog_output_holding_registers'}
+                 for i in range(10)]
+
+    sparse = Map(name='sparse', registry_config_lst=registers).get_class()()
+    assert len(sparse.requests()) == 10
+
+    gapped = Map(name='gapped', registry_config_lst=registers, max_read_gap=3).get_class()()
+    requests = gapped.requests()
+    assert len(requests) == 1
+    request = requests[0]
+    assert (request.address, request.count) == (0, 37)
+
+    # Unused registers are skipped when the response is unpacked.
+    data = b''.join(struct.pack(">H", address) for address in range(37))
+    values = request.parse_values(struct.unpack(request.formatting, data))
+    assert [(field.name, datum.value) for field, datum in values.items()] == \
+        [('point{0}'.format(i), i * 4) for i in range(10)]
+
+    # Writes never cover registers that were not asked for.
+    fields = [gapped.field_by_name('point0'), gapped.field_by_name('point1')]
+    assert len(Request.compile_requests(fields, '>')) == 2
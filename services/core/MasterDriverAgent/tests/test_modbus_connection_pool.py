@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+import socket
+
+import gevent
+import pytest
+from gevent.lock import BoundedSemaphore
+from pymodbus.exceptions import ConnectionException
+
+from master_driver import driver_locks
+from master_driver.interfaces import modbus
+
+
+class FakeClient(object):
+    instances = []
+    reachable = True
+
+    def __init__(self, address, port):
+        self.address = address
+        self.port = port
+        self.socket = None
+        self.closed = False
+        FakeClient.instances.append(self)
+
+    def connect(self):
+        if FakeClient.reachable:
+            self.socket, self.peer = socket.socketpair()
+        return FakeClient.reachable
+
+    def close(self):
+        self.closed = True
+        if self.socket is not None:
+            self.socket.close()
+            self.peer.close()
+            self.socket = None
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeClient.instances = []
+    FakeClient.reachable = True
+    monkeypatch.setattr(modbus, "SyncModbusClient", FakeClient)
+    monkeypatch.setattr(driver_locks, "_socket_lock", BoundedSemaphore(2))
+    pool = modbus.ModbusConnectionPool(idle_timeout=60.0)
+    yield pool
+    pool.close_all()
+
+
+@pytest.mark.driver
+def test_connection_reused(pool):
+    with pool.connection("10.0.0.1", 502) as first:
+        pass
+    with pool.connection("10.0.0.1", 502) as second:
+        pass
+    assert first is second
+    assert len(FakeClient.instances) == 1
+
+    # The device closing its end is noticed before reuse.
+    first.peer.close()
+    with pool.connection("10.0.0.1", 502) as third:
+        pass
+    assert third is not first
+    assert first.closed
+
+
+@pytest.mark.driver
+def test_connection_discarded_after_error(pool):
+    with pytest.raises(modbus.ModbusIOException):
+        with pool.connection("10.0.0.1", 502) as client:
+            raise modbus.ModbusIOException("timeout")
+    assert client.closed
+    with pool.connection("10.0.0.1", 502) as replacement:
+        pass
+    assert replacement is not client
+
+
+@pytest.mark.driver
+def test_socket_budget_closes_least_recently_used(pool):
+    for address in ("10.0.0.1", "10.0.0.2", "10.0.0.3"):
+        with pool.connection(address, 502):
+            pass
+    first, second, third = FakeClient.instances
+    assert first.closed
+    assert not second.closed and not third.closed
+
+
+@pytest.mark.driver
+def test_gateway_use_is_serialized(pool):
+    active = []
+    overlap = []
+
+    def use():
+        with pool.connection("10.0.0.1", 502):
+            overlap.append(len(active))
+            active.append(True)
+            gevent.sleep(0.01)
+            active.pop()
+
+    gevent.joinall([gevent.spawn(use) for _ in range(3)])
+    assert overlap == [0, 0, 0]
+    assert len(FakeClient.instances) == 1
+
+
+@pytest.mark.driver
+def test_reconnect_backs_off(pool, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(modbus, "monotonic", lambda: now[0])
+    FakeClient.reachable = False
+
+    with pytest.raises(ConnectionException):
+        with pool.connection("10.0.0.1", 502):
+            pass
+    # No new connection attempt until the backoff expires.
+    with pytest.raises(ConnectionException):
+        with pool.connection("10.0.0.1", 502):
+            pass
+    assert len(FakeClient.instances) == 1
+
+    FakeClient.reachable = True
+    now[0] += pool.min_backoff
+    with pool.connection("10.0.0.1", 502) as client:
+        pass
+    assert client.socket is not None
+    # Failed attempts give their socket back to the budget.
+    assert not driver_locks._socket_lock.locked()
+
+
+@pytest.mark.driver
+def test_idle_connections_closed(pool, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(modbus, "monotonic", lambda: now[0])
+    with pool.connection("10.0.0.1", 502) as client:
+        pass
+    now[0] += pool.idle_timeout + 1
+    pool.evict_idle()
+    assert client.closed
+
+
+@pytest.mark.driver
+def test_socket_budget_waiters_get_returned_connections(pool):
+    # More devices than the budget of two, all busy at once.
+    finished = []
+
+    def use(address):
+        with pool.connection(address, 502):
+            gevent.sleep(0.05)
+        finished.append(address)
+
+    addresses = ["10.0.0.{}".format(i) for i in range(1, 6)]
+    greenlets = [gevent.spawn(use, address) for address in addresses]
+    gevent.joinall(greenlets, timeout=2)
+    assert sorted(finished) == addresses
+    assert sum(not client.closed for client in FakeClient.instances) <= 2
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+import socket
+import struct
+from collections import defaultdict
+
+import gevent
+import pytest
+from gevent.lock import BoundedSemaphore
+from pymodbus.client.sync import ModbusTcpClient
+
+from master_driver import driver_locks
+from master_driver.agent import MasterDriverAgent
+from master_driver.interfaces import modbus
+from master_driver.interfaces.modbus_tk import client as modbus_tk_client
+from volttron.platform.store import process_raw_config
+
+registry_config_string = """Volttron Point Name,Units,Modbus Register,Writable,Point Address
+Power,kW,>f,FALSE,0
+Energy,kWh,>f,FALSE,2
+Voltage,V,>H,TRUE,20
+Alarm,,BOOL,FALSE,5
+"""
+
+registry_config = process_raw_config(registry_config_string, config_type="csv")
+
+
+class FakeGateway(object):
+    """Answers register reads with the address of each register as its
+    value, holding requests until `depth` are waiting and then answering
+    them newest first."""
+    def __init__(self, sock, depth):
+        self.sock = sock
+        self.depth = depth
+        self.requests = []
+        self.most_in_flight = 0
+        self.greenlet = gevent.spawn(self.run)
+
+    def run(self):
+        waiting = []
+        data = b''
+        while True:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                return
+            data += chunk
+            while len(data) >= 7:
+                tid, _, length, unit = struct.unpack_from(">HHHB", data)
+                if len(data) < 6 + length:
+                    break
+                function, address, count = struct.unpack_from(">BHH", data, 7)
+                data = data[6 + length:]
+                waiting.append((tid, unit, function, address, count))
+                self.requests.append((unit, function, address, count))
+            self.most_in_flight = max(self.most_in_flight, len(waiting))
+            if len(waiting) >= self.depth:
+                for request in reversed(waiting):
+                    self.sock.sendall(self.response(*request))
+                waiting = []
+
+    def response(self, tid, unit, function, address, count):
+        if function in (1, 2):
+            values = [(address + i) % 2 for i in range(count)]
+            payload = bytearray((count + 7) // 8)
+            for i, value in enumerate(values):
+                payload[i // 8] |= value << (i % 8)
+            pdu = struct.pack(">BB", function, len(payload)) + bytes(payload)
+        else:
+            pdu = struct.pack(">BB", function, count * 2)
+            pdu += b''.join(struct.pack(">H", address + i) for i in range(count))
+        return struct.pack(">HHHB", tid, 0, len(pdu) + 1, unit) + pdu
+
+
+class Gateways(list):
+    depth = 1
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateways = Gateways()
+
+    class Client(ModbusTcpClient):
+        def connect(self):
+            self.socket, gateway_socket = socket.socketpair()
+            gateways.append(FakeGateway(gateway_socket, gateways.depth))
+            return True
+
+    monkeypatch.setattr(modbus, "SyncModbusClient", Client)
+    monkeypatch.setattr(driver_locks, "_socket_lock", BoundedSemaphore(10))
+    pool = modbus.ModbusConnectionPool()
+    monkeypatch.setattr(modbus, "_connection_pool", pool)
+    yield gateways
+    pool.close_all()
+
+
+def make_interface(slave_id, pipeline_depth=1):
+    interface = modbus.Interface()
+    interface.configure({"device_address": "10.0.0.1", "slave_id": slave_id,
+                         "pipeline_depth": pipeline_depth}, registry_config)
+    return interface
+
+
+def expected_values(interface):
+    values = {}
+    for point in interface.get_register_names():
+        register = interface.get_register_by_name(point)
+        if register.register_type == 'bit':
+            values[point] = bool(register.address % 2)
+        else:
+            data = b''.join(struct.pack(">H", register.address + i)
+                            for i in range(register.get_register_count()))
+            values[point] = register.parse_struct.unpack(data)[0]
+    return values
+
+
+@pytest.mark.driver
+def test_pipelined_scrape_matches_transaction_ids(gateway):
+    gateway.depth = 3
+    interface = make_interface(7, pipeline_depth=3)
+    assert interface.scrape_all() == expected_values(interface)
+    assert gateway[0].most_in_flight == 3
+
+
+@pytest.mark.driver
+def test_devices_on_gateway_share_stream(gateway):
+    interfaces = [make_interface(unit) for unit in range(1, 6)]
+    results = [gevent.spawn(interface.scrape_all) for interface in interfaces]
+    gevent.joinall(results, raise_error=True)
+
+    for interface, result in zip(interfaces, results):
+        assert result.value == expected_values(interface)
+    # One connection carried every device's reads.
+    assert len(gateway) == 1
+    units = set(unit for unit, _, _, _ in gateway[0].requests)
+    assert units == set(range(1, 6))
+
+
+@pytest.mark.driver
+def test_devices_on_gateway_share_time_slot():
+    agent = MasterDriverAgent.__new__(MasterDriverAgent)
+    agent.group_counts = defaultdict(int)
+    agent.freed_time_slots = defaultdict(list)
+    agent.endpoint_slots = {}
+
+    def config(address, driver_type="modbus"):
+        return {"driver_type": driver_type,
+                "driver_config": {"device_address": address, "port": 502}}
+
+    first = agent.derive_endpoint(config("10.0.0.1"))
+    other = agent.derive_endpoint(config("10.0.0.2"))
+    assert agent.derive_endpoint(config("10.0.0.1", "bacnet")) is None
+
+    assert agent.assign_time_slot(0, first) == 0
+    assert agent.assign_time_slot(0, first) == 0
+    assert agent.assign_time_slot(0, other) == 1
+    assert agent.assign_time_slot(0) == 2
+
+    # The slot is only freed once every device on the endpoint is gone.
+    agent.release_time_slot(0, 0, first)
+    assert agent.assign_time_slot(0) == 3
+    agent.release_time_slot(0, 0, first)
+    assert agent.assign_time_slot(0) == 0
+
+
+class FakeMaster(object):
+    def __init__(self, host, port, timeout_in_sec):
+        self.timeout_in_sec = timeout_in_sec
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class GatewayClient(modbus_tk_client.Client):
+    pass
+
+
+@pytest.mark.driver
+def test_modbus_tk_master_closed_by_last_client(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(modbus_tk_client, "_shared_masters", {})
+    monkeypatch.setattr(modbus_tk_client.modbus_tcp, "TcpMaster", FakeMaster)
+    monkeypatch.setattr(modbus_tk_client.logger, "warning", warnings.append)
+
+    first = GatewayClient().set_transport_tcp("10.0.0.1", 502)
+    second = GatewayClient().set_transport_tcp("10.0.0.1", "502")
+    assert first.client is second.client
+    assert not warnings
+    slow = GatewayClient().set_transport_tcp("10.0.0.1", 502, timeout_in_sec=5.0)
+    assert slow.client is first.client
+    assert len(warnings) == 1
+    master = first.client
+
+    first.close()
+    slow.close()
+    assert not master.closed
+
+    # The last client closes the master, but not while a request holds it.
+    with second._transport_lock:
+        closing = gevent.spawn(second.close)
+        gevent.sleep(0.01)
+        assert not master.closed
+    closing.join()
+    assert master.closed
+    assert not modbus_tk_client._shared_masters
+
+    third = GatewayClient().set_transport_tcp("10.0.0.1", 502)
+    assert third.client is not master
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from master_driver import driver as driver_module
+from master_driver.agent import MasterDriverAgent
+from master_driver.driver import DriverAgent
+from master_driver.scrape_scheduler import ScrapeStatistics, plan_scrape_offsets
+
+
+@pytest.mark.driver
+def test_statistics_percentiles():
+    stats = ScrapeStatistics(window=10)
+    assert stats.summary()["p50"] is None
+
+    for i in range(1, 21):
+        stats.record(float(i), success=i % 5 != 0)
+
+    # Only the last 10 scrapes are kept.
+    assert stats.percentile(50) == 15.0
+    assert stats.percentile(90) == 19.0
+    assert stats.percentile(100) == 20.0
+    summary = stats.summary()
+    assert (summary["count"], summary["failures"]) == (20, 4)
+    assert summary["failure_rate"] == 0.2
+    assert summary["last"] == 20.0
+
+
+@pytest.mark.driver
+def test_offsets_limit_concurrency():
+    durations = [("slow1", 10.0), ("slow2", 10.0), ("fast1", 0.1), ("fast2", 0.1), ("fast3", 0.1)]
+
+    assert plan_scrape_offsets(durations, 0.5) == \
+        {"slow1": 0.0, "slow2": 0.5, "fast1": 1.0, "fast2": 1.5, "fast3": 2.0}
+
+    offsets = plan_scrape_offsets(durations, 0.5, max_concurrent=2)
+    assert offsets["slow2"] == 0.5
+    # Both slots are taken by the slow devices until the first finishes.
+    assert offsets["fast1"] == 10.0
+    assert offsets["fast2"] == 10.5
+    assert offsets["fast3"] == 11.0
+
+
+class FakeDriver(object):
+    def __init__(self, time_slot, config=None, group=0):
+        self.time_slot = time_slot
+        self.time_slot_offset = time_slot * 0.5
+        self.group = group
+        self.config = config or {}
+        self.interval = 60
+        self.moves = 0
+
+    def update_scrape_offset(self, offset):
+        self.time_slot_offset = offset % self.interval
+        self.moves += 1
+
+
+@pytest.mark.driver
+def test_reschedule_uses_measured_durations():
+    agent = MasterDriverAgent.__new__(MasterDriverAgent)
+    agent.driver_scrape_interval = 0.5
+    agent.group_offset_interval = 0.0
+    agent.max_concurrent_scrapes = 1
+    agent.scrape_stats = {}
+    gateway = {"driver_type": "modbus", "driver_config": {"device_address": "10.0.0.1"}}
+    agent.instances = {"bacnet": FakeDriver(0),
+                       "meter1": FakeDriver(1, gateway),
+                       "meter2": FakeDriver(2, gateway),
+                       "new": FakeDriver(3)}
+
+    for _ in range(10):
+        agent.scrape_completed("bacnet", 4.0, True)
+        agent.scrape_completed("meter1", 1.0, True)
+        agent.scrape_completed("meter2", 1.0, False)
+
+    agent.reschedule_scrapes()
+    offsets = dict((topic, driver.time_slot_offset) for topic, driver in agent.instances.items())
+    # Meters on one gateway start together, after the BACnet device is done,
+    # and the device that has never been scraped follows them.
+    assert offsets == {"bacnet": 0.0, "meter1": 4.0, "meter2": 4.0, "new": 6.0}
+
+
+@pytest.mark.driver
+def test_reschedule_ignores_small_and_wrapped_changes():
+    agent = MasterDriverAgent.__new__(MasterDriverAgent)
+    agent.driver_scrape_interval = 0.5
+    agent.group_offset_interval = 50.0
+    agent.max_concurrent_scrapes = 1
+    agent.scrape_stats = {}
+    agent.instances = {"first": FakeDriver(0, group=1), "second": FakeDriver(1, group=1)}
+
+    agent.scrape_completed("first", 20.0, True)
+    agent.reschedule_scrapes()
+    # 50 + 20 is past the end of the 60 second interval.
+    assert agent.instances["second"].time_slot_offset == 10.0
+    assert [driver.moves for driver in agent.instances.values()] == [1, 1]
+
+    # Neither the wrapped offset nor a drift under a second moves a device.
+    agent.scrape_completed("first", 20.2, True)
+    agent.reschedule_scrapes()
+    assert [driver.moves for driver in agent.instances.values()] == [1, 1]
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+        self.events = []
+
+    def schedule(self, deadline, func, *args):
+        event = FakeEvent(deadline, func, args)
+        self.events.append(event)
+        return event
+
+    def run_until(self, end):
+        while True:
+            pending = [event for event in self.events if not event.canceled]
+            if not pending:
+                break
+            event = min(pending, key=lambda event: event.deadline)
+            if event.deadline > end:
+                break
+            self.events.remove(event)
+            self.now = max(self.now, event.deadline)
+            event.func(*event.args)
+        self.now = end
+
+
+class FakeEvent(object):
+    def __init__(self, deadline, func, args):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.canceled = False
+
+    def cancel(self):
+        self.canceled = True
+
+
+class FakeParent(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.scrapes = []
+
+    def scrape_starting(self, device_name):
+        self.scrapes.append(self.clock.now)
+
+    def scrape_completed(self, device_topic, duration, success):
+        pass
+
+
+class EmptyInterface(object):
+    def scrape_all(self):
+        return {}
+
+    def get_register_names_view(self):
+        return set()
+
+
+@pytest.mark.driver
+def test_moving_offset_keeps_one_scrape_per_interval(monkeypatch):
+    start = datetime(2017, 1, 1, tzinfo=pytz.utc)
+    clock = FakeClock(start)
+    monkeypatch.setattr(driver_module.utils, "get_aware_utc_now", lambda: clock.now)
+
+    driver = DriverAgent.__new__(DriverAgent)
+    driver.device_path = driver.device_name = "campus/building/device"
+    driver.interval = 60
+    driver.periodic_read_event = None
+    driver.core = clock
+    driver.parent = FakeParent(clock)
+    driver.interface = EmptyInterface()
+    driver.update_scrape_offset(30.0)
+    driver.schedule_periodic_read(driver.find_starting_datetime(clock.now + timedelta(seconds=1)))
+
+    # Move later while this interval's scrape is still ahead, earlier to a
+    # time that has already passed, and past the end of the interval.
+    for at, offset in ((70, 50.0), (150, 5.0), (200, 65.0), (260, 40.0)):
+        clock.run_until(start + timedelta(seconds=at))
+        driver.update_scrape_offset(offset)
+    clock.run_until(start + timedelta(seconds=600))
+
+    intervals = [int((scrape - start).total_seconds() // 60) for scrape in driver.parent.scrapes]
+    assert intervals == range(1, 10)
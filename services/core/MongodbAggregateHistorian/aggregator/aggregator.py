@@ -200,6 +200,47 @@ class MongodbAggregateHistorian(AggregateHistorian):
         except StopIteration:
             return 0, 0
 
+    def collect_aggregates(self, topic_ids, start_time, end_time):
+
+        db = self.dbclient.get_default_database()
+        # topic ids found through topic name patterns are strings, map the
+        # object ids back to whichever form each point was configured with.
+        requested = {}
+        for topic_id in topic_ids:
+            object_id = topic_id if isinstance(topic_id, ObjectId) \
+                else ObjectId(topic_id)
+            requested.setdefault(object_id, []).append(topic_id)
+
+        match_conditions = [{"topic_id": {"$in": requested.keys()}}]
+        if start_time is not None:
+            match_conditions.append({"ts": {"$gte": start_time}})
+        if end_time is not None:
+            match_conditions.append({"ts": {"$lt": end_time}})
+
+        match = {"$match": {"$and": match_conditions}}
+        # $sum skips values that are not numbers, as $avg does, so count
+        # those that are for the average. Numbers sort after null and before
+        # strings and every other BSON type.
+        is_number = {"$and": [{"$gt": ["$value", None]},
+                              {"$lt": ["$value", ""]}]}
+        group = {"$group": {"_id": "$topic_id",
+                            "sum": {"$sum": "$value"},
+                            "count": {"$sum": 1},
+                            "numbers": {"$sum": {"$cond": [is_number, 1, 0]}},
+                            "min": {"$min": "$value"},
+                            "max": {"$max": "$value"}}}
+
+        pipeline = [match, group]
+
+        _log.debug("collect_aggregates: pipeline: {}".format(pipeline))
+        topic_aggregates = {}
+        for row in db[self._data_collection].aggregate(pipeline):
+            for topic_id in requested.get(row['_id'], []):
+                topic_aggregates[topic_id] = (row['sum'], row['count'],
+                                              row['min'], row['max'],
+                                              row['numbers'])
+        return topic_aggregates
+
     def insert_aggregate(self, topic_id, agg_type, period, end_time,
                          value, topic_ids):
 
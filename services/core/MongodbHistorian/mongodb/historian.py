@@ -42,7 +42,7 @@ import logging
 import numbers
 import re
 import sys
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from datetime import datetime
 from datetime import timedelta
 from multiprocessing.pool import ThreadPool
@@ -77,6 +77,9 @@ except ImportError:
 utils.setup_logging()
 _log = logging.getLogger(__name__)
 __version__ = '2.1.1'
+
+# Number of raw data rows rolled up into hourly and daily data per bulk write.
+ROLLUP_BATCH_SIZE = 5000
 _VOLTTRON_TYPE = '__volttron_type__'
 
 
@@ -174,6 +177,8 @@ class MongodbHistorian(BaseHistorian):
         self.version_nums = __version__.split(".")
         self.DAILY_COLLECTION = "daily_data"
         self.HOURLY_COLLECTION = "hourly_data"
+        self.ROLLUP_CHECKPOINT_COLLECTION = "rollup_checkpoint"
+        self._rollup_running = False
 
         try:
             self._initial_rollup_start_time = get_aware_utc_now()
@@ -253,101 +258,111 @@ class MongodbHistorian(BaseHistorian):
             _log.debug("historian setup not complete. "
                        "wait for next periodic call")
             return
-        # Find the records that needs to be processed from data table
+        if self._rollup_running:
+            _log.debug("previous rollup is still running. "
+                       "wait for next periodic call")
+            return
+        self._rollup_running = True
+        try:
+            self.rollup()
+        finally:
+            self._rollup_running = False
+
+    def rollup(self):
+        """
+        Roll up raw data added since the last checkpoint into the hourly and
+        daily collections. Raw rows are read in batches of
+        ROLLUP_BATCH_SIZE. Each batch is grouped by topic and hour or day and
+        written with one bulk write per collection. The checkpoint then moves
+        to the last row of the batch and other greenlets get a chance to run.
+        """
         db = self._client.get_default_database()
-        stat = {}
-        stat["last_data_into_daily"] = self.get_last_updated_data(
-            db, self.DAILY_COLLECTION)
+        last_hourly, last_daily = self.get_rollup_checkpoint(db)
 
-        stat["last_data_into_hourly"] = self.get_last_updated_data(
-            db, self.HOURLY_COLLECTION)
         find_condition = {}
-        if stat["last_data_into_daily"]:
-            find_condition['_id'] = {'$gt': stat["last_data_into_daily"]}
-        if stat["last_data_into_hourly"]:
-            if stat["last_data_into_daily"] and stat[
-                "last_data_into_hourly"] < \
-                    stat["last_data_into_daily"]:
-                find_condition['_id'] = {'$gt': stat["last_data_into_hourly"]}
-        if not stat["last_data_into_hourly"] and not stat[
-            "last_data_into_daily"]:
-            stat = {}
-            find_condition['ts']= {'$gte': self._initial_rollup_start_time}
-            _log.info("ROLLING FROM start date {}".format(
-                self._initial_rollup_start_time))
-        else:
+        if last_hourly and last_daily:
+            find_condition['_id'] = {'$gt': min(last_hourly, last_daily)}
             _log.info("ROLLING FROM last processed id {}".format(
                 find_condition['_id']))
+        elif last_hourly or last_daily:
+            # Only one collection has been rolled up, so the other one has
+            # to start from the beginning.
+            find_condition['ts'] = {'$gte': self._initial_rollup_start_time}
+            _log.info("ROLLING FROM start date {} and last processed id "
+                      "{}".format(self._initial_rollup_start_time,
+                                  last_hourly or last_daily))
+        else:
+            find_condition['ts'] = {'$gte': self._initial_rollup_start_time}
+            _log.info("ROLLING FROM start date {}".format(
+                self._initial_rollup_start_time))
 
         _log.debug("query condition is {} ".format(find_condition))
 
-
-        # Iterate and append to a bulk_array. Insert in batches of 1000
-        bulk_publish_hour = []
-        bulk_publish_day = []
-        hour_ids = []
-        day_ids = []
-        h = 0
-        d = 0
-        last_topic_id = ''
-        last_date = ''
-        cursor = db[self._data_collection].find(
-            find_condition).sort("_id", pymongo.ASCENDING)
+        cursor = db[self._data_collection].find(find_condition).sort(
+            "_id", pymongo.ASCENDING).batch_size(ROLLUP_BATCH_SIZE)
         _log.debug("rollup query returned. Looping through to update db")
+        rows = []
         for row in cursor:
-            if not stat or row['_id'] > stat["last_data_into_hourly"]:
-                self.initialize_hourly(topic_id=row['topic_id'], ts=row['ts'])
-                bulk_publish_hour.append(
-                    MongodbHistorian.insert_to_hourly(db,
-                                          row['_id'],
-                                          topic_id=row['topic_id'],
-                                          ts=row['ts'],
-                                          value=row['value']))
-                hour_ids.append(row['_id'])
-                h += 1
-
-            if not stat or row['_id'] > stat["last_data_into_daily"]:
-                self.initialize_daily(topic_id=row['topic_id'],
-                                      ts=row['ts'])
-                bulk_publish_day.append(
-                    MongodbHistorian.insert_to_daily(db,
-                                         row['_id'],
-                                         topic_id=row['topic_id'],
-                                         ts=row['ts'], value=row['value']))
-                day_ids.append(row['_id'])
-                d += 1
-            # Perform insert if we have 5000 rows
-            d_errors = h_errors = False
-            if h == 5000:
-                bulk_publish_hour, hour_ids, h_errors = \
-                    MongodbHistorian.bulk_write_rolled_up_data(
-                        self.HOURLY_COLLECTION, bulk_publish_hour,
-                        hour_ids, db)
-                h = 0
-            if d == 5000:
-                bulk_publish_day, day_ids, d_errors = \
-                    MongodbHistorian.bulk_write_rolled_up_data(
-                        self.DAILY_COLLECTION, bulk_publish_day, day_ids, db)
-                d = 0
-            if d_errors or h_errors:
-                # something failed in bulk write. try from last err
-                # row during the next periodic call
-                _log.warn("bulk publish errors. last_processed_data would "
-                          "have got recorded in collection. returning from "
-                          "periodic call to try again during next scheduled "
-                          "call")
-                return
-            gevent.sleep(0.2)
-
-        # Perform insert for any pending records
-        if bulk_publish_hour:
-            _log.debug("bulk_publish outside loop")
-            MongodbHistorian.bulk_write_rolled_up_data(
-                self.HOURLY_COLLECTION, bulk_publish_hour, hour_ids, db)
-        if bulk_publish_day:
-            _log.debug("bulk_publish outside loop")
-            MongodbHistorian.bulk_write_rolled_up_data(
-                self.DAILY_COLLECTION, bulk_publish_day, day_ids, db)
+            rows.append(row)
+            if len(rows) == ROLLUP_BATCH_SIZE:
+                if not self.rollup_batch(db, rows, last_hourly, last_daily):
+                    return
+                last_hourly = last_daily = rows[-1]['_id']
+                rows = []
+                gevent.sleep(0)
+
+        if rows:
+            self.rollup_batch(db, rows, last_hourly, last_daily)
+
+    def rollup_batch(self, db, rows, last_hourly, last_daily):
+        """
+        Write one batch of raw rows, sorted by _id, into the hourly and daily
+        collections and move the checkpoint past it. Rows at or before
+        a collection's last processed id are skipped for that collection.
+
+        :return: True if the batch was written, False if a bulk write failed
+                 and the batch should be retried during the next periodic
+                 call
+        """
+        for collection, last_id, period in (
+                (self.HOURLY_COLLECTION, last_hourly, 'hour'),
+                (self.DAILY_COLLECTION, last_daily, 'day')):
+            pending = [row for row in rows
+                       if not last_id or row['_id'] > last_id]
+            if not pending:
+                continue
+            requests = MongodbHistorian.rollup_requests(pending, period)
+            _, _, errors = MongodbHistorian.bulk_write_rolled_up_data(
+                collection, requests, [], db)
+            if errors:
+                # Groups written before the error are not written twice
+                # when the batch is retried, see rollup_requests.
+                _log.warn("bulk publish errors. returning from periodic "
+                          "call to try again from the last checkpoint "
+                          "during next scheduled call")
+                return False
+
+        last_id = rows[-1]['_id']
+        db[self.ROLLUP_CHECKPOINT_COLLECTION].replace_one(
+            {'_id': 'rollup'},
+            {'_id': 'rollup', 'last_hourly_data': last_id,
+             'last_daily_data': last_id},
+            upsert=True)
+        return True
+
+    def get_rollup_checkpoint(self, db):
+        """
+        Return the _id of the last raw row rolled up into the hourly and the
+        daily collections. Databases rolled up before the checkpoint was
+        kept fall back on the last_updated_data of the rolled up documents.
+        """
+        checkpoint = db[self.ROLLUP_CHECKPOINT_COLLECTION].find_one(
+            {'_id': 'rollup'})
+        if checkpoint:
+            return (checkpoint['last_hourly_data'],
+                    checkpoint['last_daily_data'])
+        return (self.get_last_updated_data(db, self.HOURLY_COLLECTION),
+                self.get_last_updated_data(db, self.DAILY_COLLECTION))
 
     def get_last_updated_data(self, db, collection):
         id = ""
@@ -385,59 +400,64 @@ class MongodbHistorian(BaseHistorian):
     def version(self):
         return __version__
 
-    def initialize_hourly(self, topic_id, ts):
-        ts_hour = ts.replace(minute=0, second=0, microsecond=0)
-
-        db = self._client.get_default_database()
-        # use update+upsert instead of insert cmd as the external script
-        # to back fill data could have initialized this same row
-        db[self.HOURLY_COLLECTION].update_one(
-            {'ts': ts_hour, 'topic_id': topic_id},
-            {"$setOnInsert": {'ts': ts_hour,
-                              'topic_id': topic_id,
-                              'count': 0,
-                              'sum': 0,
-                              'data': [[]] * 60,
-                              'last_updated_data': ''}
-            },
-            upsert=True)
-
-    def initialize_daily(self, topic_id, ts):
-        ts_day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
-
-        db = self._client.get_default_database()
-        db[self.DAILY_COLLECTION].update_one(
-            {'ts': ts_day, 'topic_id': topic_id},
-            {"$setOnInsert": {'ts': ts_day,
-                              'topic_id': topic_id,
-                              'count': 0,
-                              'sum': 0,
-                              'data': [[]] * 24 * 60,
-                              'last_updated_data': ''}},
-            upsert=True)
-
-    @staticmethod
-    def insert_to_hourly(db, data_id, topic_id, ts, value):
-        sum_value = MongodbHistorian.value_to_sumable(value)
-        rollup_hour = ts.replace(minute=0, second=0, microsecond=0)
-
-        return UpdateOne({'ts': rollup_hour, 'topic_id': topic_id},
-                {'$push': {"data." + str(ts.minute): [ts, value]},
-                 '$inc': {'count': 1, 'sum': sum_value},
-                 '$set': {'last_updated_data': data_id}})
-
     @staticmethod
-    def insert_to_daily(db, data_id, topic_id, ts, value):
-        rollup_day = ts.replace(hour=0, minute=0, second=0,
-                                         microsecond=0)
-        position = ts.hour * 60 + ts.minute
-        sum_value = MongodbHistorian.value_to_sumable(value)
-
-        one = UpdateOne({'ts': rollup_day, 'topic_id': topic_id},
-                        {'$push': {"data." + str(position): [ts, value]},
-                         '$inc': {'count': 1, 'sum': sum_value},
-                         '$set': {'last_updated_data': data_id}})
-        return one
+    def rollup_requests(rows, period):
+        """
+        Group raw rows by topic and hour or day and build the bulk write
+        requests that add them to the hourly or daily collection.
+
+        Each group gets one upsert that creates its document if it is
+        missing, the same way the rollup_data_by_time.py script does, and one
+        update that pushes all of the group's values into their minute slots.
+        The update only applies while the document's last_updated_data is
+        before the last row of the group, so a batch retried after a failed
+        bulk write does not add the same rows twice.
+
+        :param rows: raw data rows sorted by _id
+        :param period: 'hour' or 'day'
+        :return: list of bulk write requests
+        """
+        groups = OrderedDict()
+        for row in rows:
+            ts = row['ts']
+            if period == 'hour':
+                rollup_ts = ts.replace(minute=0, second=0, microsecond=0)
+                position = ts.minute
+            else:
+                rollup_ts = ts.replace(hour=0, minute=0, second=0,
+                                       microsecond=0)
+                position = ts.hour * 60 + ts.minute
+            group = groups.get((row['topic_id'], rollup_ts))
+            if group is None:
+                group = groups[(row['topic_id'], rollup_ts)] = {
+                    'count': 0, 'sum': 0, 'data': defaultdict(list)}
+            group['count'] += 1
+            group['sum'] += MongodbHistorian.value_to_sumable(row['value'])
+            group['data']["data." + str(position)].append([ts, row['value']])
+            group['last'] = row['_id']
+
+        slots = 60 if period == 'hour' else 24 * 60
+        requests = []
+        for (topic_id, rollup_ts), group in groups.iteritems():
+            # use update+upsert instead of insert cmd as the external script
+            # to back fill data could have initialized this same row
+            requests.append(UpdateOne(
+                {'ts': rollup_ts, 'topic_id': topic_id},
+                {"$setOnInsert": {'ts': rollup_ts,
+                                  'topic_id': topic_id,
+                                  'count': 0,
+                                  'sum': 0,
+                                  'data': [[]] * slots,
+                                  'last_updated_data': ''}},
+                upsert=True))
+            requests.append(UpdateOne(
+                {'ts': rollup_ts, 'topic_id': topic_id,
+                 'last_updated_data': {'$not': {'$gte': group['last']}}},
+                {'$push': dict((slot, {'$each': values}) for slot, values
+                               in group['data'].iteritems()),
+                 '$inc': {'count': group['count'], 'sum': group['sum']},
+                 '$set': {'last_updated_data': group['last']}}))
+        return requests
 
     @doc_inherit
     def publish_to_historian(self, to_publish_list):
@@ -0,0 +1,212 @@
+from datetime import datetime
+
+import pytest
+
+try:
+    import pymongo
+    from bson.objectid import ObjectId
+
+    HAS_PYMONGO = True
+except:
+    HAS_PYMONGO = False
+
+if HAS_PYMONGO:
+    from mongodb.historian import MongodbHistorian
+
+pytestmark = pytest.mark.skipif(not HAS_PYMONGO,
+                                reason='No pymongo client available.')
+
+
+def make_rows(readings):
+    """Raw data rows for (topic_id, ts, value) tuples, in _id order."""
+    return [{'_id': ObjectId(), 'topic_id': topic_id, 'ts': ts,
+             'value': value} for topic_id, ts, value in readings]
+
+
+def split(requests):
+    """(filter, document) pairs of the upserts and of the updates."""
+    upserts = [(r._filter, r._doc) for r in requests if r._upsert]
+    updates = [(r._filter, r._doc) for r in requests if not r._upsert]
+    return upserts, updates
+
+
+class FakeCursor(list):
+    def sort(self, key, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc.get(key),
+                                 reverse=direction == pymongo.DESCENDING))
+
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+    def batch_size(self, size):
+        return self
+
+
+class FakeCollection(object):
+    """
+    Applies the operations the rollup uses to documents kept in memory.
+    """
+    def __init__(self):
+        self.docs = []
+        self.finds = []
+
+    def matches(self, doc, condition):
+        for key, expected in condition.items():
+            value = doc.get(key)
+            if isinstance(expected, dict):
+                for op, operand in expected.items():
+                    if op == '$gt' and not value > operand:
+                        return False
+                    if op == '$gte' and not value >= operand:
+                        return False
+                    # Only used for the last_updated_data guard. Mongo does
+                    # not compare values of different types.
+                    if op == '$not' and (type(value) == type(
+                            operand['$gte']) and value >= operand['$gte']):
+                        return False
+            elif value != expected:
+                return False
+        return True
+
+    def find(self, condition):
+        self.finds.append(condition)
+        return FakeCursor(doc for doc in self.docs
+                          if self.matches(doc, condition))
+
+    def find_one(self, condition):
+        for doc in self.find(condition):
+            return doc
+
+    def replace_one(self, condition, doc, upsert=False):
+        self.docs = [d for d in self.docs if not self.matches(d, condition)]
+        self.docs.append(doc)
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            doc = self.find_one(request._filter)
+            update = request._doc
+            if doc is None:
+                if request._upsert:
+                    self.docs.append(dict(update['$setOnInsert']))
+                continue
+            for key, values in update.get('$push', {}).items():
+                slot = int(key.split('.')[1])
+                doc['data'] = list(doc['data'])
+                doc['data'][slot] = doc['data'][slot] + values['$each']
+            for key, amount in update.get('$inc', {}).items():
+                doc[key] += amount
+            doc.update(update.get('$set', {}))
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        return collection
+
+
+class FakeClient(object):
+    def __init__(self, db):
+        self.db = db
+
+    def get_default_database(self):
+        return self.db
+
+
+def make_historian(db):
+    historian = MongodbHistorian.__new__(MongodbHistorian)
+    historian._client = FakeClient(db)
+    historian._data_collection = 'data'
+    historian._initial_rollup_start_time = datetime(2017, 1, 1)
+    historian.HOURLY_COLLECTION = 'hourly_data'
+    historian.DAILY_COLLECTION = 'daily_data'
+    historian.ROLLUP_CHECKPOINT_COLLECTION = 'rollup_checkpoint'
+    historian._rollup_running = False
+    return historian
+
+
+def test_rollup_requests_group_by_topic_and_period():
+    rows = make_rows([(1, datetime(2017, 1, 1, 10, 5), 1.5),
+                      (2, datetime(2017, 1, 1, 10, 5), 'on'),
+                      (1, datetime(2017, 1, 1, 10, 5, 30), 2),
+                      (1, datetime(2017, 1, 1, 10, 59), True),
+                      (1, datetime(2017, 1, 1, 11, 0), 4)])
+
+    upserts, updates = split(MongodbHistorian.rollup_requests(rows, 'hour'))
+    assert [(f['topic_id'], f['ts']) for f, _ in upserts] == [
+        (1, datetime(2017, 1, 1, 10)), (2, datetime(2017, 1, 1, 10)),
+        (1, datetime(2017, 1, 1, 11))]
+    assert len(upserts[0][1]['$setOnInsert']['data']) == 60
+
+    first = updates[0][1]
+    assert first['$push'] == {
+        'data.5': {'$each': [[rows[0]['ts'], 1.5], [rows[2]['ts'], 2]]},
+        'data.59': {'$each': [[rows[3]['ts'], True]]}}
+    # Only numbers are summed, booleans and strings are still counted.
+    assert first['$inc'] == {'count': 3, 'sum': 3.5}
+    assert first['$set'] == {'last_updated_data': rows[3]['_id']}
+    assert updates[1][1]['$inc'] == {'count': 1, 'sum': 0}
+
+    upserts, updates = split(MongodbHistorian.rollup_requests(rows, 'day'))
+    assert [(f['topic_id'], f['ts']) for f, _ in upserts] == [
+        (1, datetime(2017, 1, 1)), (2, datetime(2017, 1, 1))]
+    assert len(upserts[0][1]['$setOnInsert']['data']) == 24 * 60
+    assert sorted(updates[0][1]['$push']) == ['data.605', 'data.659',
+                                              'data.660']
+    assert updates[0][1]['$inc'] == {'count': 4, 'sum': 7.5}
+    assert updates[0][1]['$set'] == {'last_updated_data': rows[4]['_id']}
+
+
+def test_retried_batch_is_not_added_twice():
+    rows = make_rows([(1, datetime(2017, 1, 1, 10, 5), 1),
+                      (2, datetime(2017, 1, 1, 10, 6), 2),
+                      (1, datetime(2017, 1, 1, 10, 7), 3)])
+    requests = MongodbHistorian.rollup_requests(rows, 'hour')
+    _, updates = split(requests)
+    assert updates[0][0]['last_updated_data'] == {
+        '$not': {'$gte': rows[2]['_id']}}
+
+    hourly = FakeCollection()
+    # The bulk write failed after the first group was written.
+    hourly.bulk_write(requests[:2])
+    hourly.bulk_write(requests)
+    hourly.bulk_write(requests)
+
+    docs = dict((doc['topic_id'], doc) for doc in hourly.docs)
+    assert (docs[1]['count'], docs[1]['sum']) == (2, 4)
+    assert docs[1]['data'][5] == [[rows[0]['ts'], 1]]
+    assert (docs[2]['count'], docs[2]['sum']) == (1, 2)
+
+    # The next batch for the same hour is added.
+    more = make_rows([(1, datetime(2017, 1, 1, 10, 8), 4)])
+    hourly.bulk_write(MongodbHistorian.rollup_requests(more, 'hour'))
+    assert (docs[1]['count'], docs[1]['sum']) == (3, 8)
+    assert docs[1]['last_updated_data'] == more[0]['_id']
+
+
+def test_checkpoint_falls_back_to_rolled_up_data():
+    db = FakeDatabase()
+    historian = make_historian(db)
+    rows = make_rows([(1, datetime(2017, 1, 1, 10, i), i) for i in range(4)])
+    db['data'].docs = list(rows)
+
+    # Rolled up before the checkpoint was kept: hourly data up to the second
+    # row and daily data up to the first.
+    db['hourly_data'].bulk_write(
+        MongodbHistorian.rollup_requests(rows[:2], 'hour'))
+    db['daily_data'].bulk_write(
+        MongodbHistorian.rollup_requests(rows[:1], 'day'))
+    assert historian.get_rollup_checkpoint(db) == (rows[1]['_id'],
+                                                   rows[0]['_id'])
+
+    historian.periodic_rollup()
+    assert db['data'].finds[-1] == {'_id': {'$gt': rows[0]['_id']}}
+    for name in ('hourly_data', 'daily_data'):
+        doc = db[name].docs[0]
+        assert (doc['count'], doc['sum']) == (4, 6)
+    assert historian.get_rollup_checkpoint(db) == (rows[3]['_id'],
+                                                   rows[3]['_id'])
+
+    # The checkpoint is used from now on.
+    historian.periodic_rollup()
+    assert db['data'].finds[-1] == {'_id': {'$gt': rows[3]['_id']}}
+    assert db['hourly_data'].docs[0]['count'] == 4
@@ -127,6 +127,11 @@ class SQLAggregateHistorian(AggregateHistorian):
             start_time,
             end_time)
 
+    def collect_aggregates(self, topic_ids, start_time, end_time):
+        return self.dbfuncts_class.collect_aggregates(topic_ids,
+                                                      start_time,
+                                                      end_time)
+
     def insert_aggregate(self, topic_id, agg_type, period, end_time,
                          value, topic_ids):
         self.dbfuncts_class.insert_aggregate(topic_id,
@@ -42,7 +42,9 @@ import sys
 import threading
 
 from volttron.platform.agent import utils
-from volttron.platform.agent.base_historian import BaseHistorian
+from volttron.platform.agent.base_historian import (BaseHistorian,
+                                                    count_records,
+                                                    iter_records)
 from volttron.platform.dbutils import sqlutils
 from volttron.utils.docs import doc_inherit
 
@@ -157,6 +159,10 @@ class SQLHistorian(BaseHistorian):
         # this gets initialized in the bg_thread within historian_setup
         self.bg_thread_dbutils = None
         super(SQLHistorian, self).__init__(**kwargs)
+        # All points of a scrape are handled at once with
+        # report_all_handled, so there is no need to split them up.
+        self.publish_scrape_records = True
+        self.supports_paging = self.db_functs_class.supports_paging
 
     def record_table_definitions(self, meta_table_name):
         self.bg_thread_dbutils.record_table_definitions(self.tables_def,
@@ -178,7 +184,7 @@ class SQLHistorian(BaseHistorian):
         try:
             published = 0
             with self.bg_thread_dbutils.bulk_insert() as insert_data:
-                for x in to_publish_list:
+                for x in iter_records(to_publish_list):
                     ts = x['timestamp']
                     topic = x['topic']
                     value = x['value']
@@ -226,7 +232,8 @@ class SQLHistorian(BaseHistorian):
                     self.bg_thread_dbutils.rollback()
             else:
                 _log.debug(
-                    'Unable to publish {}'.format(len(to_publish_list)))
+                    'Unable to publish {}'.format(
+                        count_records(to_publish_list)))
         except Exception as e:
             #TODO Unable to send alert from here
             # if isinstance(e, ConnectionError):
@@ -281,6 +288,19 @@ class SQLHistorian(BaseHistorian):
     def query_historian(self, topic, start=None, end=None, agg_type=None,
                         agg_period=None, skip=0, count=None,
                         order="FIRST_TO_LAST"):
+        return self._query(topic, start, end, agg_type, agg_period, skip,
+                           count, order)
+
+    @doc_inherit
+    def query_historian_page(self, topic, start=None, end=None, agg_type=None,
+                             agg_period=None, skip=0, count=None,
+                             order="FIRST_TO_LAST", page_size=None,
+                             continuation=None):
+        return self._query(topic, start, end, agg_type, agg_period, skip,
+                           count, order, page_size, continuation)
+
+    def _query(self, topic, start, end, agg_type, agg_period, skip, count,
+               order, page_size=None, continuation=None):
         _log.debug("query_historian Thread is: {}".format(
             threading.currentThread().getName()))
         results = dict()
@@ -324,9 +344,18 @@ class SQLHistorian(BaseHistorian):
         _log.debug(
             "Querying db reader with topic_ids {} ".format(topic_ids))
 
-        values = self.main_thread_dbutils.query(
-            topic_ids, id_name_map, start=start, end=end, agg_type=agg_type,
-            agg_period=agg_period, skip=skip, count=count, order=order)
+        next_continuation = None
+        if page_size is None:
+            values = self.main_thread_dbutils.query(
+                topic_ids, id_name_map, start=start, end=end,
+                agg_type=agg_type, agg_period=agg_period, skip=skip,
+                count=count, order=order)
+        else:
+            values, next_continuation = self.main_thread_dbutils.query_page(
+                topic_ids, id_name_map, start=start, end=end,
+                agg_type=agg_type, agg_period=agg_period, skip=skip,
+                count=count, order=order, page_size=page_size,
+                continuation=continuation)
         metadata = {}
         meta_tid = None
         if len(values) > 0:
@@ -353,6 +382,8 @@ class SQLHistorian(BaseHistorian):
                 metadata = self.topic_meta.get(meta_tid, {})
                 # _log.debug("metadata is {}".format(metadata))
                 results = {'values': values, 'metadata': metadata}
+                if next_continuation:
+                    results['continuation'] = next_continuation
             else:
                 results = dict()
         return results
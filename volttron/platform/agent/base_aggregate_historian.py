@@ -53,6 +53,49 @@ from volttron.platform.vip.agent.subsystems import RPC
 _log = logging.getLogger(__name__)
 __version__ = '1.0'
 
+# Aggregations that can be combined from per topic sums, counts, minimums
+# and maximums.
+GROUPED_AGGREGATIONS = ('sum', 'count', 'avg', 'min', 'max')
+
+
+def combine_aggregates(topic_aggregates, topic_ids, agg_type):
+    """
+    Combine the per topic results of
+    :py:meth:`AggregateHistorian.collect_aggregates` into the aggregate of
+    agg_type across topic_ids.
+
+    :param topic_aggregates: dictionary of topic id to a tuple of (sum,
+                             count, min, max) of the topic's values. The
+                             tuple may carry a fifth element, the number of
+                             values included in the sum, when that is not
+                             every record counted.
+    :param topic_ids: topic ids to aggregate across
+    :param agg_type: type of aggregation, one of GROUPED_AGGREGATIONS
+    :return: a tuple of (aggregated value, count of records over which this
+             aggregation was computed)
+    """
+    rows = [topic_aggregates[topic_id] for topic_id in topic_ids
+            if topic_id in topic_aggregates and topic_aggregates[topic_id][1]]
+    count = sum(row[1] for row in rows)
+    if not count:
+        return None, 0
+    agg_type = agg_type.lower()
+    if agg_type == 'sum':
+        return sum(row[0] for row in rows), count
+    elif agg_type == 'count':
+        return count, count
+    elif agg_type == 'avg':
+        summed = sum(row[4] if len(row) > 4 else row[1] for row in rows)
+        if not summed:
+            return None, count
+        return float(sum(row[0] for row in rows)) / summed, count
+    elif agg_type == 'min':
+        return min(row[2] for row in rows), count
+    elif agg_type == 'max':
+        return max(row[3] for row in rows), count
+    raise ValueError("Aggregation type {} cannot be combined across "
+                     "topics".format(agg_type))
+
 
 class AggregateHistorian(Agent):
     """
@@ -83,6 +126,10 @@ class AggregateHistorian(Agent):
         config = utils.load_config(config_path)
         self.topic_id_map = None
         self.aggregate_topic_id_map = None
+        # Topic ids matching each topic_name_pattern, valid as long as the
+        # topic map they were looked up with does not change.
+        self._pattern_topic_ids = {}
+        self._pattern_topic_map = None
         self.volttron_table_defs = 'volttron_table_definitions'
 
         self.vip.config.set_default("config", config)
@@ -117,6 +164,8 @@ class AggregateHistorian(Agent):
         assert params is not None
 
         self.topic_id_map, name_map = self.get_topic_map()
+        self._pattern_topic_map = (self.topic_id_map, name_map)
+        self._pattern_topic_ids.clear()
         self.agg_topic_id_map = self.get_agg_topic_map()
         _log.debug("In start of aggregate historian. "
                    "After loading topic and aggregate topic maps")
@@ -190,11 +239,8 @@ class AggregateHistorian(Agent):
             else:
                 # Find if the topic_name patterns result in any topics
                 # at all. If it does log them as info
-                topic_map = self.vip.rpc.call(
-                    PLATFORM_HISTORIAN,
-                    "get_topics_by_pattern",
-                    topic_pattern=topic_pattern).get()
-                if topic_map is None or len(topic_map) == 0:
+                topic_ids = self.get_topic_ids_by_pattern(topic_pattern)
+                if not topic_ids:
                     raise ValueError(
                         "Please provide a valid topic_name or "
                         "topic_name_pattern for aggregation_period {}. "
@@ -203,9 +249,7 @@ class AggregateHistorian(Agent):
                             agg_group['aggregation_period'],
                             topic_pattern))
 
-                _log.info("topic_names matching the given pattern {} "
-                          ":\n {}".format(topic_pattern, topic_map.keys()))
-                data['topic_ids'] = topic_map.values()
+                data['topic_ids'] = topic_ids
 
             # Aggregating across multiple points. Check if unique topic
             # name was given for this.
@@ -280,11 +324,18 @@ class AggregateHistorian(Agent):
         This method in turn calls the platform historian's
         - :py:method:`get_topics_by_pattern()` <BaseHistorian.get_topics_by_pattern>
 
-        and the following methods implemented by child classes:
+        for topic name patterns that have not been resolved since the topics
+        last changed, and the following methods implemented by child classes:
 
+        - :py:meth:`collect_aggregates() <AggregateHistorian.collect_aggregates>`
         - :py:meth:`collect_aggregate() <AggregateHistorian.collect_aggregate>`
         - :py:meth:`insert_aggregate() <AggregateHistorian.insert_aggregate>`
 
+        Sums, counts, averages, minimums and maximums of all points are
+        computed from a single call to collect_aggregates. Other aggregations,
+        or all of them if the child class does not implement
+        collect_aggregates, use one collect_aggregate call per point.
+
         :param collection_time:  time of aggregation collection
         :param param agg_time_period: time agg_time_period for which data
                                       needs to be collected and aggregated
@@ -315,6 +366,10 @@ class AggregateHistorian(Agent):
             _log.debug(
                 "After  compute agg_time_period = {} start_time {} end_time "
                 "{} ".format(agg_time_period, start_time, end_time))
+            if any(data.get('topic_name_pattern') for data in points):
+                self.refresh_topic_patterns()
+
+            point_topic_ids = []
             for data in points:
                 _log.debug("data in loop {}".format(data))
                 topic_ids = data.get('topic_ids', None)
@@ -322,28 +377,41 @@ class AggregateHistorian(Agent):
                 topic_pattern = data.get('topic_name_pattern', None)
                 if topic_pattern:
                     # Find topic ids that match the pattern at runtime
-                    topic_map = self.vip.rpc.call(
-                        PLATFORM_HISTORIAN,
-                        "get_topics_by_pattern",
-                        topic_pattern=topic_pattern).get()
-                    _log.debug("Found topics for pattern {}".format(topic_map))
-                    if topic_map:
-                        topic_ids = topic_map.values()
-                        _log.debug("topic ids loaded {} ".format(topic_ids))
-                    else:
+                    topic_ids = self.get_topic_ids_by_pattern(topic_pattern)
+                    if not topic_ids:
                         _log.warn(
                             "Skipping recording of aggregate data for {topic} "
                             "between {start_time} and {end_time} as ".format(
                                 topic=topic_pattern,
                                 start_time=start_time,
                                 end_time=end_time))
-                        return
-
-                agg_value, count = self.collect_aggregate(
-                    topic_ids,
-                    data['aggregation_type'],
-                    start_time,
-                    end_time)
+                        continue
+                point_topic_ids.append((data, topic_ids))
+
+            # One grouped query for all points whose aggregate can be
+            # combined from per topic results.
+            grouped_ids = set()
+            for data, topic_ids in point_topic_ids:
+                if data['aggregation_type'].lower() in GROUPED_AGGREGATIONS:
+                    grouped_ids.update(topic_ids)
+            topic_aggregates = None
+            if grouped_ids:
+                topic_aggregates = self.collect_aggregates(
+                    list(grouped_ids), start_time, end_time)
+
+            for data, topic_ids in point_topic_ids:
+                topic_pattern = data.get('topic_name_pattern', None)
+                if (topic_aggregates is not None and
+                        data['aggregation_type'].lower() in
+                        GROUPED_AGGREGATIONS):
+                    agg_value, count = combine_aggregates(
+                        topic_aggregates, topic_ids, data['aggregation_type'])
+                else:
+                    agg_value, count = self.collect_aggregate(
+                        topic_ids,
+                        data['aggregation_type'],
+                        start_time,
+                        end_time)
                 if count == 0:
                     _log.warn(
                         "No records found for topic {topic} between "
@@ -391,6 +459,41 @@ class AggregateHistorian(Agent):
                                        points)
             _log.debug("After Scheduling next collection.{}".format(event))
 
+    def get_topic_ids_by_pattern(self, topic_pattern):
+        """
+        Return the ids of the topics that match topic_pattern. The platform
+        historian is asked once per pattern and the answer is kept until
+        :py:meth:`refresh_topic_patterns()
+        <AggregateHistorian.refresh_topic_patterns>` finds that the topics
+        changed.
+
+        :param topic_pattern: topic name pattern from the configuration
+        :return: list of matching topic ids
+        """
+        topic_ids = self._pattern_topic_ids.get(topic_pattern)
+        if topic_ids is None:
+            topic_map = self.vip.rpc.call(
+                PLATFORM_HISTORIAN,
+                "get_topics_by_pattern",
+                topic_pattern=topic_pattern).get()
+            _log.info("topic_names matching the given pattern {} "
+                      ":\n {}".format(topic_pattern,
+                                      topic_map.keys() if topic_map else []))
+            topic_ids = topic_map.values() if topic_map else []
+            self._pattern_topic_ids[topic_pattern] = topic_ids
+        return topic_ids
+
+    def refresh_topic_patterns(self):
+        """
+        Reload the topic map and forget the topic ids cached for topic name
+        patterns if topics were added or renamed since they were looked up.
+        """
+        topic_map = self.get_topic_map()
+        if topic_map != self._pattern_topic_map:
+            _log.debug("Topics changed, resolving topic name patterns again")
+            self._pattern_topic_map = topic_map
+            self._pattern_topic_ids.clear()
+
     @abstractmethod
     def get_topic_map(self):
         """
@@ -468,6 +571,26 @@ class AggregateHistorian(Agent):
         """
         pass
 
+    def collect_aggregates(self, topic_ids, start_time, end_time):
+        """
+        Collect the sum, count, minimum and maximum of the values of each
+        topic in one query grouped by topic id. Child classes that can do
+        this override it, the default returns None so every aggregate is
+        collected with :py:meth:`collect_aggregate()
+        <AggregateHistorian.collect_aggregate>`.
+
+        :param topic_ids: list of topic ids for which aggregates should be
+                          collected.
+        :param start_time: start time for query (inclusive)
+        :param end_time:  end time for query (exclusive)
+        :return: dictionary of topic id to a tuple of (sum, count, min, max).
+                 If the sum skips some of the records, for example values
+                 that are not numbers, the tuple should end with the number
+                 of values summed so averages are computed over those only.
+                 Topics without records in the time slice may be left out.
+        """
+        return None
+
     @abstractmethod
     def insert_aggregate(self, agg_topic_id, agg_type, agg_time_period,
                          end_time, value, topic_ids):
@@ -227,7 +227,7 @@ import threading
 import weakref
 from Queue import Queue, Empty
 from abc import abstractmethod
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from threading import Thread
 
@@ -313,6 +313,96 @@ STATUS_KEY_CACHE_COUNT = "cache_count"
 STATUS_KEY_PUBLISHING = "publishing"
 STATUS_KEY_CACHE_FULL = "cache_full"
 
+SCRAPE_SOURCES = ('scrape', 'analysis')
+
+BACKUP_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL')
+BACKUP_SYNCHRONOUS_SETTINGS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class ScrapeRecord(object):
+    """
+    All of the points from a single device or analysis `all` publish.
+
+    A scrape is kept together from the capture callback through the event
+    queue, the backup cache and, for historians that set
+    `publish_scrape_records`, :py:meth:`BaseHistorianAgent.publish_to_historian`.
+
+    Iterating over a ScrapeRecord lazily yields the per point records that
+    historians expect:
+
+    .. code-block:: python
+
+        {
+            '_id': 1,
+            'timestamp': timestamp1.replace(tzinfo=pytz.UTC),
+            'source': 'scrape',
+            'topic': "pnnl/isb1/hvac1/thermostat",
+            'value': 73.0,
+            'headers': {"Date": "2015-11-17 21:24:10.189393+00:00"},
+            'meta': {"units": "F", "tz": "UTC", "type": "float"}
+        }
+
+    Passing a ScrapeRecord to :py:meth:`BaseHistorianAgent.report_handled`
+    reports every point in the scrape.
+    """
+    __slots__ = ('source', 'device', 'timestamp', 'values', 'meta',
+                 'headers', 'ids')
+
+    def __init__(self, source, device, timestamp, values, meta, headers,
+                 ids=None):
+        self.source = source
+        self.device = device
+        self.timestamp = timestamp
+        # Point name to value.
+        self.values = values
+        # Point name to meta data dictionary.
+        self.meta = meta
+        # Shared by all points in the scrape.
+        self.headers = headers
+        # Point name to cache id. None until read from the backup cache.
+        self.ids = ids
+
+    def topic(self, point):
+        return self.device + '/' + point
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        ids = self.ids
+        for point, value in self.values.iteritems():
+            record = {'timestamp': self.timestamp,
+                      'source': self.source,
+                      'topic': self.device + '/' + point,
+                      'value': value,
+                      'headers': self.headers,
+                      'meta': self.meta.get(point, {})}
+            if ids is not None:
+                record['_id'] = ids[point]
+            yield record
+
+
+def iter_records(to_publish_list):
+    """
+    Iterate over a list of records and :py:class:`ScrapeRecord` objects
+    yielding only per point records.
+    """
+    for item in to_publish_list:
+        if isinstance(item, ScrapeRecord):
+            for record in item:
+                yield record
+        else:
+            yield item
+
+
+def count_records(to_publish_list):
+    """
+    Number of per point records in a list that may contain
+    :py:class:`ScrapeRecord` objects.
+    """
+    return sum(len(item) if isinstance(item, ScrapeRecord) else 1
+               for item in to_publish_list)
+
 
 class BaseHistorianAgent(Agent):
     """
@@ -361,6 +451,10 @@ class BaseHistorianAgent(Agent):
                  history_limit_days=None,
                  storage_limit_gb=None,
                  sync_timestamp=False,
+                 prefetch_batches=0,
+                 cache_only_on_failure=False,
+                 backup_journal_mode=None,
+                 backup_synchronous=None,
                  **kwargs):
 
         super(BaseHistorianAgent, self).__init__(**kwargs)
@@ -396,9 +490,16 @@ class BaseHistorianAgent(Agent):
         self._setup_failed = False
         self._process_thread = None
         self._message_publish_count = int(message_publish_count)
+        self._prefetch_batches = int(prefetch_batches)
+        self._cache_only_on_failure = bool(cache_only_on_failure)
+        self._backup_journal_mode = backup_journal_mode
+        self._backup_synchronous = backup_synchronous
 
         self.no_insert = False
         self.no_query = False
+        # Historians that can write a whole device scrape at once may set
+        # this to receive ScrapeRecord objects in publish_to_historian.
+        self.publish_scrape_records = False
         self.instance_name = None
         self._sync_timestamp = sync_timestamp
 
@@ -423,6 +524,10 @@ class BaseHistorianAgent(Agent):
                                 "capture_analysis_data": capture_analysis_data,
                                 "capture_record_data": capture_record_data,          
                                 "message_publish_count": self._message_publish_count,
+                                "prefetch_batches": self._prefetch_batches,
+                                "cache_only_on_failure": self._cache_only_on_failure,
+                                "backup_journal_mode": self._backup_journal_mode,
+                                "backup_synchronous": self._backup_synchronous,
                                 "storage_limit_gb": storage_limit_gb,
                                 "history_limit_days": history_limit_days
                                }
@@ -520,6 +625,20 @@ class BaseHistorianAgent(Agent):
 
             readonly = bool(config.get("readonly", False))
             message_publish_count = int(config.get("message_publish_count", 10000))
+            prefetch_batches = max(0, int(config.get("prefetch_batches", 0)))
+            cache_only_on_failure = bool(config.get("cache_only_on_failure", False))
+
+            backup_journal_mode = config.get("backup_journal_mode")
+            if backup_journal_mode is not None:
+                backup_journal_mode = str(backup_journal_mode).upper()
+                if backup_journal_mode not in BACKUP_JOURNAL_MODES:
+                    raise ValueError("Invalid backup_journal_mode: {}".format(backup_journal_mode))
+
+            backup_synchronous = config.get("backup_synchronous")
+            if backup_synchronous is not None:
+                backup_synchronous = str(backup_synchronous).upper()
+                if backup_synchronous not in BACKUP_SYNCHRONOUS_SETTINGS:
+                    raise ValueError("Invalid backup_synchronous: {}".format(backup_synchronous))
         except ValueError as e:
             self._backup_storage_report = 0.9
             _log.error("Failed to load base historian settings. Settings not applied!")
@@ -547,6 +666,10 @@ class BaseHistorianAgent(Agent):
 
         self._readonly = readonly
         self._message_publish_count = message_publish_count
+        self._prefetch_batches = prefetch_batches
+        self._cache_only_on_failure = cache_only_on_failure
+        self._backup_journal_mode = backup_journal_mode
+        self._backup_synchronous = backup_synchronous
 
         self._update_subscriptions(bool(config.get("capture_device_data", True)),
                                    bool(config.get("capture_log_data", True)),
@@ -873,6 +996,14 @@ class BaseHistorianAgent(Agent):
             if len(message) == 2:
                 meta = message[1]
 
+        # Checked here so that a bad publish does not reach the cache and
+        # fail the whole batch it is saved with.
+        if not isinstance(values, dict) or not isinstance(meta, dict):
+            _log.error("message for {topic} is not a dictionary of point "
+                       "values and meta data: {message}".format(
+                           topic=topic, message=message))
+            return
+
         if topic.startswith('analysis'):
             source = 'analysis'
         else:
@@ -884,13 +1015,8 @@ class BaseHistorianAgent(Agent):
         if self.gather_timing_data:
             add_timing_data_to_header(headers, self.core.agent_uuid or self.core.identity, "collected")
 
-        for key, value in values.iteritems():
-            point_topic = device + '/' + key
-            self._event_queue.put({'source': source,
-                                   'topic': point_topic,
-                                   'readings': [(timestamp, value)],
-                                   'meta': meta.get(key, {}),
-                                   'headers': headers})
+        self._event_queue.put(ScrapeRecord(source, device, timestamp, values,
+                                           meta, headers))
 
     def _capture_actuator_data(self, topic, headers, message, match):
         """Capture actuation data and submit it to be published by a historian.
@@ -1000,9 +1126,22 @@ class BaseHistorianAgent(Agent):
             return
 
         backupdb = BackupDatabase(self, self._backup_storage_limit_gb,
-                                  self._backup_storage_report)
+                                  self._backup_storage_report,
+                                  group_scrapes=self.publish_scrape_records,
+                                  journal_mode=self._backup_journal_mode,
+                                  synchronous=self._backup_synchronous)
         self._update_status({STATUS_KEY_CACHE_COUNT: backupdb.get_backlog_count()})
 
+        prefetcher = None
+        if self._prefetch_batches > 0:
+            if self._process_loop_in_greenlet:
+                _log.warning("prefetch_batches is not supported when the "
+                             "process loop runs in a greenlet. Ignoring.")
+            else:
+                prefetcher = _BatchPrefetcher(backupdb,
+                                              self._submit_size_limit,
+                                              self._prefetch_batches)
+
         # now that everything is setup we need to make sure that the topics
         # are synchronized between
 
@@ -1034,8 +1173,25 @@ class BaseHistorianAgent(Agent):
 
 
             # We wake the thread after a configuration change by passing a None to the queue.
+            new_to_publish = [x for x in new_to_publish if x is not None]
+
+            # Nothing is waiting in the cache so try to send the new data
+            # straight to the historian. Only what could not be published
+            # is written to the cache.
+            if (self._cache_only_on_failure and new_to_publish and
+                    not self._setup_failed and
+                    backupdb.get_backlog_count() == 0):
+                new_to_publish, published_count = self._publish_direct(new_to_publish)
+                current_published_count += published_count
+
             # Backup anything new before checking for a stop.
-            cache_full = backupdb.backup_new_data((x for x in new_to_publish if x is not None))
+            cache_full = backupdb.backup_new_data(new_to_publish)
+            if prefetcher is not None:
+                if cache_full:
+                    # Records may have been dropped from the head of the cache.
+                    prefetcher.rewind()
+                elif new_to_publish:
+                    prefetcher.new_data()
             backlog_count = backupdb.get_backlog_count()
             if cache_full:
                 self._send_alert({STATUS_KEY_CACHE_FULL: cache_full,
@@ -1063,8 +1219,18 @@ class BaseHistorianAgent(Agent):
                 _log.debug("Beginning publish loop.")
 
                 while True:
-                    to_publish_list = backupdb.get_outstanding_to_publish(
-                        self._submit_size_limit)
+                    last_outstanding_id = None
+                    read_directly = prefetcher is None
+                    if prefetcher is not None:
+                        # Already read and decoded while the previous batch
+                        # was being published.
+                        try:
+                            to_publish_list, last_outstanding_id = prefetcher.next_batch()
+                        except Exception:
+                            read_directly = True
+                    if read_directly:
+                        to_publish_list = backupdb.get_outstanding_to_publish(
+                            self._submit_size_limit)
 
                     # Check to see if we are caught up.
                     if not to_publish_list:
@@ -1079,29 +1245,30 @@ class BaseHistorianAgent(Agent):
                     if self._stop_process_loop:
                         break
 
-                    history_limit_timestamp = None
-                    if self._history_limit_days is not None:
-                        last_element = to_publish_list[-1]
-                        last_time_stamp = last_element["timestamp"]
-                        history_limit_timestamp = last_time_stamp - self._history_limit_days
-
-                    try:
-                        self.publish_to_historian(to_publish_list)
-                        self.manage_db_size(history_limit_timestamp, self._storage_limit_gb)
-                    except:
-                        _log.exception(
-                            "An unhandled exception occurred while publishing.")
+                    self._publish_batch(to_publish_list)
 
                     # if the success queue is empty then we need not remove
                     # them from the database and we are probably having connection problems.
                     # Update the status and send alert accordingly.
                     if not self._successful_published:
+                        if prefetcher is not None:
+                            prefetcher.rewind()
                         self._send_alert({STATUS_KEY_PUBLISHING: False}, "historian_not_publishing")
                         break
 
 
                     backupdb.remove_successfully_published(
-                        self._successful_published, self._submit_size_limit)
+                        self._successful_published, self._submit_size_limit,
+                        last_outstanding_id=last_outstanding_id)
+
+                    # Records that were not handled are still at the head of
+                    # the cache. Read them again before anything prefetched.
+                    # After a direct read the prefetcher restarts from the
+                    # head as well.
+                    if prefetcher is not None and (read_directly or (
+                            None not in self._successful_published and
+                            len(self._successful_published) < count_records(to_publish_list))):
+                        prefetcher.rewind()
 
                     backlog_count = backupdb.get_backlog_count()
                     old_backlog_state = self._current_status_context[STATUS_KEY_BACKLOGGED]
@@ -1110,7 +1277,7 @@ class BaseHistorianAgent(Agent):
                                          STATUS_KEY_CACHE_COUNT: backlog_count})
 
                     if None in self._successful_published:
-                        current_published_count += len(to_publish_list)
+                        current_published_count += count_records(to_publish_list)
                     else:
                         current_published_count += len(self._successful_published)
 
@@ -1135,6 +1302,9 @@ class BaseHistorianAgent(Agent):
             if self._stop_process_loop:
                 break
 
+        if prefetcher is not None:
+            prefetcher.stop()
+
         backupdb.close()
 
         try:
@@ -1145,6 +1315,119 @@ class BaseHistorianAgent(Agent):
         _log.debug("Process loop stopped.")
         self._stop_process_loop = False
 
+    def _publish_batch(self, to_publish_list):
+        history_limit_timestamp = None
+        if self._history_limit_days is not None:
+            last_element = to_publish_list[-1]
+            if isinstance(last_element, ScrapeRecord):
+                last_time_stamp = last_element.timestamp
+            else:
+                last_time_stamp = last_element["timestamp"]
+            history_limit_timestamp = last_time_stamp - self._history_limit_days
+
+        try:
+            self.publish_to_historian(to_publish_list)
+            self.manage_db_size(history_limit_timestamp, self._storage_limit_gb)
+        except:
+            _log.exception(
+                "An unhandled exception occurred while publishing.")
+
+    def _publish_direct(self, new_to_publish):
+        """
+        Publish records from the event queue without caching them first.
+
+        Records are given temporary ids for
+        :py:meth:`BaseHistorianAgent.report_handled`. Publishing stops at the
+        first batch that is not completely handled.
+
+        :returns: Tuple of the records in event queue form that still need to
+                  be cached and the number of records published.
+        """
+        # Temporary id to (queue item, point name or reading).
+        pending = {}
+        batches = []
+        batch = []
+        batch_size = 0
+        next_id = 0
+
+        for item in new_to_publish:
+            if isinstance(item, ScrapeRecord):
+                if item.timestamp is None:
+                    item.timestamp = get_aware_utc_now()
+                item.ids = {}
+                for point in item.values:
+                    item.ids[point] = next_id
+                    pending[next_id] = (item, point)
+                    next_id += 1
+                records = [item] if self.publish_scrape_records else list(item)
+                count = len(item)
+            else:
+                records = []
+                for timestamp, value in item['readings']:
+                    if timestamp is None:
+                        timestamp = get_aware_utc_now()
+                    records.append({'_id': next_id,
+                                    'timestamp': timestamp,
+                                    'source': item['source'],
+                                    'topic': item['topic'],
+                                    'value': value,
+                                    'headers': item.get('headers', {}),
+                                    'meta': item.get('meta', {})})
+                    pending[next_id] = (item, (timestamp, value))
+                    next_id += 1
+                count = len(records)
+
+            batch.extend(records)
+            batch_size += count
+            if batch_size >= self._submit_size_limit:
+                batches.append(batch)
+                batch = []
+                batch_size = 0
+        if batch:
+            batches.append(batch)
+
+        published_count = 0
+        for to_publish_list in batches:
+            self._successful_published = set()
+            self._publish_batch(to_publish_list)
+            handled = self._successful_published
+            self._successful_published = set()
+
+            if None in handled:
+                handled = set(r['_id'] for r in iter_records(to_publish_list))
+            for _id in handled:
+                if pending.pop(_id, None) is not None:
+                    published_count += 1
+
+            if len(handled) < count_records(to_publish_list):
+                break
+
+        if published_count:
+            self._update_status({STATUS_KEY_PUBLISHING: True})
+
+        # Rebuild queue items for everything not published.
+        to_cache = []
+        scrapes = {}
+        for _id in sorted(pending):
+            item, part = pending[_id]
+            if isinstance(item, ScrapeRecord):
+                remaining = scrapes.get(id(item))
+                if remaining is None:
+                    remaining = ScrapeRecord(item.source, item.device,
+                                             item.timestamp, {}, item.meta,
+                                             item.headers)
+                    scrapes[id(item)] = remaining
+                    to_cache.append(remaining)
+                remaining.values[part] = item.values[part]
+            else:
+                to_cache.append({'source': item['source'],
+                                 'topic': item['topic'],
+                                 'readings': [part],
+                                 'meta': item.get('meta', {}),
+                                 'headers': item.get('headers', {})})
+
+        return to_cache, published_count
+
     def _historian_setup(self):
         try:
             _log.exception("Trying to setup historian")
@@ -1169,13 +1452,15 @@ class BaseHistorianAgent(Agent):
         removed from the cache.
 
         :param record: Record or list of records to remove from cache.
-        :type record: dict or list
+        :type record: dict, ScrapeRecord or list
         """
-        if isinstance(record, list):
-            for x in record:
+        if not isinstance(record, list):
+            record = [record]
+        for x in record:
+            if isinstance(x, ScrapeRecord):
+                self._successful_published.update(x.ids.itervalues())
+            else:
                 self._successful_published.add(x['_id'])
-        else:
-            self._successful_published.add(record['_id'])
 
     def report_all_handled(self):
         """
@@ -1216,6 +1501,12 @@ class BaseHistorianAgent(Agent):
                 ...
             ]
 
+        If `publish_scrape_records` is set to True by the historian, records
+        from a single device or analysis publish arrive as one
+        :py:class:`ScrapeRecord` instead of one record per point. Iterating
+        over a ScrapeRecord (or using :py:func:`iter_records` on the whole
+        list) yields the per point records shown above.
+
         The contents of `meta` is not consistent. The keys in the meta data
         values can be different and can
         change along with the values of the meta data. It is safe to assume
@@ -1330,10 +1621,13 @@ class BackupDatabase:
     """
 
     def __init__(self, owner, backup_storage_limit_gb, backup_storage_report,
-                 check_same_thread=True):
+                 check_same_thread=True, group_scrapes=False,
+                 journal_mode=None, synchronous=None):
         # The topic cache is only meant as a local lookup and should not be
         # accessed via the implemented historians.
         self._backup_cache = {}
+        # Return points cached from the same scrape as a ScrapeRecord.
+        self._group_scrapes = group_scrapes
         # Count of records in cache.
         self._record_count = 0
         self._meta_data = defaultdict(dict)
@@ -1341,6 +1635,12 @@ class BackupDatabase:
         self._backup_storage_limit_gb = backup_storage_limit_gb
         self._backup_storage_report = backup_storage_report
         self._connection = None
+        # Id of the last record returned by get_outstanding_to_publish.
+        self._last_outstanding_id = None
+        # SQLite journal_mode and synchronous settings. None uses the
+        # SQLite defaults.
+        self._journal_mode = journal_mode
+        self._synchronous = synchronous
         self._setupdb(check_same_thread)
 
     def backup_new_data(self, new_publish_list):
@@ -1353,47 +1653,68 @@ class BackupDatabase:
         #_log.debug("Backing up unpublished values.")
         c = self._connection.cursor()
 
+        # Records from the same publish share a single headers dictionary.
+        # Serialize each distinct headers object once and store it once in
+        # the headers table. Cached rows only reference it by id.
+        header_ids = {}
+        rows = []
+
         for item in new_publish_list:
+            if isinstance(item, ScrapeRecord):
+                source = item.source
+                headers = item.headers
+                timestamp = item.timestamp
+                if timestamp is None:
+                    timestamp = get_aware_utc_now()
+                header_id = self._get_shared_header_id(c, header_ids, headers)
+                device = item.device
+                meta = item.meta
+                for point, value in item.values.iteritems():
+                    topic_id = self._get_topic_id(c, device + '/' + point)
+                    point_meta = meta.get(point)
+                    if point_meta:
+                        self._update_meta(c, source, topic_id, point_meta)
+                    rows.append((timestamp, source, topic_id, dumps(value),
+                                 header_id))
+                continue
+
             source = item['source']
             topic = item['topic']
             meta = item.get('meta', {})
             readings = item['readings']
             headers = item.get('headers', {})
 
-            topic_id = self._backup_cache.get(topic)
-
-            if topic_id is None:
-                c.execute('''INSERT INTO topics values (?,?)''',
-                          (None, topic))
-                c.execute('''SELECT last_insert_rowid()''')
-                row = c.fetchone()
-                topic_id = row[0]
-                self._backup_cache[topic_id] = topic
-                self._backup_cache[topic] = topic_id
-
-            meta_dict = self._meta_data[(source, topic_id)]
-            for name, value in meta.iteritems():
-                current_meta_value = meta_dict.get(name)
-                if current_meta_value != value:
-                    c.execute('''INSERT OR REPLACE INTO metadata
-                                 values(?, ?, ?, ?)''',
-                              (source, topic_id, name, value))
-                    meta_dict[name] = value
+            topic_id = self._get_topic_id(c, topic)
+            self._update_meta(c, source, topic_id, meta)
+            header_id = self._get_shared_header_id(c, header_ids, headers)
 
             for timestamp, value in readings:
                 if timestamp is None:
                     timestamp = get_aware_utc_now()
-                try:
-                    c.execute(
-                        '''INSERT INTO outstanding
-                        values(NULL, ?, ?, ?, ?, ?)''',
-                        (timestamp, source, topic_id, dumps(value), dumps(headers)))
-                    self._record_count += 1
-                except sqlite3.IntegrityError:
-                    # In the case where we are upgrading an existing installed historian the
-                    # unique constraint may still exist on the outstanding database.
-                    # Ignore this case.
-                    pass
+                rows.append((timestamp, source, topic_id, dumps(value),
+                             header_id))
+
+        if rows:
+            try:
+                c.executemany(
+                    '''INSERT INTO outstanding
+                    (ts, source, topic_id, value_string, header_id)
+                    values(?, ?, ?, ?, ?)''', rows)
+                self._record_count += len(rows)
+            except sqlite3.IntegrityError:
+                # In the case where we are upgrading an existing installed
+                # historian the unique constraint may still exist on the
+                # outstanding database. Fall back to inserting one row at a
+                # time and ignore the duplicates.
+                for row in rows:
+                    try:
+                        c.execute(
+                            '''INSERT INTO outstanding
+                            (ts, source, topic_id, value_string, header_id)
+                            values(?, ?, ?, ?, ?)''', row)
+                        self._record_count += 1
+                    except sqlite3.IntegrityError:
+                        pass
 
         cache_full = False
         if self._backup_storage_limit_gb is not None:
@@ -1409,6 +1730,7 @@ class BackupDatabase:
                     (SELECT ROWID FROM outstanding
                     ORDER BY ROWID ASC LIMIT 100)''')
                 self._record_count -= c.rowcount
+                self._delete_unused_headers(c)
                 cache_full = True
 
             # Catch case where we are not adding fast enough to trigger the above
@@ -1420,8 +1742,69 @@ class BackupDatabase:
 
         return cache_full
 
+    def _get_topic_id(self, c, topic):
+        topic_id = self._backup_cache.get(topic)
+
+        if topic_id is None:
+            c.execute('''INSERT INTO topics values (?,?)''',
+                      (None, topic))
+            c.execute('''SELECT last_insert_rowid()''')
+            row = c.fetchone()
+            topic_id = row[0]
+            self._backup_cache[topic_id] = topic
+            self._backup_cache[topic] = topic_id
+
+        return topic_id
+
+    def _update_meta(self, c, source, topic_id, meta):
+        meta_dict = self._meta_data[(source, topic_id)]
+        for name, value in meta.iteritems():
+            current_meta_value = meta_dict.get(name)
+            if current_meta_value != value:
+                c.execute('''INSERT OR REPLACE INTO metadata
+                             values(?, ?, ?, ?)''',
+                          (source, topic_id, name, value))
+                meta_dict[name] = value
+
+    def _get_shared_header_id(self, c, header_ids, headers):
+        """
+        Look up or store `headers` for the current backup_new_data call.
+        Records from the same publish share a single headers dictionary so
+        the object's id is used as the key. A reference to the headers object
+        is kept alongside its row id so the key cannot be reused by another
+        object during the call.
+        """
+        header_entry = header_ids.get(id(headers))
+        if header_entry is None:
+            header_entry = (headers, self._get_header_id(c, headers))
+            header_ids[id(headers)] = header_entry
+        return header_entry[1]
+
+    def _get_header_id(self, c, headers):
+        """
+        Store a headers dictionary in the headers table.
+
+        :returns: The id of the new headers row or None if `headers` is empty.
+        """
+        if not headers:
+            return None
+        c.execute('''INSERT INTO headers values (?,?)''',
+                  (None, dumps(headers)))
+        return c.lastrowid
+
+    def _delete_unused_headers(self, c):
+        """
+        Headers rows are shared by many cached records. Records are consumed
+        roughly in insertion order so every headers row older than the oldest
+        one still referenced can no longer be used.
+        """
+        c.execute('''DELETE FROM headers
+                     WHERE header_id < coalesce(
+                        (SELECT min(header_id) FROM outstanding),
+                        (SELECT max(header_id) + 1 FROM headers))''')
+
     def remove_successfully_published(self, successful_publishes,
-                                      submit_size):
+                                      submit_size, last_outstanding_id=None):
         """
         Removes the reported successful publishes from the backup database.
         If None is found in `successful_publishes` we assume that everything
@@ -1430,20 +1813,34 @@ class BackupDatabase:
         :param successful_publishes: List of records that was published.
         :param submit_size: Number of things requested from previous call to
                             :py:meth:`get_outstanding_to_publish`
+        :param last_outstanding_id: Id of the last record in the published
+                                    batch if it was not read with
+                                    :py:meth:`get_outstanding_to_publish`.
 
         :type successful_publishes: list
         :type submit_size: int
+        :type last_outstanding_id: int
 
         """
+        if last_outstanding_id is not None:
+            self._last_outstanding_id = last_outstanding_id
 
         #_log.debug("Cleaning up successfully published values.")
         c = self._connection.cursor()
 
         if None in successful_publishes:
-            c.execute('''DELETE FROM outstanding
-                        WHERE ROWID IN
-                        (SELECT ROWID FROM outstanding
-                          ORDER BY ts LIMIT ?)''', (submit_size,))
+            if self._last_outstanding_id is not None:
+                # Records are read from the head of the table in id order
+                # and new records always get a larger id so everything up to
+                # the last id handed out was in the published batch.
+                c.execute('''DELETE FROM outstanding
+                            WHERE id <= ?''', (self._last_outstanding_id,))
+                self._last_outstanding_id = None
+            else:
+                c.execute('''DELETE FROM outstanding
+                            WHERE id IN
+                            (SELECT id FROM outstanding
+                              ORDER BY id LIMIT ?)''', (submit_size,))
             if self._record_count < c.rowcount:
                 self._record_count = 0
             else:
@@ -1457,46 +1854,120 @@ class BackupDatabase:
                            successful_publishes))
             self._record_count -= len(temp)
 
+        self._delete_unused_headers(c)
+
         self._connection.commit()
 
     def get_outstanding_to_publish(self, size_limit):
         """
-        Retrieve up to `size_limit` records from the cache.
+        Retrieve up to `size_limit` of the oldest records from the cache.
+
+        The cache is consumed as a queue in insertion order. Records are
+        read from the head of the outstanding table by id, which is the
+        table's primary key, so no sorting is needed however large the
+        backlog is.
 
         :param size_limit: Max number of records to retrieve.
         :type size_limit: int
-        :returns: List of records for publication.
+        :returns: List of records for publication. Points cached from the
+                  same scrape are returned as a :py:class:`ScrapeRecord` if
+                  the database was created with `group_scrapes`.
         :rtype: list
         """
         # _log.debug("Getting oldest outstanding to publish.")
         c = self._connection.cursor()
-        c.execute('select * from outstanding order by ts limit ?',
-                  (size_limit,))
+        results, row_count, last_id = self._read_outstanding(c, None,
+                                                             size_limit)
+        c.close()
+
+        self._last_outstanding_id = last_id
+
+        # If we were backlogged at startup and our initial estimate was
+        # off this will correct it.
+        if row_count < size_limit:
+            self._record_count = row_count
+
+        return results
+
+    def read_outstanding(self, connection, after_id, size_limit):
+        """
+        Read up to `size_limit` records with an id greater than `after_id`
+        using a separate connection from :py:meth:`connect`. Used to read
+        ahead of the records currently being published.
+
+        :returns: Tuple of the list of records and the id of the last row
+                  read or None if nothing was read.
+        """
+        c = connection.cursor()
+        try:
+            results, _, last_id = self._read_outstanding(c, after_id,
+                                                         size_limit)
+        finally:
+            c.close()
+        return results, last_id
+
+    def _read_outstanding(self, c, after_id, size_limit):
+        if after_id is None:
+            after_id = -1
+        c.execute('''SELECT o.id, o.ts, o.source, o.topic_id,
+                            o.value_string, o.header_string, o.header_id,
+                            h.header_string
+                     FROM outstanding AS o
+                     LEFT JOIN headers AS h ON o.header_id = h.header_id
+                     WHERE o.id > ?
+                     ORDER BY o.id LIMIT ?''',
+                  (after_id, size_limit))
         results = []
+        # Decode each shared headers row once per batch.
+        header_cache = {}
+        group_scrapes = self._group_scrapes
+        scrape = None
+        scrape_key = None
+        row_count = 0
         for row in c:
             _id = row[0]
             timestamp = row[1]
             source = row[2]
             topic_id = row[3]
             value = loads(row[4])
-            headers = {} if row[5] is None else loads(row[5])
+            if row[6] is not None:
+                headers = header_cache.get(row[6])
+                if headers is None:
+                    headers = header_cache[row[6]] = loads(row[7])
+            elif row[5] is not None:
+                # Row cached before headers were stored separately.
+                headers = loads(row[5])
+            else:
+                headers = {}
             meta = self._meta_data[(source, topic_id)].copy()
+            topic = self._backup_cache[topic_id]
+            timestamp = timestamp.replace(tzinfo=pytz.UTC)
+            row_count += 1
+
+            if group_scrapes and source in SCRAPE_SOURCES and '/' in topic:
+                device, point = topic.rsplit('/', 1)
+                key = (source, timestamp, row[6], device)
+                # Points from the same publish are cached next to each other.
+                if key != scrape_key or point in scrape.values:
+                    scrape_key = key
+                    scrape = ScrapeRecord(source, device, timestamp, {}, {},
+                                          headers, {})
+                    results.append(scrape)
+                scrape.values[point] = value
+                scrape.meta[point] = meta
+                scrape.ids[point] = _id
+                continue
+
+            scrape_key = None
             results.append({'_id': _id,
-                            'timestamp': timestamp.replace(tzinfo=pytz.UTC),
+                            'timestamp': timestamp,
                             'source': source,
-                            'topic': self._backup_cache[topic_id],
+                            'topic': topic,
                             'value': value,
                             'headers': headers,
                             'meta': meta})
 
-        c.close()
-
-        # If we were backlogged at startup and our initial estimate was
-        # off this will correct it.
-        if len(results) < size_limit:
-            self._record_count = len(results)
-
-        return results
+        return results, row_count, _id if row_count else None
 
     def get_backlog_count(self):
         """
@@ -1509,17 +1980,32 @@ class BackupDatabase:
         self._connection.close()
         self._connection = None
 
+    def connect(self, check_same_thread=True):
+        """
+        Open a new connection to the backup database.
+        """
+        return sqlite3.connect(
+            'backup.sqlite',
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread=check_same_thread)
+
     def _setupdb(self, check_same_thread):
         """ Creates a backup database for the historian if doesn't exist."""
 
         _log.debug("Setting up backup DB.")
-        self._connection = sqlite3.connect(
-            'backup.sqlite',
-            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
-            check_same_thread=check_same_thread)
+        self._connection = self.connect(check_same_thread)
 
         c = self._connection.cursor()
 
+        # Values are checked against BACKUP_JOURNAL_MODES and
+        # BACKUP_SYNCHRONOUS_SETTINGS by the historian. Pragmas do not
+        # support parameters.
+        if self._journal_mode is not None:
+            c.execute("PRAGMA journal_mode = {}".format(self._journal_mode))
+            _log.debug("Backup DB journal mode: {}".format(c.fetchone()[0]))
+        if self._synchronous is not None:
+            c.execute("PRAGMA synchronous = {}".format(self._synchronous))
+
         if self._backup_storage_limit_gb is not None:
             c.execute('''PRAGMA page_size''')
             page_size = c.fetchone()[0]
@@ -1538,10 +2024,11 @@ class BackupDatabase:
                                          source TEXT NOT NULL,
                                          topic_id INTEGER NOT NULL,
                                          value_string TEXT NOT NULL,
-                                         header_string TEXT)''')
+                                         header_string TEXT,
+                                         header_id INTEGER)''')
             self._record_count = 0
         else:
-            # Check to see if we have a header_string column.
+            # Check to see if we have the header_string and header_id columns.
             c.execute("pragma table_info(outstanding);")
             name_index = 0
             for description in c.description:
@@ -1549,37 +2036,40 @@ class BackupDatabase:
                     break
                 name_index += 1
 
-            found_header_column = False
-            for row in c:
-                if row[name_index] == "header_string":
-                    found_header_column = True
-                    break
+            columns = set(row[name_index] for row in c)
 
-            if not found_header_column:
+            if "header_string" not in columns:
                 _log.info("Updating cache database to support storing header data.")
                 c.execute("ALTER TABLE outstanding ADD COLUMN header_string text;")
 
+            if "header_id" not in columns:
+                _log.info("Updating cache database to support shared header data.")
+                c.execute("ALTER TABLE outstanding ADD COLUMN header_id integer;")
+
             # Initialize record_count at startup.
             # This is a (probably correct) estimate of the total records cached.
             # We do not use count() as it can be very slow if the cache is quite large.
             _log.info("Counting existing rows.")
-            self._connection.execute('''select
-                                        max(id)
-                                        from outstanding''')
-            max_id = c.fetchone()
-
-            self._connection.execute('''select
-                                        min(id)
-                                        from outstanding''')
-            min_id = c.fetchone()
+            c.execute('''select
+                         min(id), max(id)
+                         from outstanding''')
+            min_id, max_id = c.fetchone()
 
             if max_id is not None and min_id is not None:
-                self._record_count = max_id[0] - min_id[0] + 1
+                self._record_count = max_id - min_id + 1
             else:
                 self._record_count = 0
 
-        c.execute('''CREATE INDEX IF NOT EXISTS outstanding_ts_index
-                                           ON outstanding (ts)''')
+        # The cache is read in id order. An index on ts only slows down
+        # inserts.
+        c.execute('''DROP INDEX IF EXISTS outstanding_ts_index''')
+
+        c.execute('''CREATE INDEX IF NOT EXISTS outstanding_header_id_index
+                                           ON outstanding (header_id)''')
+
+        c.execute('''CREATE TABLE IF NOT EXISTS headers
+                     (header_id INTEGER PRIMARY KEY,
+                      header_string TEXT NOT NULL)''')
 
         c.execute("SELECT name FROM sqlite_master WHERE type='table' "
                   "AND name='metadata';")
@@ -1615,6 +2105,134 @@ class BackupDatabase:
         self._connection.commit()
 
 
+class _BatchPrefetcher(object):
+    """
+    Reads and decodes batches from a :py:class:`BackupDatabase` in a
+    separate thread so the next batches are ready while the current one is
+    being published.
+
+    Batches are handed out in id order. After a publish that did not handle
+    every record :py:meth:`rewind` must be called so reading starts again
+    from the head of the cache.
+
+    If reading ahead fails :py:meth:`next_batch` raises the error, and
+    reading ahead stops until the next :py:meth:`rewind`. The caller reads
+    the batch from the cache itself in the meantime.
+    """
+
+    def __init__(self, backupdb, size_limit, depth):
+        self._backupdb = backupdb
+        self._size_limit = size_limit
+        self._depth = depth
+        self._condition = threading.Condition()
+        self._batches = deque()
+        # Id of the last record read.
+        self._last_id = None
+        # Incremented by rewind to discard reads in progress.
+        self._generation = 0
+        # Incremented whenever new data is cached.
+        self._data_version = 0
+        # Data version at which the reader last found nothing new.
+        self._exhausted_version = None
+        # Error from the last failed read, kept until the next rewind.
+        self._error = None
+        self._stopped = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        connection = self._backupdb.connect()
+        try:
+            while True:
+                with self._condition:
+                    while not self._stopped and (
+                            len(self._batches) >= self._depth or
+                            self._error is not None or
+                            self._exhausted_version == self._data_version):
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+                    generation = self._generation
+                    data_version = self._data_version
+                    last_id = self._last_id
+
+                try:
+                    batch, last_read_id = self._backupdb.read_outstanding(
+                        connection, last_id, self._size_limit)
+                except Exception as e:
+                    _log.exception("Failed to read ahead from the backup cache.")
+                    with self._condition:
+                        if generation == self._generation:
+                            self._error = e
+                            self._condition.notify_all()
+                    continue
+
+                with self._condition:
+                    if generation != self._generation:
+                        continue
+                    if batch:
+                        self._batches.append((batch, last_read_id))
+                        self._last_id = last_read_id
+                    else:
+                        self._exhausted_version = data_version
+                    self._condition.notify_all()
+        finally:
+            connection.close()
+
+    def next_batch(self):
+        """
+        :returns: Tuple of the next batch of records and the id of its last
+                  record. The batch is empty if everything cached has been
+                  handed out.
+        :raises: The error from reading ahead if the next batch could not
+                 be read.
+        """
+        with self._condition:
+            while (not self._stopped and not self._batches and
+                   self._error is None and
+                   self._exhausted_version != self._data_version):
+                self._condition.wait()
+            if self._batches:
+                batch = self._batches.popleft()
+                self._condition.notify_all()
+                return batch
+            if self._error is not None:
+                raise self._error
+            return [], None
+
+    def new_data(self):
+        """
+        Called after new records are written to the cache while no batch is
+        being published.
+        """
+        with self._condition:
+            self._data_version += 1
+            if not self._batches and self._exhausted_version is not None:
+                # Everything handed out has been removed from the cache.
+                # Ids start over when the table is emptied so read from
+                # the head again.
+                self._generation += 1
+                self._last_id = None
+            self._condition.notify_all()
+
+    def rewind(self):
+        """Discard prefetched batches and read again from the head."""
+        with self._condition:
+            self._generation += 1
+            self._batches.clear()
+            self._last_id = None
+            self._exhausted_version = None
+            self._error = None
+            self._condition.notify_all()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(5.0)
+
+
 # Code reimplemented from https://github.com/gilesbrown/gsqlite3
 def _using_threadpool(method):
     @wraps(method, ['__name__', '__doc__'])
@@ -1643,6 +2261,10 @@ class BaseQueryHistorianAgent(Agent):
     their data stores.
     """
 
+    # Historians that implement query_historian_page set this to accept
+    # page_size in the query RPC.
+    supports_paging = False
+
     @RPC.export
     def get_version(self):
         """RPC call to get the version of the historian
@@ -1763,7 +2385,8 @@ class BaseQueryHistorianAgent(Agent):
 
     @RPC.export
     def query(self, topic=None, start=None, end=None, agg_type=None,
-              agg_period=None, skip=0, count=None, order="FIRST_TO_LAST"):
+              agg_period=None, skip=0, count=None, order="FIRST_TO_LAST",
+              page_size=None, continuation=None):
         """RPC call to query an Historian for time series data.
 
         :param topic: Topic or topics to query for.
@@ -1782,9 +2405,16 @@ class BaseQueryHistorianAgent(Agent):
                          aggregation ( for example, sum, avg)
         :param agg_period: If this is a query for aggregate data, the time
                            period of aggregation
+        :param page_size: Return at most this many values, across all
+                          topics, and a continuation token for the rest.
+        :param continuation: Token returned with the previous page. The
+                             other arguments must be the same as the ones
+                             the previous page was queried with.
         :type skip: int
         :type count: int
         :type order: str
+        :type page_size: int
+        :type continuation: str
 
         :return: Results of the query
         :rtype: dict
@@ -1811,11 +2441,26 @@ class BaseQueryHistorianAgent(Agent):
         specify one hour ago.
         "now -1d -1h -20m" would specify 25 hours and 20 minutes ago.
 
+        When page_size is given and more values are left, the results also
+        hold a "continuation" token. Query again with the same arguments and
+        that token to get the next page. Only historians that set
+        supports_paging accept page_size, the others raise a ValueError.
+
         """
 
         if topic is None:
             raise TypeError('"Topic" required')
 
+        if page_size is not None and not self.supports_paging:
+            raise ValueError("paging not supported by {}".format(
+                self.__class__.__name__))
+
+        if continuation is not None and page_size is None:
+            raise TypeError("You should provide page_size to continue a "
+                            "paged query")
+        if page_size is not None and page_size < 1:
+            raise ValueError("page_size must be at least 1")
+
         if agg_type:
             if not agg_period:
                 raise TypeError("You should provide both aggregation type"
@@ -1849,8 +2494,13 @@ class BaseQueryHistorianAgent(Agent):
         if start:
             _log.debug("start={}".format(start))
 
-        results = self.query_historian(topic, start, end, agg_type,
-                                       agg_period, skip, count, order)
+        if page_size is None:
+            results = self.query_historian(topic, start, end, agg_type,
+                                           agg_period, skip, count, order)
+        else:
+            results = self.query_historian_page(topic, start, end, agg_type,
+                                                agg_period, skip, count, order,
+                                                page_size, continuation)
         metadata = results.get("metadata", None)
         values = results.get("values", None)
         if values and metadata is None:
@@ -1926,6 +2576,24 @@ class BaseQueryHistorianAgent(Agent):
 
         """
 
+    def query_historian_page(self, topic, start=None, end=None, agg_type=None,
+                             agg_period=None, skip=0, count=None, order=None,
+                             page_size=None, continuation=None):
+        """
+        This function is called by :py:meth:`BaseQueryHistorianAgent.query`
+        for paged queries, only if supports_paging is True. Historians that
+        set it override this to return at most page_size values in the same
+        format as :py:meth:`BaseQueryHistorianAgent.query_historian`, with a
+        "continuation" entry holding the token for the next page if there is
+        one.
+
+        :param page_size: Maximum number of values to return.
+        :param continuation: Token returned with the previous page, or None
+                             for the first page.
+        :return: Results of the query
+        :rtype: dict
+        """
+
 
 class BaseHistorian(BaseHistorianAgent, BaseQueryHistorianAgent):
     def __init__(self, **kwargs):
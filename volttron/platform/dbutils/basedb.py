@@ -83,6 +83,9 @@ class DbDriver(object):
     - :py:class:`volttron.platform.dbutils.sqlitefuncts.SqlLiteFuncts`
 
     """
+    # Drivers that implement query_page set this to True.
+    supports_paging = False
+
     def __init__(self, dbapimodule, **kwargs):
         thread_name = threading.currentThread().getName()
         if callable(dbapimodule):
@@ -521,6 +524,21 @@ class DbDriver(object):
         """
         pass
 
+    def query_page(self, topic_ids, id_name_map, start=None, end=None,
+                   agg_type=None, agg_period=None, skip=0, count=None,
+                   order="FIRST_TO_LAST", page_size=None, continuation=None):
+        """
+        Same as :py:meth:`query`, but returns at most page_size values across
+        all topics along with a continuation token for the next page, which
+        is None on the last page. Only called on drivers that set
+        supports_paging, which override this.
+
+        :param page_size: maximum number of values to return
+        :param continuation: token returned with the previous page
+        :return: tuple of the query result and the continuation token
+        """
+        pass
+
     @abstractmethod
     def create_aggregate_store(self, agg_type, period):
         """
@@ -587,3 +605,18 @@ class DbDriver(object):
                  this aggregation was computed)
         """
         pass
+
+    def collect_aggregates(self, topic_ids, start=None, end=None):
+        """
+        Collect the sum, count, minimum and maximum of the values of each of
+        topic_ids with one query grouped by topic id. Drivers that do not
+        support this return None.
+
+        :param topic_ids: list of topic ids for which aggregates should be
+                          collected.
+        :param start: start time for query (inclusive)
+        :param end:  end time for query (exclusive)
+        :return: dictionary of topic id to a tuple of (sum, count, min, max)
+                 for the topics that have records in the time slice
+        """
+        return None
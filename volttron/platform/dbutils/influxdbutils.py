@@ -67,6 +67,7 @@ from requests.exceptions import ConnectionError
 from dateutil import parser
 from influxdb import InfluxDBClient
 from influxdb.exceptions import InfluxDBClientError
+from influxdb.line_protocol import make_lines
 
 from volttron.platform.agent.utils import format_timestamp
 
@@ -80,6 +81,7 @@ SUPPORTED_AGG_TYPE = ["COUNT", "DISTINCT", "INTEGRAL", "MEAN", "MEDIAN", "MODE",
 
 TOPIC_REGEX = r"^[-\w\/]+$"  # Alphanumeric + '_' + '-' + '/'
 AGG_PERIOD_REGEX = r"^\d+[mhdw]$"   # Number + 'm'/'h'/'d'/'w'
+DEFAULT_BATCH_SIZE = 5000  # Data points sent in one write
 
 
 def value_type_matching(value_type, value):
@@ -105,9 +107,13 @@ def get_client(connection_params):
     port = connection_params['port']
     user = connection_params.get('user', None)
     passwd = connection_params.get('passwd', None)
+    kwargs = {}
+    # Older clients do not know the gzip argument, only pass it when asked for.
+    if connection_params.get('gzip', False):
+        kwargs['gzip'] = True
 
     try:
-        client = InfluxDBClient(host, port, user, passwd, db)
+        client = InfluxDBClient(host, port, user, passwd, db, **kwargs)
         dbs = client.get_list_database()
         if {"name": db} not in dbs:
             _log.error("Database {} does not exist.".format(db))
@@ -301,9 +307,9 @@ def insert_meta(client, topic_id, topic, meta, updated_time):
     client.write_points(json_body)
 
 
-def insert_data_point(client, time, topic_id, source, value, value_string):
+def make_data_point(time, topic_id, source, value, value_string):
     """
-    Insert one data point of a specific topic into the database.
+    Build the data point of a specific topic as it is written to the database.
     Measurement name is parsed from topic_id.
 
 
@@ -319,41 +325,138 @@ def insert_data_point(client, time, topic_id, source, value, value_string):
 
     tags_dict["source"] = source
 
-    json_body = [
-        {
-            "measurement": measurement,
-            "tags": tags_dict,
-            "time": time,
-            "fields": {
-                "value": value,
-                "value_string": value_string
-            }
+    return {
+        "measurement": measurement,
+        "tags": tags_dict,
+        "time": time,
+        "fields": {
+            "value": value,
+            "value_string": value_string
         }
-    ]
+    }
+
+
+def insert_data_point(client, time, topic_id, source, value, value_string):
+    """
+    Insert one data point of a specific topic into the database.
+    Measurement name is parsed from topic_id.
+
+
+    See Schema description for InfluxDB Historian in README
+    """
+    json_body = [make_data_point(time, topic_id, source, value, value_string)]
 
     try:
         client.write_points(json_body)
     except InfluxDBClientError as e:
-        matching = re.findall('type \w+', json.loads(e.content)["error"])
-        inserted_type = matching[1]
-        existed_type = matching[2]
-        _log.warning('{} value exists as {}, while inserted value={} has {}'.format(measurement,
-                                                                                    existed_type,
-                                                                                    value,
-                                                                                    inserted_type))
-        existed_type = existed_type[5:]
-        try:
-            value = value_type_matching(existed_type, value)
-        except ValueError:
-            _log.warning('Cannot cast value={} {} to type {}. \'value\' field will be empty'.format(value,
-                                                                                                    inserted_type,
-                                                                                                    existed_type))
-            value = None
-
-        json_body[0]["fields"]["value"] = value
+        json_body[0] = cast_to_existing_type(json_body[0], e)
         client.write_points(json_body)
 
 
+def is_field_type_conflict(error):
+    """
+    Return True if a write was rejected because a value does not match the
+    type its field already has. Writing the same point again fails the same
+    way, unlike failed authorizations, missing databases or server errors.
+
+    :param error: InfluxDBClientError raised when writing points
+    """
+    return error.code == 400 and 'field type conflict' in (error.content or '')
+
+
+def cast_to_existing_type(point, error):
+    """
+    Return a copy of a data point whose value is cast to the type the database
+    already holds for its field, as reported in a field type conflict error.
+    The value is left empty if it cannot be cast.
+
+    :param point: data point the database rejected
+    :param error: InfluxDBClientError raised when writing the point
+    """
+    matching = re.findall('type \w+', json.loads(error.content)["error"])
+    inserted_type = matching[1]
+    existed_type = matching[2]
+    value = point["fields"]["value"]
+    _log.warning('{} value exists as {}, while inserted value={} has {}'.format(point["measurement"],
+                                                                                existed_type,
+                                                                                value,
+                                                                                inserted_type))
+    existed_type = existed_type[5:]
+    try:
+        value = value_type_matching(existed_type, value)
+    except ValueError:
+        _log.warning('Cannot cast value={} {} to type {}. \'value\' field will be empty'.format(value,
+                                                                                                inserted_type,
+                                                                                                existed_type))
+        value = None
+
+    point = dict(point, fields=dict(point["fields"], value=value))
+    return point
+
+
+def insert_data_points(client, points, batch_size=DEFAULT_BATCH_SIZE, time_precision=None):
+    """
+    Insert data points into the database, batch_size points per write, each
+    batch sent as a single line protocol payload.
+
+    A batch rejected with a field type conflict, because one of its values
+    does not match the type its field already has, is split in half and each
+    half is written on its own, down to single points. A single conflicting
+    point is retried once with its value cast to the existing type, as
+    insert_data_point does, and is dropped if it is rejected again. Every other
+    error, such as a failed authorization or a missing database, and connection
+    errors are raised to the caller.
+
+    :param client: InfluxDB client connected in historian_setup method.
+    :param points: list of data points, as built by make_data_point
+    :param batch_size: maximum number of points sent in one write
+    :param time_precision: precision of the timestamps written, one of
+                           's', 'ms', 'u' or 'n'. Defaults to nanoseconds.
+    :return: a generator yielding, once per batch, a tuple of the indexes
+             into points of the points that were stored and of the points
+             that were dropped
+    """
+    for start in range(0, len(points), batch_size):
+        indexes = range(start, min(start + batch_size, len(points)))
+        yield _write_batch(client, points, indexes, time_precision)
+
+
+def _write_batch(client, points, indexes, time_precision):
+    """
+    Write the points at indexes, splitting the batch when the database rejects
+    it with a field type conflict. Returns the indexes of the points that were
+    stored and the indexes of the points that were dropped.
+    """
+    # Newlines inside values are escaped, so each line is one point.
+    lines = make_lines({"points": [points[i] for i in indexes]}, time_precision).rstrip('\n').split('\n')
+    try:
+        client.write_points(lines, time_precision=time_precision, protocol='line')
+        return indexes, []
+    except InfluxDBClientError as e:
+        if not is_field_type_conflict(e):
+            raise
+        if len(indexes) > 1:
+            middle = len(indexes) // 2
+            stored, dropped = _write_batch(client, points, indexes[:middle], time_precision)
+            more_stored, more_dropped = _write_batch(client, points, indexes[middle:], time_precision)
+            return stored + more_stored, dropped + more_dropped
+        index = indexes[0]
+        try:
+            point = cast_to_existing_type(points[index], e)
+        except (ValueError, KeyError, IndexError):
+            _log.error("Dropping data point for {}, it was rejected: {}".format(points[index]["measurement"], e))
+            return [], indexes
+
+    try:
+        client.write_points([point], time_precision=time_precision)
+        return indexes, []
+    except InfluxDBClientError as e:
+        if not is_field_type_conflict(e):
+            raise
+        _log.error("Dropping data point for {}, it was rejected: {}".format(point["measurement"], e))
+        return [], indexes
+
+
 def get_topics_by_pattern(client, pattern):
     """
 
@@ -36,6 +36,7 @@
 # under Contract DE-AC05-76RL01830
 # }}}
 import ast
+import contextlib
 import logging
 from collections import defaultdict
 
@@ -50,6 +51,32 @@ from volttron.platform.agent import json as jsonapi
 utils.setup_logging()
 _log = logging.getLogger(__name__)
 
+# Used when the server's max_allowed_packet cannot be read.
+DEFAULT_MAX_PACKET = 1024 * 1024
+# Allowance for the timestamp, topic id and punctuation of each row of a
+# multi-row insert, on top of the length of its value.
+ROW_OVERHEAD = 64
+
+
+def batch_records(records, max_bytes):
+    """
+    Split (ts, topic_id, value) records into batches whose multi-row insert
+    statement stays within max_bytes. A record too big for any batch is
+    sent on its own.
+    """
+    batch = []
+    size = 0
+    for record in records:
+        record_size = len(record[2]) + ROW_OVERHEAD
+        if batch and size + record_size > max_bytes:
+            yield batch
+            batch = []
+            size = 0
+        batch.append(record)
+        size += record_size
+    if batch:
+        yield batch
+
 """
 Implementation of Mysql database operation for
 :py:class:`sqlhistorian.historian.SQLHistorian` and
@@ -61,6 +88,7 @@ class MySqlFuncts(DbDriver):
     def __init__(self, connect_params, table_names):
         # kwargs['dbapimodule'] = 'mysql.connector'
         self.MICROSECOND_SUPPORT = None
+        self.max_packet = None
 
         self.data_table = None
         self.topics_table = None
@@ -80,6 +108,53 @@ class MySqlFuncts(DbDriver):
         connect_params['autocommit'] = True
         super(MySqlFuncts, self).__init__('mysql.connector', **connect_params)
 
+    @contextlib.contextmanager
+    def bulk_insert(self):
+        """
+        This function implements the bulk insert requirements for MySQL historian by overriding the
+        DbDriver::bulk_insert() in basedb.py. Records are written with multi-row REPLACE statements, each kept to
+        half of the server's max_allowed_packet to leave room for escaping.
+
+        :yields: insert method
+        """
+        records = []
+
+        def insert_data(ts, topic_id, data):
+            """
+            Inserts data records to the list
+
+            :param ts: time stamp
+            :type string
+            :param topic_id: topic ID
+            :type string
+            :param data: data value
+            :type any valid JSON serializable value
+            :return: Returns True after insert
+            :rtype: bool
+            """
+            records.append((ts, topic_id, jsonapi.dumps(data)))
+            return True
+
+        yield insert_data
+
+        if records:
+            if self.max_packet is None:
+                self.init_max_packet()
+            for batch in batch_records(records, self.max_packet // 2):
+                stmt = 'REPLACE INTO ' + self.data_table + ' values ' + \
+                       ', '.join(['(%s, %s, %s)'] * len(batch))
+                self.execute_stmt(stmt, [value for record in batch
+                                         for value in record])
+
+    def init_max_packet(self):
+        try:
+            rows = self.select("SELECT @@max_allowed_packet", None)
+            self.max_packet = int(rows[0][0])
+        except (MysqlError, IndexError, TypeError, ValueError) as e:
+            _log.warning("Unable to read max_allowed_packet, using {} "
+                         "bytes: {}".format(DEFAULT_MAX_PACKET, e))
+            self.max_packet = DEFAULT_MAX_PACKET
+
     def init_microsecond_support(self):
         rows = self.select("SELECT version()", None)
         p = re.compile('(\d+)\D+(\d+)\D+(\d+)\D*')
@@ -456,3 +531,37 @@ class MySqlFuncts(DbDriver):
             return rows[0][0], rows[0][1]
         else:
             return 0, 0
+
+    def collect_aggregates(self, topic_ids, start=None, end=None):
+        query = '''SELECT topic_id, SUM(value_string), COUNT(value_string),
+                          MIN(value_string), MAX(value_string)
+                   FROM ''' + self.data_table + '''
+                   {where}
+                   GROUP BY topic_id'''
+        # Topic ids are inlined so large groups need no placeholder each.
+        where_clauses = ["WHERE topic_id IN ({})".format(
+            ', '.join(str(int(topic_id)) for topic_id in topic_ids))]
+        args = []
+
+        if start is not None:
+            where_clauses.append("ts >= %s")
+            if self.MICROSECOND_SUPPORT:
+                args.append(start)
+            else:
+                start_str = start.isoformat()
+                args.append(start_str[:start_str.rfind('.')])
+
+        if end is not None:
+            where_clauses.append("ts < %s")
+            if self.MICROSECOND_SUPPORT:
+                args.append(end)
+            else:
+                end_str = end.isoformat()
+                args.append(end_str[:end_str.rfind('.')])
+
+        real_query = query.format(where=' AND '.join(where_clauses))
+        _log.debug("Real Query: " + real_query)
+        _log.debug("args: " + str(args))
+
+        rows = self.select(real_query, args)
+        return dict((row[0], tuple(row[1:])) for row in rows or [])
@@ -357,3 +357,20 @@ class RedshiftFuncts(DbDriver):
             query.append(SQL(' AND ts < {}').format(Literal(end)))
         rows = self.select(SQL('\n').join(query))
         return rows[0] if rows else (0, 0)
+
+    def collect_aggregates(self, topic_ids, start=None, end=None):
+        query = [
+            SQL('SELECT topic_id, SUM(CAST(value_string as float)), '
+                'COUNT(value_string), MIN(CAST(value_string as float)), '
+                'MAX(CAST(value_string as float))'),
+            SQL('FROM {}').format(Identifier(self.data_table)),
+            SQL('WHERE topic_id in ({})').format(
+                SQL(', ').join(Literal(tid) for tid in topic_ids)),
+        ]
+        if start is not None:
+            query.append(SQL(' AND ts >= {}').format(Literal(start)))
+        if end is not None:
+            query.append(SQL(' AND ts < {}').format(Literal(end)))
+        query.append(SQL('GROUP BY topic_id'))
+        rows = self.select(SQL('\n').join(query))
+        return dict((row[0], tuple(row[1:])) for row in rows or [])
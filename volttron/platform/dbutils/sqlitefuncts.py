@@ -36,6 +36,8 @@
 # under Contract DE-AC05-76RL01830
 # }}}
 import ast
+import base64
+import contextlib
 import errno
 import logging
 import sqlite3
@@ -65,7 +67,47 @@ Implementation of SQLite3 database operation for
 For method details please refer to base class
 :py:class:`volttron.platform.dbutils.basedb.DbDriver`
 """
+# SQLite allows at most 500 SELECTs in a compound statement.
+MAX_COMPOUND_SELECT = 500
+
+
+def format_stored_timestamp(ts):
+    """
+    Format a timestamp read from the data table as
+    :py:func:`volttron.platform.agent.utils.format_timestamp` would. Values
+    are stored in that format, so only rows written some other way need
+    parsing.
+    """
+    if len(ts) in (26, 32) and ts[10] == 'T' and ts[19] == '.':
+        return ts
+    return utils.format_timestamp(utils.parse_timestamp_string(ts))
+
+
+def encode_continuation(topic_id, ts, returned):
+    """
+    Build the continuation token of a paged query that stopped after the
+    value of topic_id at ts, with returned values of that topic returned so
+    far.
+    """
+    return base64.urlsafe_b64encode(jsonapi.dumps([topic_id, ts, returned]))
+
+
+def decode_continuation(continuation):
+    """
+    Return the topic id, timestamp and count of returned values stored in a
+    continuation token.
+    """
+    try:
+        topic_id, ts, returned = jsonapi.loads(
+            base64.urlsafe_b64decode(str(continuation)))
+        return int(topic_id), str(ts), int(returned)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid continuation token {}".format(continuation))
+
+
 class SqlLiteFuncts(DbDriver):
+    supports_paging = True
+
     def __init__(self, connect_params, table_names):
         database = connect_params['database']
         thread_name = threading.currentThread().getName()
@@ -215,19 +257,36 @@ class SqlLiteFuncts(DbDriver):
         @param count:
         @param order:
         """
+        values, _ = self.query_page(topic_ids, id_name_map, start, end,
+                                    agg_type, agg_period, skip, count, order)
+        return values
+
+    def query_page(self, topic_ids, id_name_map, start=None, end=None,
+                   agg_type=None, agg_period=None, skip=0, count=None,
+                   order="FIRST_TO_LAST", page_size=None, continuation=None):
+        """
+        Same as :py:meth:`query`, but returns at most page_size values across
+        all topics along with a continuation token. Pass the token back with
+        otherwise identical arguments to get the next page. The token is None
+        once the last page has been returned. Without a page_size all values
+        are returned in one page.
+
+        All topics are read with one statement, ordered by topic id and then
+        time so values can be streamed into the result, and the stored
+        timestamp strings are only reparsed when they are not already in the
+        format returned to callers.
+
+        @param page_size: maximum number of values to return
+        @param continuation: token returned with the previous page
+        @return: tuple of the values, in the same form :py:meth:`query`
+                 returns, and the continuation token
+        """
         table_name = self.data_table
         if agg_type and agg_period:
             table_name = agg_type + "_" + agg_period
 
-        query = '''SELECT topic_id, ts, value_string
-                   FROM ''' + table_name + '''
-                   {where}
-                   {order_by}
-                   {limit}
-                   {offset}'''
-
-        where_clauses = ["WHERE topic_id = ?"]
-        args = [topic_ids[0]]
+        where_clauses = []
+        args = {}
 
         # base historian converts naive timestamps to UTC, but if the
         # start and end had explicit timezone info then they need to get
@@ -238,60 +297,120 @@ class SqlLiteFuncts(DbDriver):
             end = end.astimezone(pytz.UTC)
 
         if start and end and start == end:
-            where_clauses.append("ts = ?")
-            args.append(start)
+            where_clauses.append("ts = :start")
+            args['start'] = start
         else:
             if start:
-                where_clauses.append("ts >= ?")
-                args.append(start)
+                where_clauses.append("ts >= :start")
+                args['start'] = start
             if end:
-                where_clauses.append("ts < ?")
-                args.append(end)
-
-
-        where_statement = ' AND '.join(where_clauses)
-
-        order_by = 'ORDER BY topic_id ASC, ts ASC'
-        if order == 'LAST_TO_FIRST':
-            order_by = ' ORDER BY topic_id DESC, ts DESC'
-
-        # can't have an offset without a limit
-        # -1 = no limit and allows the user to
-        # provide just an offset
-        if count is None:
-            count = -1
-
-        limit_statement = 'LIMIT ?'
-        args.append(count)
-
-        offset_statement = ''
-        if skip > 0:
-            offset_statement = 'OFFSET ?'
-            args.append(skip)
-
-        real_query = query.format(where=where_statement,
-                                  limit=limit_statement,
-                                  offset=offset_statement,
-                                  order_by=order_by)
-        _log.debug("Real Query: " + real_query)
-        _log.debug("args: " + str(args))
-
+                where_clauses.append("ts < :end")
+                args['end'] = end
 
+        descending = order == 'LAST_TO_FIRST'
+        topic_ids = sorted(topic_ids, reverse=descending)
         values = defaultdict(list)
+        if page_size is None:
+            for topic_id in topic_ids:
+                values[id_name_map[topic_id]] = []
+
+        # Each segment is a group of topics read with one statement. A query
+        # picking up from a continuation token first finishes the topic the
+        # last page stopped in.
+        segments = []
+        last_id = None
+        seen = 0
+        if continuation:
+            last_id, args['last_ts'], seen = decode_continuation(continuation)
+            if descending:
+                later_ids = [t for t in topic_ids if t < last_id]
+            else:
+                later_ids = [t for t in topic_ids if t > last_id]
+            if last_id in topic_ids and (count is None or count > seen):
+                after = '<' if descending else '>'
+                segments.append(([last_id],
+                                 where_clauses + ['ts {} :last_ts'.format(after)],
+                                 None if count is None else count - seen, 0))
+            topic_ids = later_ids
+
+        if count is None and not skip:
+            if topic_ids:
+                segments.append((topic_ids, where_clauses, None, 0))
+        else:
+            for i in range(0, len(topic_ids), MAX_COMPOUND_SELECT):
+                segments.append((topic_ids[i:i + MAX_COMPOUND_SELECT],
+                                 where_clauses, count, skip))
+
+        # One row past the page tells whether there is another page.
+        remaining = page_size + 1 if page_size is not None else None
+        last_row = None
+        next_continuation = None
         start_t = datetime.utcnow()
-        for topic_id in topic_ids:
-            args[0] = topic_id
-            values[id_name_map[topic_id]] = []
+        for segment_ids, clauses, limit, offset in segments:
+            real_query = self._query_statement(table_name, segment_ids, clauses,
+                                               limit, offset, descending,
+                                               remaining)
+            _log.debug("Real Query: " + real_query)
+            _log.debug("args: " + str(args))
             cursor = self.select(real_query, args, fetch_all=False)
-            if cursor:
-                for _id, ts, value in cursor:
-                    values[id_name_map[topic_id]].append(
-                        (utils.format_timestamp(ts), jsonapi.loads(value)))
-                cursor.close()
+            if not cursor:
+                continue
+            for topic_id, ts, value in cursor:
+                if remaining is not None:
+                    remaining -= 1
+                    if not remaining:
+                        last_topic, last_ts = last_row
+                        returned = len(values[id_name_map[last_topic]])
+                        if last_topic == last_id:
+                            returned += seen
+                        next_continuation = encode_continuation(
+                            last_topic, last_ts, returned)
+                        break
+                values[id_name_map[topic_id]].append(
+                    (format_stored_timestamp(ts), jsonapi.loads(value)))
+                last_row = topic_id, ts
+            cursor.close()
+            if next_continuation:
+                break
 
         _log.debug("Time taken to load results from db:{}".format(
             datetime.utcnow()-start_t))
-        return values
+        return values, next_continuation
+
+    def _query_statement(self, table_name, topic_ids, where_clauses, count,
+                         skip, descending, limit):
+        """
+        Build the statement reading the values of topic_ids ordered by topic
+        id and time. Without a per topic count or skip this is a plain
+        topic_id IN (...) query, otherwise each topic gets its own
+        sub-select joined with UNION ALL.
+        """
+        direction = 'DESC' if descending else 'ASC'
+        select = ('SELECT topic_id, CAST(ts AS TEXT) AS ts, value_string '
+                  'FROM ' + table_name + ' WHERE ')
+        if count is None and not skip:
+            query = select + ' AND '.join(
+                ['topic_id IN ({})'.format(
+                    ','.join(str(int(topic_id)) for topic_id in topic_ids))] +
+                where_clauses)
+        else:
+            # can't have an offset without a limit
+            # -1 = no limit and allows the user to
+            # provide just an offset
+            terms = []
+            for topic_id in topic_ids:
+                terms.append(
+                    'SELECT * FROM (' + select +
+                    ' AND '.join(['topic_id = {}'.format(int(topic_id))] +
+                                 where_clauses) +
+                    ' ORDER BY ts {} LIMIT {} OFFSET {})'.format(
+                        direction, -1 if count is None else int(count),
+                        int(skip)))
+            query = ' UNION ALL '.join(terms)
+        query += ' ORDER BY topic_id {0}, ts {0}'.format(direction)
+        if limit is not None:
+            query += ' LIMIT {}'.format(int(limit))
+        return query
 
     def manage_db_size(self, history_limit_timestamp, storage_limit_gb):
         """
@@ -340,6 +459,38 @@ class SqlLiteFuncts(DbDriver):
             _log.debug("Committing changes for manage_db_size.")
             self.commit()
 
+    @contextlib.contextmanager
+    def bulk_insert(self):
+        """
+        This function implements the bulk insert requirements for SQLite historian by overriding the
+        DbDriver::bulk_insert() in basedb.py. Records are written with a single executemany call, which reuses one
+        prepared statement and is not subject to SQLite's limit on bound parameters per statement.
+
+        :yields: insert method
+        """
+        records = []
+
+        def insert_data(ts, topic_id, data):
+            """
+            Inserts data records to the list
+
+            :param ts: time stamp
+            :type string
+            :param topic_id: topic ID
+            :type string
+            :param data: data value
+            :type any valid JSON serializable value
+            :return: Returns True after insert
+            :rtype: bool
+            """
+            records.append((ts, topic_id, jsonapi.dumps(data)))
+            return True
+
+        yield insert_data
+
+        if records:
+            self.execute_many(self.insert_data_query(), records)
+
     def insert_meta_query(self):
         return '''INSERT OR REPLACE INTO ''' + self.meta_table + \
                ''' values(?, ?)'''
@@ -569,6 +720,52 @@ class SqlLiteFuncts(DbDriver):
         else:
             return 0, 0
 
+    def collect_aggregates(self, topic_ids, start=None, end=None):
+        """
+        This function should return the sum, count, minimum and maximum of
+        the values of each topic
+        @param topic_ids: list of topic ids
+        @param start: start time
+        @param end: end time
+        @return: dictionary of topic id to (sum, count, min, max)
+        """
+        # Topic ids are inlined so large groups stay under the limit on
+        # the number of query parameters.
+        where_clauses = ["WHERE topic_id IN ({})".format(
+            ', '.join(str(int(topic_id)) for topic_id in topic_ids))]
+        args = []
+
+        # base historian converts naive timestamps to UTC, but if the
+        # start and end had explicit timezone info then they need to get
+        # converted to UTC since sqlite3 only store naive timestamp
+        if start:
+            start = start.astimezone(pytz.UTC)
+        if end:
+            end = end.astimezone(pytz.UTC)
+
+        if start and end and start == end:
+            where_clauses.append("ts = ?")
+            args.append(start)
+        else:
+            if start:
+                where_clauses.append("ts >= ?")
+                args.append(start)
+            if end:
+                where_clauses.append("ts < ?")
+                args.append(end)
+
+        query = '''SELECT topic_id, SUM(value_string), COUNT(value_string),
+                          MIN(value_string), MAX(value_string)
+                   FROM ''' + self.data_table + '''
+                   {where}
+                   GROUP BY topic_id'''
+        real_query = query.format(where=' AND '.join(where_clauses))
+        _log.debug("Real Query: " + real_query)
+        _log.debug("args: " + str(args))
+
+        results = self.select(real_query, args)
+        return dict((row[0], tuple(row[1:])) for row in results)
+
 
     @staticmethod
     def get_tagging_query_from_ast(topic_tags_table, tup, tag_refs):
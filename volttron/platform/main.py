@@ -425,6 +425,9 @@ class Router(BaseRouter):
     def _add_pubsub_peers(self, peer):
         self._pubsub.peer_add(peer)
 
+    def _set_pubsub_serializer(self, peer, name):
+        self._pubsub.set_peer_serializer(peer, name)
+
     def poll_sockets(self):
         """
         Poll for incoming messages through router socket or other external socket connections
@@ -65,6 +65,7 @@ from .dispatch import Signal
 from .errors import VIPError
 from .. import green as vip
 from .. import router
+from .. import serializers
 from .... import platform
 from volttron.platform.keystore import KeyStore, KnownHostsStore
 from volttron.platform.agent import utils
@@ -464,7 +465,7 @@ class Core(BasicCore):
                  publickey=None, secretkey=None, serverkey=None,
                  volttron_home=os.path.abspath(platform.get_home()),
                  agent_uuid=None, reconnect_interval=None,
-                 version='0.1', enable_fncs=False):
+                 version='0.1', enable_fncs=False, message_serializer=None):
 
         self.volttron_home = volttron_home
 
@@ -496,10 +497,28 @@ class Core(BasicCore):
         self.__connected = False
         self._version = version
         self._fncs_enabled=enable_fncs
+        self._message_serializer = self._check_message_serializer(message_serializer)
+        # Serializer for pubsub payloads, negotiated with the router in
+        # the hello exchange. JSON until the router agrees otherwise.
+        self.serializer = serializers.JSON
+        # Version reported by the router in the hello exchange.
+        self.router_version = None
 
     def version(self):
         return self._version
 
+    @staticmethod
+    def _check_message_serializer(name):
+        if name is None or name == serializers.JSON.name:
+            return None
+        if name != serializers.MSGPACK.name:
+            raise ValueError('unknown message serializer {!r}'.format(name))
+        if name not in serializers.available():
+            _log.warning('msgpack is not installed, using JSON for '
+                         'pubsub messages')
+            return None
+        return name
+
     def _set_keys(self):
         """Implements logic for setting encryption keys and putting
         those keys in the parameters of the VIP address
@@ -646,8 +665,13 @@ class Core(BasicCore):
             state.ident = ident = b'connect.hello.%d' % state.count
             state.count += 1
             self.spawn(connection_failed_check)
+            args = [b'hello']
+            if self._message_serializer is not None:
+                # Offer the preferred serializer with JSON as fallback.
+                args.append(b','.join([self._message_serializer,
+                                       serializers.JSON.name]))
             self.spawn(self.socket.send_vip,
-                       b'', b'hello', [b'hello'], msg_id=ident)
+                       b'', b'hello', args, msg_id=ident)
 
         def hello_response(sender, version='',
                            router='', identity=''):
@@ -752,6 +776,14 @@ class Core(BasicCore):
                             bytes(message.args[0]) == b'welcome'):
                     version, server, identity = [
                         bytes(x) for x in message.args[1:4]]
+                    self.router_version = version
+                    self.serializer = serializers.JSON
+                    if len(message.args) > 4:
+                        try:
+                            self.serializer = serializers.get(
+                                bytes(message.args[4]))
+                        except KeyError:
+                            pass
                     self.__connected = True
                     self.onconnected.send(self, version=version,
                                           router=server, identity=identity)
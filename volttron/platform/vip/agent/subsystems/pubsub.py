@@ -39,6 +39,7 @@
 from __future__ import absolute_import
 
 from base64 import b64encode, b64decode
+import bisect
 import inspect
 import logging
 import random
@@ -46,6 +47,7 @@ import re
 import weakref
 
 import gevent
+from gevent.event import AsyncResult
 from zmq import green as zmq
 from zmq import SNDMORE
 from volttron.platform.agent import json as jsonapi
@@ -56,6 +58,7 @@ from ..errors import Unreachable, VIPError, UnknownSubsystem
 from .... import jsonrpc
 from volttron.platform.agent import utils
 from ..results import ResultsDictionary
+from ... import serializers
 from gevent.queue import Queue, Empty
 from collections import defaultdict
 from datetime import timedelta
@@ -64,6 +67,8 @@ from datetime import timedelta
 __all__ = ['PubSub']
 min_compatible_version = '3.0'
 max_compatible_version = ''
+# First router version that accepts publish_batch
+publish_batch_router_version = (1, 1)
 
 #utils.setup_logging()
 _log = logging.getLogger(__name__)
@@ -93,7 +98,7 @@ class PubSub(SubsystemBase):
             return defaultdict(subscriptions)
 
         def subscriptions():
-            return defaultdict(set)
+            return SubscriptionIndex()
 
         self._my_subscriptions = defaultdict(platform_subscriptions)
         self.protected_topics = ProtectedPubSubTopics()
@@ -130,8 +135,8 @@ class PubSub(SubsystemBase):
         self.synchronize()
 
     def _process_callback(self, sender, bus, topic, headers, message):
-        """Handle incoming subscription pushes from PubSubService. It iterates over all subscriptions to find the
-        subscription matching the topic and bus. It then calls the corresponding callback on finding a match.
+        """Handle incoming subscription pushes from PubSubService. It looks up the subscriptions matching the topic
+        and bus in the subscription index. It then calls the corresponding callback on finding a match.
         param sender: identity of the publisher
         type sender: str
         param bus: bus
@@ -146,16 +151,14 @@ class PubSub(SubsystemBase):
         peer = 'pubsub'
 
         handled = 0
-        for platform in self._my_subscriptions:
+        for platform, buses in self._my_subscriptions.items():
             #_log.debug("SYNC: process callback subscriptions: {}".format(self._my_subscriptions[platform][bus]))
-            buses = self._my_subscriptions[platform]
-            if bus in buses:
-                subscriptions = buses[bus]
-                for prefix, callbacks in subscriptions.iteritems():
-                    if topic.startswith(prefix):
-                        handled += 1
-                        for callback in callbacks:
-                            callback(peer, sender, bus, topic, headers, message)
+            subscriptions = buses.get(bus)
+            if subscriptions:
+                for prefix, callbacks in subscriptions.match(topic):
+                    handled += 1
+                    for callback in list(callbacks):
+                        callback(peer, sender, bus, topic, headers, message)
         if not handled:
             # No callbacks for topic; synchronize with sender
             self.synchronize()
@@ -601,12 +604,82 @@ class PubSub(SubsystemBase):
                               headers=headers, message=message)
                 self._save_parameters(result.ident, **kwargs)
 
-            json_msg = jsonapi.dumps(dict(bus=bus, headers=headers, message=message))
-            frames = [zmq.Frame(b'publish'), zmq.Frame(str(topic)), zmq.Frame(str(json_msg))]
+            serializer = self.core().serializer
+            data = serializer.dumps(dict(bus=bus, headers=headers, message=message))
+            frames = [zmq.Frame(b'publish'), zmq.Frame(str(topic)), zmq.Frame(str(data))]
+            if serializer is not serializers.JSON:
+                frames.append(zmq.Frame(serializer.name))
             #<recipient, subsystem, args, msg_id, flags>
             self.vip_socket.send_vip(b'', 'pubsub', frames, result.ident, copy=False)
             return result
 
+    def publish_many(self, peer, items, bus=''):
+        """Publish several messages in one request.
+
+        The messages are sent to the PubSubService together and
+        acknowledged once, instead of one request and acknowledgement per
+        topic. Subscribers receive each message as an ordinary publish.
+        Against routers that do not support batches the messages are
+        published one at a time.
+        param peer: peer
+        type peer: str
+        param items: (topic, headers, message) for each message
+        type items: iterable
+        param bus: bus
+        type bus: str
+        return: Number of subscribers, summed over all the messages.
+        :rtype: int
+
+        :Return Values:
+        Number of subscribers
+        """
+        if peer is None:
+            peer = 'pubsub'
+        batch = []
+        for topic, headers, message in items:
+            if headers is None:
+                headers = {}
+            headers['min_compatible_version'] = min_compatible_version
+            headers['max_compatible_version'] = max_compatible_version
+            batch.append((topic, headers, message))
+
+        if (self._send_via_rpc or self._parameters_needed or
+                not self._router_accepts_batches()):
+            return self._publish_each(peer, batch, bus)
+
+        result = next(self._results)
+        serializer = self.core().serializer
+        data = serializer.dumps(dict(bus=bus, items=batch))
+        frames = [zmq.Frame(b'publish_batch'), zmq.Frame(str(data))]
+        if serializer is not serializers.JSON:
+            frames.append(zmq.Frame(serializer.name))
+        self.vip_socket.send_vip(b'', 'pubsub', frames, result.ident, copy=False)
+        return result
+
+    def _router_accepts_batches(self):
+        version = self.core().router_version
+        try:
+            version = tuple(int(part) for part in version.split('.'))
+        except (AttributeError, ValueError):
+            return False
+        return version >= publish_batch_router_version
+
+    def _publish_each(self, peer, items, bus):
+        """Publish the messages of a batch one at a time, returning one
+        result for all of them."""
+        results = [self.publish(peer, topic, headers, message, bus)
+                   for topic, headers, message in items]
+        batch = AsyncResult()
+
+        def wait():
+            try:
+                # Same form as the router's reply to a batch
+                batch.set(str(sum(int(result.get()) for result in results)))
+            except Exception as exc:
+                batch.set_exception(exc)
+        gevent.spawn(wait)
+        return batch
+
     def _check_if_protected_topic(self, topic):
         required_caps = self.protected_topics.get(topic)
         if required_caps:
@@ -657,7 +730,10 @@ class PubSub(SubsystemBase):
             except IndexError:
                 return
             try:
-                msg = jsonapi.loads(data)
+                serializer = serializers.JSON
+                if len(message.args) > 3:
+                    serializer = serializers.get(message.args[3].bytes)
+                msg = serializer.loads(data)
                 headers = msg['headers']
                 message = msg['message']
                 sender = msg['sender']
@@ -933,3 +1009,103 @@ class ProtectedPubSubTopics(object):
                 return capabilities
         return None
 
+
+
+class SubscriptionIndex(dict):
+    """Mapping of subscription prefix to a set of subscribers.
+
+    Missing prefixes are created on access, like ``defaultdict(set)``.
+    Prefixes are also tracked by length so :py:meth:`match` only needs
+    one dictionary lookup per distinct prefix length rather than a
+    ``startswith`` test against every subscription. Matches for recently
+    seen topics are cached until a prefix is added or removed.
+    """
+    def __init__(self, cache_size=4096):
+        super(SubscriptionIndex, self).__init__()
+        self._length_counts = {}
+        self._lengths = []
+        self._cache = {}
+        self._cache_size = cache_size
+
+    def __missing__(self, prefix):
+        subscribers = self[prefix] = set()
+        return subscribers
+
+    def __setitem__(self, prefix, subscribers):
+        if prefix not in self:
+            self._add_length(len(prefix))
+        super(SubscriptionIndex, self).__setitem__(prefix, subscribers)
+
+    def __delitem__(self, prefix):
+        super(SubscriptionIndex, self).__delitem__(prefix)
+        self._remove_length(len(prefix))
+
+    def pop(self, prefix, *default):
+        if prefix in self:
+            self._remove_length(len(prefix))
+        return super(SubscriptionIndex, self).pop(prefix, *default)
+
+    def setdefault(self, prefix, subscribers=None):
+        if prefix not in self:
+            self[prefix] = subscribers
+        return self[prefix]
+
+    def clear(self):
+        super(SubscriptionIndex, self).clear()
+        self._length_counts.clear()
+        del self._lengths[:]
+        self._cache.clear()
+
+    def popitem(self):
+        prefix, subscribers = super(SubscriptionIndex, self).popitem()
+        self._remove_length(len(prefix))
+        return prefix, subscribers
+
+    def update(self, *args, **kwargs):
+        for prefix, subscribers in dict(*args, **kwargs).iteritems():
+            self[prefix] = subscribers
+
+    def match(self, topic):
+        """Return a list of (prefix, subscribers) for every prefix of topic.
+        """
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        get = self.get
+        size = len(topic)
+        matches = []
+        for length in self._lengths:
+            if length > size:
+                break
+            prefix = topic[:length]
+            subscribers = get(prefix)
+            if subscribers is not None:
+                matches.append((prefix, subscribers))
+        if len(self._cache) >= self._cache_size:
+            self._cache.clear()
+        self._cache[topic] = matches
+        return matches
+
+    def subscribers(self, topic):
+        """Return the union of subscribers of every prefix of topic."""
+        result = set()
+        for _, subscribers in self.match(topic):
+            result |= subscribers
+        return result
+
+    def _add_length(self, length):
+        self._cache.clear()
+        count = self._length_counts.get(length, 0)
+        if not count:
+            bisect.insort(self._lengths, length)
+        self._length_counts[length] = count + 1
+
+    def _remove_length(self, length):
+        self._cache.clear()
+        count = self._length_counts[length] - 1
+        if count:
+            self._length_counts[length] = count
+        else:
+            del self._length_counts[length]
+            self._lengths.remove(length)
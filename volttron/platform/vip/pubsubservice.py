@@ -50,10 +50,11 @@ from collections import defaultdict
 
 # Create a context common to the green and non-green zmq modules.
 green.Context._instance = green.Context.shadow(zmq.Context.instance().underlying)
-from .agent.subsystems.pubsub import ProtectedPubSubTopics
+from .agent.subsystems.pubsub import ProtectedPubSubTopics, SubscriptionIndex
 from volttron.platform.jsonrpc import (INVALID_REQUEST, UNAUTHORIZED)
 from volttron.platform.vip.agent.errors import VIPError
 from volttron.platform.agent import json as jsonapi
+from . import serializers
 
 # Optimizing by pre-creating frames
 _ROUTE_ERRORS = {
@@ -61,6 +62,8 @@ _ROUTE_ERRORS = {
              zmq.Frame(os.strerror(errnum).encode('ascii')))
     for errnum in [zmq.EHOSTUNREACH, zmq.EAGAIN]
 }
+# Operation frame of each message fanned out from a publish batch
+_PUBLISH_FRAME = zmq.Frame(b'publish')
 
 
 class PubSubService(object):
@@ -73,7 +76,7 @@ class PubSubService(object):
             return defaultdict(subscriptions)
 
         def subscriptions():
-            return defaultdict(set)
+            return SubscriptionIndex()
 
         self._peer_subscriptions = defaultdict(platform_subscriptions)
         self._vip_sock = socket
@@ -81,6 +84,9 @@ class PubSubService(object):
         self._protected_topics = ProtectedPubSubTopics()
         self._load_protected_topics(protected_topics)
         self._ext_subscriptions = defaultdict(set)
+        # Payload serializers negotiated with peers in the hello exchange.
+        # Peers not listed here use JSON.
+        self._peer_serializers = {}
         self._ext_router = routing_service
         if self._ext_router is not None:
             self._ext_router.register('on_connect', self.external_platform_add)
@@ -106,8 +112,22 @@ class PubSubService(object):
         :param **kwargs optional arguments
         :type pointer to arguments
         """
+        self._peer_serializers.pop(peer, None)
         self._sync(peer, {})
 
+    def set_peer_serializer(self, peer, name):
+        """
+        Record the payload serializer negotiated with a peer in the hello exchange.
+        :param peer identity of the peer
+        :type peer str
+        :param name serializer name
+        :type name str
+        """
+        if name == serializers.JSON.name:
+            self._peer_serializers.pop(peer, None)
+        else:
+            self._peer_serializers[peer] = name
+
     def peer_add(self, peer):
         #To do
         temp = {}
@@ -290,22 +310,91 @@ class PubSubService(object):
         if len(frames) > 8:
             data = frames[8].bytes
             try:
-                msg = jsonapi.loads(data)
+                serializer = self._frames_serializer(frames)
+                msg = serializer.loads(data)
                 headers = msg['headers']
                 message = msg['message']
                 peer = frames[0].bytes
                 bus = msg['bus']
-                pub_msg = jsonapi.dumps(
-                    dict(sender=peer, bus=bus, headers=headers, message=message)
-                )
-                frames[8] = zmq.Frame(str(pub_msg))
+                pub_msg = dict(sender=peer, bus=bus, headers=headers, message=message)
+                frames[8] = zmq.Frame(str(serializer.dumps(pub_msg)))
             except KeyError as exc:
                 self._logger.error("Missing key in _peer_publish message {}".format(exc))
                 return 0
             except ValueError:
-                self._logger.error("JSON decode error. Invalid character")
+                self._logger.error("Decode error. Invalid message data")
                 return 0
-            return self._distribute(frames, user_id)
+            return self._distribute(frames, user_id, bus, pub_msg)
+
+    def _peer_publish_batch(self, frames, user_id):
+        """Publish a batch of messages sent in one request. Each message is delivered to its subscribers as an
+        ordinary publish, so subscribers need no support for batches.
+        :param frames list of frames
+        :type frames list
+        :param user_id user id of the publishing agent. This is required for protected topics check.
+        :type user_id  UTF-8 encoded User-Id property
+        :returns: Count of subscribers summed over all messages in the batch.
+        :rtype: int
+
+        :Return Values:
+        Number of subscribers to whom the messages were sent
+        """
+        if len(frames) < 8:
+            return 0
+        try:
+            serializer = serializers.JSON
+            if len(frames) > 8:
+                serializer = serializers.get(bytes(frames[8]))
+            msg = serializer.loads(frames[7].bytes)
+            bus = msg['bus']
+            items = msg['items']
+        except KeyError as exc:
+            self._logger.error("Missing key in _peer_publish_batch message {}".format(exc))
+            return 0
+        except ValueError:
+            self._logger.error("Decode error. Invalid message data")
+            return 0
+
+        peer = frames[0].bytes
+        envelope = frames[:6]
+        count = 0
+        for topic, headers, message in items:
+            pub_msg = dict(sender=peer, bus=bus, headers=headers, message=message)
+            item_frames = envelope + [_PUBLISH_FRAME, zmq.Frame(str(topic)),
+                                      zmq.Frame(str(serializer.dumps(pub_msg)))]
+            if serializer is not serializers.JSON:
+                item_frames.append(serializer.name)
+            count += self._distribute(item_frames, user_id, bus, pub_msg)
+        return count
+
+    def _frames_serializer(self, frames):
+        """
+        Serializer of the message data in publish frames. Data encoded with anything other than JSON is followed by
+        a frame naming its serializer.
+        :param frames list of frames
+        :type frames list
+        :returns: serializer
+        :raises KeyError: if the serializer is not available
+        """
+        if len(frames) > 9:
+            return serializers.get(bytes(frames[9]))
+        return serializers.JSON
+
+    def _serialized_frames(self, frames, serializer, message):
+        """
+        Copy of publish frames with the message data encoded by another serializer.
+        :param frames list of frames
+        :type frames list
+        :param serializer serializer to encode with
+        :param message decoded message data
+        :type message dict
+        :returns: list of frames
+        """
+        serialized = frames[:8]
+        serialized.append(zmq.Frame(str(serializer.dumps(message))))
+        if serializer is not serializers.JSON:
+            serialized.append(serializer.name)
+        return serialized
 
     def _peer_list(self, frames):
         """Returns a list of subscriptions for a specific bus. If bus is None, then it returns list of subscriptions
@@ -354,7 +443,7 @@ class PubSubService(object):
                             results.append((bus, topic, member))
         return results
 
-    def _distribute(self, frames, user_id):
+    def _distribute(self, frames, user_id, bus=None, message=None):
         """
         Distributes the message to all the subscribers subscribed to the same bus and topic. Check if the topic
         is protected before distributing the message. For protected topics, only authorized publishers can publish
@@ -369,8 +458,10 @@ class PubSubService(object):
         :type headers dict
         :param message actual message
         :type message None or any
-        :param bus message bus
+        :param bus message bus, decoded from the message data if not given
         :type bus str
+        :param message decoded message data, if already known
+        :type message dict
         :returns: Count of subscribers.
         :rtype: int
 
@@ -393,62 +484,67 @@ class PubSubService(object):
             return 0
 
         # First: Try to send to internal platform subscribers
-        internal_count = self._distribute_internal(frames)
+        internal_count = self._distribute_internal(frames, bus, message)
         # Second: Try to send to external platform subscribers
         #external_count=0
         external_count = self._distribute_external(frames)
         return internal_count+external_count
 
-    def _distribute_internal(self, frames):
+    def _distribute_internal(self, frames, bus=None, message=None):
         """
-        Distribute the publish message to local subscribers
+        Distribute the publish message to local subscribers. The same frames are sent to every subscriber with only
+        the recipient changed, so the message data is neither decoded nor copied per subscriber. Subscribers that
+        negotiated a different serializer share one re-encoded copy per serializer.
         :param frames: list of frames
+        :param bus: message bus. The message data is only decoded to find it if it is not given.
+        :param message: decoded message data, if already known
         :return: Number of local subscribers
         """
-        publisher = frames[0].bytes
-        topic = frames[7].bytes
-        data = frames[8].bytes
+        publisher = frames[0]
+        topic = bytes(frames[7])
         try:
-            msg = jsonapi.loads(data)
-            bus = msg['bus']
+            serializer = self._frames_serializer(frames)
+            if bus is None:
+                message = serializer.loads(bytes(frames[8]))
+                bus = message['bus']
         except KeyError as exc:
             self._logger.error("Missing key in _peer_publish message {}".format(exc))
             return 0
         except ValueError:
-            self._logger.error("JSON decode error. Invalid character")
+            self._logger.error("Decode error. Invalid message data")
             return 0
 
-        all_subscriptions = dict()
-        subscriptions = dict()
-        subs = dict()
-        # Get subscriptions for all platforms
-        try:
-            all_subscriptions = self._peer_subscriptions['all'][bus]
-        except KeyError:
-            pass
-        try:
-            subscriptions = self._peer_subscriptions['internal'][bus]
-        except KeyError:
-            pass
-
-        subs.update(all_subscriptions)
-        subs.update(subscriptions)
         subscribers = set()
-        # Check for local subscribers
-        for prefix, subscription in subs.iteritems():
-            if subscription and topic.startswith(prefix):
-                subscribers |= subscription
+        # Check for local subscribers, both those subscribed to all
+        # platforms and those subscribed to this platform only
+        for platform in ('all', 'internal'):
+            bus_subscriptions = self._peer_subscriptions.get(platform)
+            if bus_subscriptions is None:
+                continue
+            subscriptions = bus_subscriptions.get(bus)
+            if subscriptions:
+                subscribers |= subscriptions.subscribers(topic)
         if subscribers:
             #self._logger.debug("PUBSUBSERVICE: found subscribers: {}".format(subscribers))
+            serialized = {serializer.name: frames}
             for subscriber in subscribers:
-                frames[0] = zmq.Frame(subscriber)
+                name = self._peer_serializers.get(subscriber, serializers.JSON.name)
+                try:
+                    outgoing = serialized[name]
+                except KeyError:
+                    if message is None:
+                        message = serializer.loads(bytes(frames[8]))
+                    outgoing = serialized[name] = self._serialized_frames(
+                        frames, serializers.get(name), message)
+                outgoing[0] = subscriber
                 try:
                     # Send the message to the subscriber
-                    for sub in self._send(frames, publisher):
+                    for sub in self._send(outgoing, publisher):
                         # Drop the subscriber if unreachable
                         self.peer_drop(sub)
                 except ZMQError:
                     raise
+            frames[0] = publisher
         return len(subscribers)
 
     def _distribute_external(self, frames):
@@ -466,6 +562,10 @@ class PubSubService(object):
                     external_subscribers.add(platform_id)
         ##self._logger.debug("PUBSUBSERVICE External subscriptions {0}".format(external_subscribers))
         if external_subscribers:
+            serializer = self._frames_serializer(frames)
+            if serializer is not serializers.JSON:
+                # External platforms may not know other serializers
+                data = zmq.Frame(str(serializers.JSON.dumps(serializer.loads(bytes(data)))))
             frames[:] = []
             frames[0:7] = b'', proto, user_id, msg_id, subsystem, b'external_publish', topic, data
             for platform_id in external_subscribers:
@@ -511,23 +611,27 @@ class PubSubService(object):
         List of dropped recipients, if any
         """
         drop = []
-        subscriber = frames[0]
+        subscriber = bytes(frames[0])
         # Expecting outgoing frames:
         #   [RECIPIENT, SENDER, PROTO, USER_ID, MSG_ID, SUBSYS, ...]
 
         try:
-            # Try sending the message to its recipient
-            self._vip_sock.send_multipart(frames, flags=NOBLOCK, copy=False)
+            # Try sending the message to its recipient. The recipient
+            # identity is small enough that copying it is cheaper than
+            # wrapping it in a zero-copy frame. The remaining frames are
+            # sent without copying so fan-out reuses the same payload.
+            self._vip_sock.send(subscriber, flags=NOBLOCK|SNDMORE, copy=True)
+            self._vip_sock.send_multipart(frames[1:], flags=NOBLOCK, copy=False)
         except ZMQError as exc:
             try:
                 errnum, errmsg = error = _ROUTE_ERRORS[exc.errno]
             except KeyError:
                 error = None
             if exc.errno == EHOSTUNREACH:
-                self._logger.debug("Host unreachable {}".format(subscriber.bytes))
-                drop.append(bytes(subscriber))
+                self._logger.debug("Host unreachable {}".format(subscriber))
+                drop.append(subscriber)
             elif exc.errno == EAGAIN:
-                self._logger.debug("EAGAIN error {}".format(subscriber.bytes))
+                self._logger.debug("EAGAIN error {}".format(subscriber))
                 # Only send EAGAIN errors
                 proto, user_id, msg_id, subsystem = frames[2:6]
                 frames = [publisher, b'', proto, user_id, msg_id,
@@ -622,6 +726,8 @@ class PubSubService(object):
                 except IndexError:
                     #send response back -- Todo
                     return
+            elif op == b'publish_batch':
+                result = self._peer_publish_batch(frames, user_id)
             elif op == b'unsubscribe':
                 result = self._peer_unsubscribe(frames)
             elif op == b'list':
@@ -753,6 +859,7 @@ class PubSubService(object):
             publisher, receiver, proto, user_id, msg_id, subsystem, op, topic, data = frames[0:9]
             data = frames[8].bytes
             msg = jsonapi.loads(data)
+            bus = msg.get('bus')
             # Check if peer is authorized to publish the topic
             errmsg = self._check_if_protected_topic(bytes(user_id), bytes(topic))
 
@@ -769,7 +876,7 @@ class PubSubService(object):
 
             # Make it an internal publish
             frames[6] = 'publish'
-            subscribers_count = self._distribute_internal(frames)
+            subscribers_count = self._distribute_internal(frames, bus)
             # There are no subscribers, send error message back to source platform
             if subscribers_count == 0:
                 try:
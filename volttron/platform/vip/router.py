@@ -45,6 +45,7 @@ import zmq
 from zmq import Frame, NOBLOCK, ZMQError, EINVAL, EHOSTUNREACH
 
 from .pubsubservice import PubSubService
+from . import serializers
 
 __all__ = ['BaseRouter', 'OUTGOING', 'INCOMING', 'UNROUTABLE', 'ERROR']
 
@@ -55,6 +56,10 @@ ERROR = 3
 
 _log = logging.getLogger(__name__)
 
+# Version reported in the hello reply. 1.1 added the pubsub publish_batch
+# operation.
+ROUTER_VERSION = b'1.1'
+
 # Optimizing by pre-creating frames
 _ROUTE_ERRORS = {
     errnum: (zmq.Frame(str(errnum).encode('ascii')),
@@ -223,6 +228,10 @@ class BaseRouter(object):
         '''Add peers for pubsub subsystem. To be handled by subclasses'''
         pass
 
+    def _set_pubsub_serializer(self, peer, name):
+        '''Record the serializer negotiated with a peer. To be handled by subclasses'''
+        pass
+
     def _add_peer(self, peer):
         if peer in self._peers:
             return
@@ -279,8 +288,16 @@ class BaseRouter(object):
             # Handle requests directed at the router
             name = subsystem.bytes
             if name == b'hello':
+                welcome = [b'welcome', ROUTER_VERSION, socket.identity, sender]
+                if len(frames) > 7:
+                    # Newer peers offer the serializers they can use for
+                    # message payloads, most preferred first.
+                    serializer = serializers.negotiate(
+                        frames[7].bytes.split(b','))
+                    self._set_pubsub_serializer(sender.bytes, serializer.name)
+                    welcome.append(serializer.name)
                 frames = [sender, recipient, proto, user_id, msg_id,
-                          b'hello', b'welcome', b'1.0', socket.identity, sender]
+                          b'hello'] + welcome
             elif name == b'ping':
                 frames[:7] = [
                     sender, recipient, proto, user_id, msg_id, b'ping', b'pong']
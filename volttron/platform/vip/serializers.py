@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+"""Serializers for pubsub message payloads.
+
+JSON is always available and is what every peer understands. msgpack is
+used when it is installed and both the agent and the router agree on it
+in the hello exchange. Messages encoded with anything other than JSON
+carry the serializer name in an extra frame so they can always be decoded
+correctly.
+"""
+
+from __future__ import absolute_import
+
+from volttron.platform.agent import json as jsonapi
+
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+__all__ = ['JSON', 'MSGPACK', 'available', 'get', 'negotiate']
+
+
+class JSONSerializer(object):
+    name = b'json'
+
+    def dumps(self, data):
+        return jsonapi.dumps(data)
+
+    def loads(self, data):
+        return jsonapi.loads(data)
+
+
+class MsgPackSerializer(object):
+    """msgpack serializer.
+
+    Strings are decoded to unicode and tuples to lists, as they are with
+    JSON. Dictionary keys are not converted: an integer key arrives as an
+    integer, where JSON turns it into a string. Publishers whose
+    subscribers may use either serializer should use string keys.
+    """
+    name = b'msgpack'
+
+    def dumps(self, data):
+        return msgpack.packb(data, use_bin_type=False)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False, use_list=True)
+
+
+JSON = JSONSerializer()
+MSGPACK = MsgPackSerializer()
+
+_serializers = {JSON.name: JSON}
+if HAS_MSGPACK:
+    _serializers[MSGPACK.name] = MSGPACK
+
+
+def available():
+    """Return the names of the serializers usable in this process."""
+    return sorted(_serializers)
+
+
+def get(name):
+    """Return the serializer with the given name.
+
+    :raises KeyError: if the serializer is unknown or not installed
+    """
+    return _serializers[name]
+
+
+def negotiate(offered):
+    """Pick the first of the offered serializer names that is available.
+
+    Falls back to JSON if none of them are.
+    """
+    for name in offered:
+        if name in _serializers:
+            return _serializers[name]
+    return JSON
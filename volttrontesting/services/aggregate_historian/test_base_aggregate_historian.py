@@ -1,5 +1,10 @@
+import shutil
+import tempfile
+
 import pytz
-from volttron.platform.agent.base_aggregate_historian import AggregateHistorian
+from volttron.platform.agent.base_aggregate_historian import (
+    AggregateHistorian, GROUPED_AGGREGATIONS, combine_aggregates)
+from volttron.platform.dbutils.sqlitefuncts import SqlLiteFuncts
 import pytest
 from datetime import datetime, timedelta
 
@@ -191,3 +196,62 @@ def test_compute_next_collection_time():
     assert next2 == datetime.strptime(
         '2016-04-30T01:15:23.123456',
         '%Y-%m-%dT%H:%M:%S.%f').replace(tzinfo=pytz.utc)
+
+
+@pytest.mark.aggregator
+def test_grouped_aggregates_match_single_queries():
+    '''
+    Aggregates combined from one query grouped by topic must match the ones
+    computed by one query per point.
+    '''
+    tmpdir = tempfile.mkdtemp()
+    try:
+        driver = SqlLiteFuncts(
+            {'database': '{}/test.sqlite'.format(tmpdir)},
+            {'data_table': 'data', 'topics_table': 'topics',
+             'meta_table': 'meta', 'agg_topics_table': 'aggregate_topics',
+             'agg_meta_table': 'aggregate_meta', 'table_prefix': ''})
+        driver.setup_historian_tables()
+        start = datetime(2016, 3, 1, tzinfo=pytz.utc)
+        topic_ids = []
+        for i in range(4):
+            topic_id = driver.insert_topic('device/point{}'.format(i))
+            topic_ids.append(topic_id)
+            # The last topic has no data in the time slice.
+            for minute in range(10 if i < 3 else 0):
+                driver.insert_data(start + timedelta(minutes=minute),
+                                   topic_id, i * 10 + minute * 0.5)
+        driver.insert_data(start + timedelta(hours=1), topic_ids[0], 1000)
+        driver.commit()
+
+        end = start + timedelta(minutes=30)
+        topic_aggregates = driver.collect_aggregates(topic_ids, start, end)
+        assert sorted(topic_aggregates) == topic_ids[:3]
+        for point_ids in [topic_ids[:1], topic_ids[1:3], topic_ids]:
+            for agg_type in GROUPED_AGGREGATIONS:
+                assert combine_aggregates(topic_aggregates, point_ids,
+                                          agg_type) == \
+                    driver.collect_aggregate(point_ids, agg_type, start, end)
+
+        assert combine_aggregates(topic_aggregates, topic_ids[3:], 'avg') == \
+            (None, 0)
+        with pytest.raises(ValueError):
+            combine_aggregates(topic_aggregates, topic_ids, 'group_concat')
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+
+@pytest.mark.aggregator
+def test_combined_avg_skips_values_not_summed():
+    '''
+    Averages are computed over the number of values summed when
+    collect_aggregates reports it, matching a per point average that skips
+    values that are not numbers.
+    '''
+    topic_aggregates = {1: (6, 4, 1, 'on', 3), 2: (4, 1, 4, 4, 1),
+                        3: (0, 2, 'off', 'on', 0)}
+    assert combine_aggregates(topic_aggregates, [1], 'avg') == (2.0, 4)
+    assert combine_aggregates(topic_aggregates, [1, 2], 'avg') == (2.5, 5)
+    assert combine_aggregates(topic_aggregates, [1, 2, 3], 'avg') == (2.5, 7)
+    assert combine_aggregates(topic_aggregates, [3], 'avg') == (None, 2)
+    assert combine_aggregates(topic_aggregates, [1, 3], 'count') == (6, 6)
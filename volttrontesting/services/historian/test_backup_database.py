@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*- {{{
+# vim: set fenc=utf-8 ft=python sw=4 ts=4 sts=4 et:
+#
+# Copyright 2017, Battelle Memorial Institute.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# This material was prepared as an account of work sponsored by an agency of
+# the United States Government. Neither the United States Government nor the
+# United States Department of Energy, nor Battelle, nor any of their
+# employees, nor any jurisdiction or organization that has cooperated in the
+# development of these materials, makes any warranty, express or
+# implied, or assumes any legal liability or responsibility for the accuracy,
+# completeness, or usefulness or any information, apparatus, product,
+# software, or process disclosed, or represents that its use would not infringe
+# privately owned rights. Reference herein to any specific commercial product,
+# process, or service by trade name, trademark, manufacturer, or otherwise
+# does not necessarily constitute or imply its endorsement, recommendation, or
+# favoring by the United States Government or any agency thereof, or
+# Battelle Memorial Institute. The views and opinions of authors expressed
+# herein do not necessarily state or reflect those of the
+# United States Government or any agency thereof.
+#
+# PACIFIC NORTHWEST NATIONAL LABORATORY operated by
+# BATTELLE for the UNITED STATES DEPARTMENT OF ENERGY
+# under Contract DE-AC05-76RL01830
+# }}}
+
+
+import json
+import sqlite3
+from datetime import datetime
+
+import pytest
+import pytz
+
+from volttron.platform.agent.base_historian import (BackupDatabase,
+                                                    _BatchPrefetcher,
+                                                    ScrapeRecord,
+                                                    count_records,
+                                                    iter_records)
+
+
+class Owner(object):
+    pass
+
+
+@pytest.fixture()
+def backupdb(tmpdir):
+    owner = Owner()
+    with tmpdir.as_cwd():
+        db = BackupDatabase(owner, None, 0.9)
+        yield db
+        db.close()
+
+
+def make_scrape(device, count, headers, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime(2017, 1, 1, tzinfo=pytz.UTC)
+    meta = {'units': 'F', 'type': 'float', 'tz': 'UTC'}
+    return [{'source': 'scrape',
+             'topic': '{}/point{}'.format(device, i),
+             'readings': [(timestamp, float(i))],
+             'meta': meta,
+             'headers': headers} for i in range(count)]
+
+
+@pytest.mark.historian
+def test_headers_stored_once_per_publish(backupdb):
+    headers = {'Date': '2017-01-01T00:00:00+00:00'}
+    backupdb.backup_new_data(make_scrape('Building/LAB/Device', 50, headers))
+
+    c = backupdb._connection.cursor()
+    c.execute("SELECT count(*) FROM headers")
+    assert c.fetchone()[0] == 1
+    c.execute("SELECT count(DISTINCT header_id) FROM outstanding")
+    assert c.fetchone()[0] == 1
+
+    results = backupdb.get_outstanding_to_publish(100)
+    assert len(results) == 50
+    assert all(r['headers'] == headers for r in results)
+    assert results[3]['topic'] == 'Building/LAB/Device/point3'
+    assert results[3]['value'] == 3.0
+    assert results[3]['meta']['units'] == 'F'
+
+
+@pytest.mark.historian
+def test_unused_headers_removed(backupdb):
+    first = {'Date': '2017-01-01T00:00:00+00:00'}
+    second = {'Date': '2017-01-01T00:01:00+00:00'}
+    backupdb.backup_new_data(make_scrape('Building/LAB/Device', 5, first))
+    backupdb.backup_new_data(make_scrape('Building/LAB/Device', 5, second))
+
+    backupdb.get_outstanding_to_publish(5)
+    backupdb.remove_successfully_published(set([None]), 5)
+
+    c = backupdb._connection.cursor()
+    c.execute("SELECT header_string FROM headers")
+    assert [json.loads(r[0]) for r in c.fetchall()] == [second]
+
+    backupdb.get_outstanding_to_publish(5)
+    backupdb.remove_successfully_published(set([None]), 5)
+
+    c.execute("SELECT count(*) FROM headers")
+    assert c.fetchone()[0] == 0
+    assert backupdb.get_backlog_count() == 0
+
+
+@pytest.mark.historian
+def test_empty_headers_not_stored(backupdb):
+    backupdb.backup_new_data(make_scrape('Building/LAB/Device', 3, {}))
+
+    c = backupdb._connection.cursor()
+    c.execute("SELECT count(*) FROM headers")
+    assert c.fetchone()[0] == 0
+
+    results = backupdb.get_outstanding_to_publish(10)
+    assert [r['headers'] for r in results] == [{}, {}, {}]
+
+
+@pytest.mark.historian
+def test_scrape_record_cached_as_rows(tmpdir):
+    headers = {'Date': '2017-01-01T00:00:00+00:00'}
+    timestamp = datetime(2017, 1, 1, tzinfo=pytz.UTC)
+    values = {'OutsideAirTemperature': 50.0, 'DamperSignal': 10.0}
+    meta = {'OutsideAirTemperature': {'units': 'F', 'type': 'float'},
+            'DamperSignal': {'units': '%', 'type': 'float'}}
+    owner = Owner()
+    with tmpdir.as_cwd():
+        db = BackupDatabase(owner, None, 0.9, group_scrapes=True)
+        db.backup_new_data([ScrapeRecord('scrape', 'Building/LAB/Device',
+                                         timestamp, values, meta, headers),
+                            {'source': 'log',
+                             'topic': 'datalogger/Building/LAB/Meter',
+                             'readings': [(timestamp, 1.0)],
+                             'meta': {},
+                             'headers': headers}])
+        assert db.get_backlog_count() == 3
+
+        results = db.get_outstanding_to_publish(10)
+        assert len(results) == 2
+        scrape = results[0]
+        assert isinstance(scrape, ScrapeRecord)
+        assert scrape.device == 'Building/LAB/Device'
+        assert scrape.values == values
+        assert scrape.meta['DamperSignal']['units'] == '%'
+        assert count_records(results) == 3
+
+        records = list(iter_records(results))
+        assert set(r['topic'] for r in records) == set([
+            'Building/LAB/Device/OutsideAirTemperature',
+            'Building/LAB/Device/DamperSignal',
+            'datalogger/Building/LAB/Meter'])
+        assert len(set(r['_id'] for r in records)) == 3
+        assert all(r['headers'] == headers for r in records)
+        db.close()
+
+    with tmpdir.as_cwd():
+        db = BackupDatabase(owner, None, 0.9)
+        results = db.get_outstanding_to_publish(10)
+        assert len(results) == 3
+        assert not any(isinstance(r, ScrapeRecord) for r in results)
+        db.close()
+
+
+@pytest.mark.historian
+def test_outstanding_read_in_insertion_order(backupdb):
+    # Timestamps out of order. The cache is a queue so insertion order wins.
+    headers = {'Date': '2017-01-01T00:00:00+00:00'}
+    later = datetime(2017, 1, 2, tzinfo=pytz.UTC)
+    earlier = datetime(2017, 1, 1, tzinfo=pytz.UTC)
+    backupdb.backup_new_data(make_scrape('Building/LAB/Later', 3, headers,
+                                         later))
+    backupdb.backup_new_data(make_scrape('Building/LAB/Earlier', 3, headers,
+                                         earlier))
+
+    results = backupdb.get_outstanding_to_publish(4)
+    assert [r['topic'] for r in results] == ['Building/LAB/Later/point0',
+                                             'Building/LAB/Later/point1',
+                                             'Building/LAB/Later/point2',
+                                             'Building/LAB/Earlier/point0']
+
+    # Data arriving between the read and the removal must stay cached.
+    backupdb.backup_new_data(make_scrape('Building/LAB/Newer', 2, headers))
+    backupdb.remove_successfully_published(set([None]), 4)
+
+    results = backupdb.get_outstanding_to_publish(10)
+    assert [r['topic'] for r in results] == ['Building/LAB/Earlier/point1',
+                                             'Building/LAB/Earlier/point2',
+                                             'Building/LAB/Newer/point0',
+                                             'Building/LAB/Newer/point1']
+
+    backupdb.remove_successfully_published(set([results[1]['_id']]), 10)
+    results = backupdb.get_outstanding_to_publish(10)
+    assert [r['topic'] for r in results] == ['Building/LAB/Earlier/point1',
+                                             'Building/LAB/Newer/point0',
+                                             'Building/LAB/Newer/point1']
+
+
+@pytest.mark.historian
+def test_prefetcher_reads_ahead_and_rewinds(backupdb):
+    headers = {'Date': '2017-01-01T00:00:00+00:00'}
+    backupdb.backup_new_data(make_scrape('Building/LAB/Device', 7, headers))
+
+    prefetcher = _BatchPrefetcher(backupdb, 3, 2)
+    try:
+        batch, last_id = prefetcher.next_batch()
+        assert [r['topic'][-1] for r in batch] == ['0', '1', '2']
+        assert last_id == batch[-1]['_id']
+
+        # Everything in the first batch was published.
+        backupdb.remove_successfully_published(set([None]), 3,
+                                               last_outstanding_id=last_id)
+
+        batch, last_id = prefetcher.next_batch()
+        assert [r['topic'][-1] for r in batch] == ['3', '4', '5']
+
+        # Only one record handled. The rest must be read again.
+        backupdb.remove_successfully_published(set([batch[0]['_id']]), 3)
+        prefetcher.rewind()
+
+        batch, last_id = prefetcher.next_batch()
+        assert [r['topic'][-1] for r in batch] == ['4', '5', '6']
+        backupdb.remove_successfully_published(set([None]), 3,
+                                               last_outstanding_id=last_id)
+
+        assert prefetcher.next_batch() == ([], None)
+
+        backupdb.backup_new_data(make_scrape('Building/LAB/Other', 2, headers))
+        prefetcher.new_data()
+        batch, last_id = prefetcher.next_batch()
+        assert [r['topic'] for r in batch] == ['Building/LAB/Other/point0',
+                                               'Building/LAB/Other/point1']
+    finally:
+        prefetcher.stop()
+
+
+@pytest.mark.historian
+def test_prefetcher_read_error_is_not_exhaustion(backupdb):
+    headers = {'Date': '2017-01-01T00:00:00+00:00'}
+    backupdb.backup_new_data(make_scrape('Building/LAB/Device', 4, headers))
+
+    read_outstanding = backupdb.read_outstanding
+    failures = [sqlite3.OperationalError('database is locked')]
+
+    def failing_read(*args):
+        if failures:
+            raise failures.pop()
+        return read_outstanding(*args)
+    backupdb.read_outstanding = failing_read
+
+    prefetcher = _BatchPrefetcher(backupdb, 3, 2)
+    try:
+        # The error is passed on instead of reporting an empty cache.
+        with pytest.raises(sqlite3.OperationalError):
+            prefetcher.next_batch()
+
+        # The caller reads the batch itself and rewinds once it is handled.
+        batch = backupdb.get_outstanding_to_publish(3)
+        assert [r['topic'][-1] for r in batch] == ['0', '1', '2']
+        backupdb.remove_successfully_published(set([None]), 3)
+        prefetcher.rewind()
+
+        batch, last_id = prefetcher.next_batch()
+        assert [r['topic'][-1] for r in batch] == ['3']
+        backupdb.remove_successfully_published(set([None]), 3,
+                                               last_outstanding_id=last_id)
+        assert prefetcher.next_batch() == ([], None)
+    finally:
+        prefetcher.stop()
+
+
+@pytest.mark.historian
+def test_journal_mode_and_synchronous(tmpdir):
+    owner = Owner()
+    with tmpdir.as_cwd():
+        db = BackupDatabase(owner, None, 0.9, journal_mode='WAL',
+                            synchronous='NORMAL')
+        c = db._connection.cursor()
+        c.execute("PRAGMA journal_mode")
+        assert c.fetchone()[0] == 'wal'
+        c.execute("PRAGMA synchronous")
+        assert c.fetchone()[0] == 1
+
+        db.backup_new_data(make_scrape('Building/LAB/Device', 3, {}))
+        assert len(db.get_outstanding_to_publish(10)) == 3
+        db.close()
@@ -56,6 +56,7 @@ from time import sleep
 from datetime import datetime
 import random
 import gevent
+import gevent.queue
 import os
 
 class Historian(BaseHistorian):
@@ -536,3 +537,41 @@ def test_failing_historian(request, fail_historian, client_agent):
 
 
 
+
+
+@pytest.mark.historian
+def test_capture_drops_malformed_publish():
+    historian = Historian.__new__(Historian)
+    historian._topic_replace_list = []
+    historian._sync_timestamp = False
+    historian.gather_timing_data = False
+    historian._event_queue = gevent.queue.Queue()
+
+    device = 'campus/building/device'
+    topic = 'devices/' + device + '/all'
+    for message in ([1.5, {'Point': {'units': 'F'}}],
+                    [{'Point': 1.5}, 'meta'],
+                    'bad'):
+        historian._capture_data('pubsub', 'driver', '', topic, {}, message,
+                                device)
+    assert historian._event_queue.empty()
+
+    historian._capture_data('pubsub', 'driver', '', topic, {},
+                            [{'Point': 1.5}, {'Point': {'units': 'F'}}],
+                            device)
+    record = historian._event_queue.get_nowait()
+    assert (record.device, record.values) == (device, {'Point': 1.5})
+
+
+@pytest.mark.historian
+def test_paged_query_needs_paging_support():
+    historian = Historian.__new__(Historian)
+    with pytest.raises(ValueError) as excinfo:
+        historian.query('device/point', page_size=10)
+    assert str(excinfo.value) == 'paging not supported by Historian'
+
+    pages = []
+    historian.supports_paging = True
+    historian.query_historian_page = lambda *args: pages.append(args) or {}
+    assert historian.query('device/point', page_size=10) == {}
+    assert len(pages) == 1
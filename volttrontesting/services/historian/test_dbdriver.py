@@ -64,6 +64,16 @@ else:
     from volttron.platform.dbutils.postgresqlfuncts import PostgreSqlFuncts
     from volttron.platform.dbutils.redshiftfuncts import RedshiftFuncts
 
+try:
+    import mysql.connector
+
+    HAVE_MYSQL = True
+except ImportError:
+    HAVE_MYSQL = False
+else:
+    from volttron.platform.dbutils.mysqlfuncts import (batch_records,
+                                                       ROW_OVERHEAD)
+
 redshift_params = {}
 if HAVE_POSTGRESQL:
     try:
@@ -327,6 +337,90 @@ class TestSqlite(AggregationSuite):
     def test_query_topic_pattern(self, driver):
         pass
 
+    def test_query_page(self, driver):
+        id_name_map = {}
+        for topic in ['Building/LAB/Device/PageA',
+                      'Building/LAB/Device/PageB',
+                      'Building/LAB/Device/PageC']:
+            topic_id = driver.insert_topic(topic)
+            id_name_map[topic_id] = topic
+            ts = datetime(year=2015, month=5, day=14, tzinfo=pytz.UTC)
+            for value in range(7):
+                driver.insert_data(ts + timedelta(minutes=value), topic_id,
+                                   value)
+        driver.commit()
+
+        def query_pages(**kwargs):
+            pages = []
+            continuation = None
+            while True:
+                values, continuation = driver.query_page(
+                    id_name_map.keys(), id_name_map, page_size=3,
+                    continuation=continuation, **kwargs)
+                pages.append(values)
+                if not continuation:
+                    return pages
+
+        start = datetime(year=2015, month=5, day=14, minute=2, tzinfo=pytz.UTC)
+        end = datetime(year=2015, month=5, day=14, minute=5, tzinfo=pytz.UTC)
+        for kwargs in [{}, {'count': 4}, {'skip': 2},
+                       {'count': 2, 'skip': 1, 'order': 'LAST_TO_FIRST'},
+                       {'start': start, 'end': end}]:
+            pages = query_pages(**kwargs)
+            assert all(sum(len(v) for v in page.values()) <= 3
+                       for page in pages)
+            merged = {}
+            for page in pages:
+                for topic, values in page.items():
+                    merged.setdefault(topic, []).extend(values)
+            assert merged == driver.query(id_name_map.keys(), id_name_map,
+                                          **kwargs)
+
+        with pytest.raises(ValueError):
+            driver.query_page(id_name_map.keys(), id_name_map, page_size=3,
+                              continuation='not a token')
+
+    def test_bulk_insert(self, driver):
+        id_name_map = {}
+        for topic in ['Building/LAB/Device/BulkA', 'Building/LAB/Device/BulkB']:
+            id_name_map[driver.insert_topic(topic)] = topic
+        topic_a, topic_b = sorted(id_name_map)
+        ts = datetime(year=2015, month=6, day=14, microsecond=1,
+                      tzinfo=pytz.UTC)
+        later = ts + timedelta(minutes=1)
+        driver.insert_data(ts, topic_a, 'stored before')
+        driver.commit()
+
+        with driver.bulk_insert() as insert_data:
+            for topic_id, time, value in [(topic_a, ts, 1.0),
+                                          (topic_b, ts, 2.0),
+                                          (topic_a, later, 3.0),
+                                          (topic_a, later, 4.0)]:
+                assert insert_data(time, topic_id, value)
+        driver.commit()
+
+        # The last value for a timestamp and topic replaces earlier ones,
+        # whether they were in the same bulk insert or already stored.
+        assert driver.query(id_name_map.keys(), id_name_map) == {
+            id_name_map[topic_a]: [(ts.isoformat(), 1.0),
+                                   (later.isoformat(), 4.0)],
+            id_name_map[topic_b]: [(ts.isoformat(), 2.0)]}
+
+
+@pytest.mark.historian
+@pytest.mark.skipif(not HAVE_MYSQL, reason='missing mysql-connector package')
+def test_batch_records_within_max_bytes():
+    ts = '2015-06-14T00:00:00'
+    records = [(ts, 1, 'x' * 36), (ts, 2, 'x' * 36), (ts, 3, 'x' * 36),
+               (ts, 4, 'x' * 500), (ts, 5, 'x' * 36)]
+    max_bytes = 2 * (36 + ROW_OVERHEAD)
+
+    batches = list(batch_records(records, max_bytes))
+    # The oversized record goes out on its own.
+    assert [[record[1] for record in batch] for batch in batches] == \
+        [[1, 2], [3], [4], [5]]
+    assert list(batch_records([], max_bytes)) == []
+
 
 class FauxConnection:
     def __init__(self, exc_class):
@@ -0,0 +1,100 @@
+import pytest
+
+from volttron.platform.agent import json as jsonapi
+from volttron.platform.vip import serializers
+from volttron.platform.vip.agent import PubSub
+from volttron.platform.vip.agent.results import ResultsDictionary
+from volttron.platform.vip.pubsubservice import PubSubService
+from volttrontesting.utils.vip_frames import (RecordingSocket,
+                                              publish_batch_frames)
+
+
+@pytest.mark.subsystems
+def test_service_fans_out_batch_as_publishes():
+    socket = RecordingSocket()
+    service = PubSubService(socket, {}, None)
+    service._add_peer_subscription('historian', '', 'devices')
+    service._add_peer_subscription('watcher', '', 'devices/campus/rtu/all')
+
+    items = [('devices/campus/rtu/Temp', {'Date': 'now'}, [72.5, {}]),
+             ('devices/campus/rtu/all', {'Date': 'now'},
+              [{'Temp': 72.5}, {}]),
+             ('analysis/other', {}, 1)]
+    response = service.handle_subsystem(
+        publish_batch_frames('driver', items), 'driver')
+
+    # One acknowledgement for the whole batch with the total count.
+    assert bytes(response[6]) == b'request_response'
+    assert bytes(response[7]) == b'3'
+
+    delivered = [(sent[0], sent[6], sent[7], jsonapi.loads(sent[8]))
+                 for sent in socket.sent]
+    assert sorted((peer, topic) for peer, _, topic, _ in delivered) == [
+        ('historian', 'devices/campus/rtu/Temp'),
+        ('historian', 'devices/campus/rtu/all'),
+        ('watcher', 'devices/campus/rtu/all')]
+    for peer, op, topic, msg in delivered:
+        assert op == b'publish'
+        assert msg['sender'] == 'driver'
+        assert msg['bus'] == ''
+
+
+class _Core(object):
+    serializer = serializers.JSON
+
+    def __init__(self, router_version):
+        self.router_version = router_version
+
+
+class _Socket(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_vip(self, peer, subsystem, args, msg_id, copy=True):
+        self.sent.append((peer, subsystem, [bytes(arg) for arg in args],
+                          msg_id))
+
+
+def _pubsub(router_version):
+    pubsub = PubSub.__new__(PubSub)
+    core = _Core(router_version)
+    pubsub.core = lambda: core
+    pubsub.vip_socket = _Socket()
+    pubsub._results = ResultsDictionary()
+    pubsub._send_via_rpc = False
+    pubsub._parameters_needed = False
+    return pubsub
+
+
+@pytest.mark.subsystems
+def test_publish_many_sends_one_request():
+    pubsub = _pubsub('1.1')
+    items = [('devices/a', {}, 1), ('devices/b', None, 2)]
+    result = pubsub.publish_many('pubsub', items)
+
+    assert len(pubsub.vip_socket.sent) == 1
+    peer, subsystem, args, msg_id = pubsub.vip_socket.sent[0]
+    assert (subsystem, args[0]) == ('pubsub', b'publish_batch')
+    assert msg_id == result.ident
+    batch = jsonapi.loads(args[1])
+    assert [item[0] for item in batch['items']] == ['devices/a', 'devices/b']
+    assert all(item[1]['min_compatible_version'] for item in batch['items'])
+
+
+@pytest.mark.subsystems
+def test_publish_many_falls_back_for_older_routers():
+    pubsub = _pubsub('1.0')
+    results = []
+
+    def publish(peer, topic, headers=None, message=None, bus=''):
+        result = pubsub._results.next()
+        result.set(b'2')
+        results.append(topic)
+        return result
+    pubsub.publish = publish
+
+    result = pubsub.publish_many('pubsub', [('devices/a', {}, 1),
+                                            ('devices/b', {}, 2)])
+    assert result.get(timeout=1) == '4'
+    assert results == ['devices/a', 'devices/b']
+    assert not pubsub.vip_socket.sent
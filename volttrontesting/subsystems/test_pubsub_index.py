@@ -0,0 +1,137 @@
+import pytest
+
+from volttron.platform.agent import json as jsonapi
+from volttron.platform.vip.agent.subsystems.pubsub import (PubSub,
+                                                           SubscriptionIndex)
+from volttron.platform.vip import pubsubservice
+from volttron.platform.vip.pubsubservice import PubSubService
+from volttrontesting.utils.vip_frames import RecordingSocket, publish_frames
+
+
+@pytest.mark.subsystems
+def test_subscription_index_matches_prefixes():
+    index = SubscriptionIndex()
+    index[''].add('everything')
+    index['devices'].add('a')
+    index['devices/campus'].add('b')
+    index['devices/campus/building'].add('c')
+    index['record'].add('d')
+
+    assert index.subscribers('devices/campus/building/all') == \
+        {'everything', 'a', 'b', 'c'}
+    assert index.subscribers('devices/other') == {'everything', 'a'}
+    assert index.subscribers('dev') == {'everything'}
+    assert sorted(prefix for prefix, _ in index.match('record/x')) == \
+        ['', 'record']
+
+    del index['devices']
+    assert index.pop('devices/campus') == {'b'}
+    assert index.pop('missing', None) is None
+    assert index.subscribers('devices/campus/building/all') == \
+        {'everything', 'c'}
+    index.clear()
+    assert index.subscribers('devices/campus/building/all') == set()
+
+
+@pytest.mark.subsystems
+def test_subscription_index_cache_follows_changes():
+    index = SubscriptionIndex(cache_size=2)
+    index['devices'].add('a')
+    assert index.subscribers('devices/campus/all') == {'a'}
+
+    # Adding to an existing prefix is seen through the cached match.
+    index['devices'].add('b')
+    assert index.subscribers('devices/campus/all') == {'a', 'b'}
+
+    # New and removed prefixes invalidate the cache.
+    index['devices/campus'].add('c')
+    assert index.subscribers('devices/campus/all') == {'a', 'b', 'c'}
+    del index['devices']
+    assert index.subscribers('devices/campus/all') == {'c'}
+
+    # The cache is bounded.
+    for i in range(10):
+        index.match('devices/campus/device{}'.format(i))
+    assert len(index._cache) <= 2
+
+
+@pytest.mark.subsystems
+def test_agent_dispatches_through_index():
+    pubsub = PubSub.__new__(PubSub)
+    pubsub._my_subscriptions = {'internal': {'': SubscriptionIndex()},
+                                'all': {'': SubscriptionIndex()}}
+    synchronized = []
+    pubsub.synchronize = lambda: synchronized.append(True)
+    received = []
+
+    def callback(name):
+        return lambda peer, sender, bus, topic, headers, message: \
+            received.append((name, topic))
+
+    pubsub._my_subscriptions['internal']['']['devices'].add(callback('a'))
+    pubsub._my_subscriptions['all']['']['devices/campus'].add(callback('b'))
+    pubsub._my_subscriptions['internal']['']['analysis'].add(callback('c'))
+
+    pubsub._process_callback('sender', '', 'devices/campus/all', {}, None)
+    assert sorted(received) == [('a', 'devices/campus/all'),
+                                ('b', 'devices/campus/all')]
+    assert not synchronized
+
+    pubsub._process_callback('sender', '', 'record/x', {}, None)
+    assert synchronized
+
+
+@pytest.mark.subsystems
+def test_service_routes_through_index():
+    socket = RecordingSocket()
+    service = PubSubService(socket, {}, None)
+    service._add_peer_subscription('agent1', '', 'devices')
+    service._add_peer_subscription('agent2', '', 'devices/campus')
+    service._add_peer_subscription('agent3', '', 'devices/campus', 'all')
+    service._add_peer_subscription('agent4', '', 'analysis')
+    service._add_peer_subscription('agent5', 'other', 'devices')
+
+    count = service._distribute_internal(
+        publish_frames('publisher', 'devices/campus/all'))
+    assert count == 3
+    assert sorted(frames[0] for frames in socket.sent) == \
+        ['agent1', 'agent2', 'agent3']
+
+    # Dropping a peer removes it, and its now empty prefix, from the index.
+    service.peer_drop('agent2')
+    service.peer_drop('agent3')
+    del socket.sent[:]
+    count = service._distribute_internal(
+        publish_frames('publisher', 'devices/campus/all'))
+    assert count == 1
+    assert [frames[0] for frames in socket.sent] == ['agent1']
+    assert 'devices/campus' not in service._peer_subscriptions['internal']['']
+
+
+@pytest.mark.subsystems
+def test_service_fanout_decodes_once(monkeypatch):
+    socket = RecordingSocket()
+    service = PubSubService(socket, {}, None)
+    for i in range(10):
+        service._add_peer_subscription('agent{}'.format(i), '', 'devices')
+
+    decoded = []
+    loads = jsonapi.loads
+
+    def counting_loads(data):
+        decoded.append(len(data))
+        return loads(data)
+    monkeypatch.setattr(pubsubservice.jsonapi, 'loads', counting_loads)
+
+    frames = publish_frames('publisher', 'devices/campus/all',
+                            message='x' * 100000)
+    assert service._peer_publish(frames, 'publisher') == 10
+    assert len(decoded) == 1
+
+    # Every subscriber is sent the same payload frame, stamped with the
+    # publisher, and the publisher is left in place for later routing.
+    assert sorted(sent[0] for sent in socket.sent) == \
+        ['agent{}'.format(i) for i in range(10)]
+    assert len(set(id(sent[8]) for sent in socket.frames)) == 1
+    assert loads(socket.sent[0][8])['sender'] == 'publisher'
+    assert bytes(frames[0]) == 'publisher'
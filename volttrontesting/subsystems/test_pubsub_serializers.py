@@ -0,0 +1,88 @@
+import pytest
+import zmq
+
+from volttron.platform.vip import serializers
+from volttron.platform.vip.agent import PubSub
+from volttron.platform.vip.pubsubservice import PubSubService
+from volttrontesting.utils.vip_frames import (RecordingSocket,
+                                              publish_frames, received)
+
+
+@pytest.mark.subsystems
+def test_negotiate_falls_back_to_json():
+    assert serializers.negotiate([b'unknown']) is serializers.JSON
+    assert serializers.negotiate([b'unknown', b'json']) is serializers.JSON
+    with pytest.raises(KeyError):
+        serializers.get(b'unknown')
+
+
+@pytest.mark.subsystems
+def test_msgpack_round_trip_matches_json():
+    pytest.importorskip('msgpack')
+    message = [{'Temperature': 72.5, 'Status': 'ok', 'Count': 3},
+               {'Temperature': {'units': 'F', 'tz': 'UTC'}}]
+    data = dict(sender='agent', bus='', headers={'Date': 'now'},
+                message=message)
+    assert serializers.MSGPACK.loads(serializers.MSGPACK.dumps(data)) == \
+        serializers.JSON.loads(serializers.JSON.dumps(data))
+
+
+@pytest.mark.subsystems
+def test_msgpack_keeps_key_types():
+    pytest.importorskip('msgpack')
+    data = {1: 'one', 'two': 2}
+    assert serializers.MSGPACK.loads(serializers.MSGPACK.dumps(data)) == \
+        {1: u'one', u'two': 2}
+    assert serializers.JSON.loads(serializers.JSON.dumps(data)) == \
+        {u'1': u'one', u'two': 2}
+
+
+@pytest.mark.subsystems
+def test_service_encodes_for_each_subscriber():
+    pytest.importorskip('msgpack')
+    socket = RecordingSocket()
+    service = PubSubService(socket, {}, None)
+    service.set_peer_serializer('packer', serializers.MSGPACK.name)
+    service.set_peer_serializer('texter', serializers.JSON.name)
+    for peer in ('packer', 'texter', 'legacy'):
+        service._add_peer_subscription(peer, '', 'devices')
+
+    message = [{'Point': 1.5}, {'Point': {'units': 'F'}}]
+    frames = publish_frames('publisher', 'devices/all', message,
+                            headers={'Date': 'now'},
+                            serializer=serializers.MSGPACK)
+    assert service._peer_publish(frames, 'publisher') == 3
+
+    by_peer = dict((sent[0], received(sent)) for sent in socket.sent)
+    assert by_peer['packer'][0] is serializers.MSGPACK
+    assert by_peer['texter'][0] is serializers.JSON
+    assert by_peer['legacy'][0] is serializers.JSON
+    for serializer, msg in by_peer.values():
+        assert msg['sender'] == 'publisher'
+        assert msg['message'] == message
+
+    # Dropped peers go back to JSON when they reconnect.
+    service.peer_drop('packer')
+    assert 'packer' not in service._peer_serializers
+
+
+@pytest.mark.subsystems
+def test_agent_decodes_by_serializer_frame():
+    pytest.importorskip('msgpack')
+    pubsub = PubSub.__new__(PubSub)
+    received = []
+    pubsub._process_callback = lambda *args: received.append(args)
+
+    class Message(object):
+        pass
+
+    for serializer in (serializers.JSON, serializers.MSGPACK):
+        msg = Message()
+        msg.args = [zmq.Frame(b'publish'), zmq.Frame(b'devices/all'),
+                    zmq.Frame(serializer.dumps(dict(
+                        sender='publisher', bus='', headers={},
+                        message=[{'Point': 1.5}, {}])))]
+        if serializer is not serializers.JSON:
+            msg.args.append(zmq.Frame(serializer.name))
+        pubsub._process_incoming_message(msg).join()
+    assert [args[4] for args in received] == [[{'Point': 1.5}, {}]] * 2
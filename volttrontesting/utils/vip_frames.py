@@ -0,0 +1,62 @@
+"""Helpers for testing the pubsub service without a running platform.
+
+:py:class:`RecordingSocket` stands in for the router socket a
+:py:class:`~volttron.platform.vip.pubsubservice.PubSubService` sends on, and
+the frame builders make the VIP frames a peer would send to it.
+"""
+
+import zmq
+
+from volttron.platform.agent import json as jsonapi
+from volttron.platform.vip import serializers
+
+
+class RecordingSocket(object):
+    """Records every message sent, as the frames passed in and as bytes."""
+
+    def __init__(self):
+        self.sent = []
+        self.frames = []
+        self._parts = []
+
+    def send(self, data, flags=0, copy=True):
+        self._parts.append(data)
+
+    def send_multipart(self, frames, flags=0, copy=True):
+        frames = self._parts + list(frames)
+        self._parts = []
+        self.frames.append(frames)
+        self.sent.append([bytes(frame) for frame in frames])
+
+
+def vip_frames(peer, subsystem, args, msg_id=b''):
+    """Frames of a VIP message from peer, as the router receives them."""
+    return [zmq.Frame(frame) for frame in
+            [peer, b'', b'VIP1', b'', msg_id, subsystem] + list(args)]
+
+
+def publish_frames(publisher, topic, message='test', bus='', headers=None,
+                   serializer=serializers.JSON):
+    """Frames of a pubsub publish, encoded with serializer."""
+    data = serializer.dumps(dict(sender=publisher, bus=bus,
+                                 headers=headers or {}, message=message))
+    args = [b'publish', topic, data]
+    if serializer is not serializers.JSON:
+        args.append(serializer.name)
+    return vip_frames(publisher, b'pubsub', args)
+
+
+def publish_batch_frames(publisher, items, bus='', msg_id=b'id1'):
+    """Frames of a pubsub publish_batch of (topic, headers, message)
+    items."""
+    data = jsonapi.dumps(dict(bus=bus, items=items))
+    return vip_frames(publisher, b'pubsub', [b'publish_batch', data], msg_id)
+
+
+def received(sent):
+    """The serializer and the decoded message of a publish sent by the
+    service, as recorded by RecordingSocket."""
+    serializer = serializers.JSON
+    if len(sent) > 9:
+        serializer = serializers.get(sent[9])
+    return serializer, serializer.loads(sent[8])